@@ -8,7 +8,11 @@ from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 
 from community_share.config import load_app_config
+from community_share.credentials import credential_cache
 from community_share.crypt import CryptHelper
+from community_share.label_completer import label_completer
+from community_share.label_index import label_index
+from community_share.password_hashing import password_hasher
 
 Base = declarative_base()
 
@@ -70,7 +74,7 @@ class Config(object):
         # Database
         'DB_CONNECTION',
         # Email 
-        'MAILER_TYPE',  # Can be 'MAILGUN' or 'DUMMY' or 'QUEUE'
+        'MAILER_TYPE',  # Can be 'MAILGUN' or 'DUMMY' or 'QUEUE' or 'OUTBOX'
         'MAILGUN_API_KEY',
         'MAILGUN_DOMAIN',
         'DONOTREPLY_EMAIL_ADDRESS',
@@ -97,12 +101,63 @@ class Config(object):
         'WEBPACK_MANIFEST_PATH',
     }
 
+    # Optional settings and their default values.
+    # Values read from the environment are strings so convert them where used.
+    DEFAULTS = {
+        # Verified credential cache
+        'CREDENTIAL_CACHE_SIZE': 1000,
+        'CREDENTIAL_CACHE_TTL': 300,  # seconds
+        # API keys
+        'API_KEY_MODE': 'SIGNED',  # Can be 'SIGNED' or 'SECRET'
+        # Number of processes used to hash passwords, 0 hashes synchronously.
+        # Only useful with threaded web workers, see the Procfile.
+        'PASSWORD_HASH_WORKERS': 0,
+        # Seconds before the in-memory label index is rebuilt, 0 disables it.
+        'LABEL_INDEX_TTL': 300,
+        # Seconds before the label completions are rebuilt.
+        'LABEL_COMPLETER_TTL': 300,
+        # Number of matches materialized for each search.
+        'SEARCH_MATCH_LIMIT': 200,
+        # Seconds between the worker's refreshes of stale search matches.
+        'SEARCH_MATCH_REFRESH_INTERVAL': 10,
+        # Number of users recommended to each user every night.
+        'RECOMMENDATION_LIMIT': 20,
+        # Seconds a message stream stays open before the client reconnects.
+        'MESSAGE_STREAM_SECONDS': 60,
+        # Seconds between heartbeats on an idle message stream.
+        'MESSAGE_STREAM_HEARTBEAT_SECONDS': 15,
+        # Seconds a message stream token can be used to connect.
+        'MESSAGE_STREAM_TOKEN_SECONDS': 300,
+        # Seconds of recent messages a stream reads again, to find messages
+        # committed after ones with larger ids.
+        'MESSAGE_STREAM_RESCAN_SECONDS': 60,
+        # Mailgun
+        'MAILGUN_API_URL': 'https://api.mailgun.net/v2',
+        'MAILGUN_TIMEOUT_SECONDS': 10,
+        # Number of connections kept open to Mailgun.
+        'MAILGUN_POOL_SIZE': 10,
+        # How the worker delivers the outbox with the 'OUTBOX' mailer, 'MAILGUN' or 'DUMMY'.
+        'MAIL_DELIVERY': 'MAILGUN',
+        # Number of outbox emails sent at the same time.
+        'OUTBOX_WORKERS': 4,
+        # Number of outbox emails claimed at a time.
+        'OUTBOX_BATCH_SIZE': 50,
+        # Seconds before an email whose dispatcher stopped is sent again.
+        'OUTBOX_LEASE_SECONDS': 300,
+        # Seconds before a failed email is retried, doubled after each attempt.
+        'OUTBOX_RETRY_SECONDS': 30,
+        # Number of attempts before giving up on an email.
+        'OUTBOX_MAX_ATTEMPTS': 8,
+    }
+
     def load_config(self, filename):
-        data = load_app_config(self.NAMES, filename)
+        names = self.NAMES | set(self.DEFAULTS.keys())
+        data = dict(self.DEFAULTS)
+        data.update(load_app_config(names, filename))
 
-        if set(data.keys()) != self.NAMES:
-            missing_keys = self.NAMES - set(data.keys())
-            invalid_keys = set(data.keys()) - self.NAMES
+        if set(data.keys()) != names:
+            missing_keys = names - set(data.keys())
+            invalid_keys = set(data.keys()) - names
 
             sys.exit(
                 'Invalid configuration found:\n\tmissing keys: {}\n\tinvalid keys: {}'
@@ -115,6 +170,10 @@ class Config(object):
         setup_logging(self.LOGGING_LEVEL, self.LOGGING_LOCATION)
         logger.info('Setup logging with level {0}'.format(self.LOGGING_LEVEL))
         store.set_config(self)
+        credential_cache.set_config(self)
+        password_hasher.set_config(self)
+        label_index.set_config(self)
+        label_completer.set_config(self)
         self.crypt_helper = CryptHelper(config.ENCRYPTION_KEY)
 
 
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 
 from flask import jsonify, request, Response
 
@@ -54,7 +54,7 @@ def endpoint(requester: User, user_id: int) -> Response:
     user_id = int_or(user_id, None)
     fields = request.args.getlist('field')
     fields = fields if fields else None
-    user = serialize(requester, get_user(user_id), fields=fields)
+    user = serialize(requester, get_user(user_id, fields=fields), fields=fields)
 
     # if the requester is not authorized
     # to see a user, it should be opaque
@@ -76,5 +76,11 @@ def endpoint(requester: User, user_id: int) -> Response:
 
 
 @with_store
-def get_user(user_id: int, store: Store=None) -> Optional[User]:
-    return store.session.query(User).get(user_id)
+def get_user(
+    user_id: int,
+    fields: Optional[List[str]]=None,
+    store: Store=None,
+) -> Optional[User]:
+    query = store.session.query(User)
+    query = query.options(*User.projection_options(fields))
+    return query.get(user_id)
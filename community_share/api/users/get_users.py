@@ -1,18 +1,20 @@
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from iso8601 import parse_date
 
 from flask import jsonify, request, Response
 
-from sqlalchemy import true, false
+from sqlalchemy import false, func, text, true
 
 from community_share import Store
 from community_share.app_exceptions import BadRequest
 from community_share.flask_helpers import api_path, needs_auth, serialize_many, with_store
-from community_share.models.institution import Institution, InstitutionAssociation
+from community_share.models import user_search
 from community_share.models.user import User
 from community_share.utils import clamped, int_or
 
+COUNT_MODES = ('exact', 'estimate', 'none')
+
 
 @needs_auth()
 def endpoint(requester: User) -> Response:
@@ -73,12 +75,16 @@ def endpoint(requester: User) -> Response:
     :query list string field: additional fields to return, always returns user id
     :query list string match_any: field:value pairs sought in search joined as 'or'
     :query list string match_all: field:value pairs required in search joined as 'and'
+    :query string count: ``exact`` (the default) counts the results, ``estimate`` uses the
+                         database's estimate of the number of users when there are no matches
+                         to apply, and ``none`` skips counting
 
     :statuscode 200: search successful
     :statuscode 400: invalid arguments passed in
     :statuscode 401: needs authentication
 
-    :>json number count: total number of results in database for search
+    :>json number count: total number of results in database for search, or null when
+                         not counted
 
     """
     number = clamped(1, 100, int_or(request.args.get('number'), 10))
@@ -86,16 +92,28 @@ def endpoint(requester: User) -> Response:
     fields = request.args.getlist('field')
     matches_all = parse_matches(request.args.getlist('matches_all'), 'matches_all')
     matches_any = parse_matches(request.args.getlist('matches_any'), 'matches_any')
+    count_mode = request.args.get('count', 'exact')
+    if count_mode not in COUNT_MODES:
+        raise BadRequest(
+            'Invalid count given: {}\n'
+            'count should be one of {}'.format(count_mode, ', '.join(COUNT_MODES))
+        )
 
     users, count = get_users(
         number=number,
         offset=offset,
         matches_all=matches_all,
         matches_any=matches_any,
+        fields=fields,
+        count_mode=count_mode,
     )
+    if count_mode == 'exact':
+        has_next_page = offset + number < count
+    else:
+        has_next_page = len(users) == number
     users = serialize_many(requester, users, fields=fields)
 
-    next_offset = offset if count <= offset + number else offset + number
+    next_offset = offset + number if has_next_page else offset
 
     return jsonify({
         'count': count,
@@ -139,19 +157,19 @@ def get_users(
     offset: int=0,
     matches_all: Dict[str, Any]={},
     matches_any: Dict[str, Any]={},
+    fields: Optional[List[str]]=None,
+    count_mode: str='exact',
     store: Store=None,
-) -> Tuple[List[User], int]:
+) -> Tuple[List[User], Optional[int]]:
     query = store.session.query(User)
-    query = query.outerjoin(InstitutionAssociation)
-    query = query.outerjoin(Institution)
     query = query.order_by(User.id.asc())
 
     searches = {
-        'bio': lambda a: User.bio.ilike('%{}%'.format(a)),
+        'bio': lambda a: user_search.match_condition(a, fields=['bio']),
         'created_after': lambda a: User.date_created > a,
         'created_before': lambda a: User.date_created < a,
-        'institution': lambda a: Institution.name.ilike('%{}%'.format(a)),
-        'name': lambda a: User.name.ilike('%{}%'.format(a)),
+        'institution': lambda a: user_search.match_condition(a, fields=['institution']),
+        'name': lambda a: user_search.match_condition(a, fields=['name']),
     }
 
     filter_all = true()
@@ -164,11 +182,45 @@ def get_users(
         filter_any = filter_any | searches.get(name, lambda _: false())(value)
 
     query = query.filter(filter_all & filter_any if filter_any is not false() else filter_all)
-    query = query.distinct()
-    count = query.count()
-    query = query.limit(number).offset(offset)
+    query = query.options(*User.projection_options(fields))
+    page = query.limit(number).offset(offset)
+
+    count = None
+    if count_mode == 'estimate' and not matches_all and not matches_any:
+        count = estimate_count(User.__table__.name, store=store)
+    if count_mode == 'none' or count is not None:
+        users = page.all()
+    else:
+        # The total comes back on every row, so one statement gives both.
+        rows = page.add_columns(func.count().over().label('total_count')).all()
+        users = [user for user, _ in rows]
+        if rows:
+            count = rows[0].total_count
+        elif offset:
+            # Past the end there are no rows to read the total from.
+            count = query.order_by(None).count()
+        else:
+            count = 0
+
+    return users, count
+
 
-    return query, count
+@with_store
+def estimate_count(table_name: str, store: Store=None) -> Optional[int]:
+    """
+    The planner's estimate of the rows in a table, which Postgres keeps up
+    to date as it vacuums and analyzes.  None when there is no estimate.
+    """
+    estimate = None
+    if store.engine.dialect.name == 'postgresql':
+        reltuples = store.session.execute(
+            text('SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table_name)'),
+            {'table_name': '"{}"'.format(table_name)},
+        ).scalar()
+        # Tables that have never been analyzed have no estimate.
+        if reltuples is not None and reltuples > 0:
+            estimate = int(reltuples)
+    return estimate
 
 
 def parse_match(match: str, match_type: str) -> Tuple[str, Any]:
@@ -0,0 +1,75 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import time
+
+from community_share import config
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    padding = '=' * (-len(text) % 4)
+    return base64.urlsafe_b64decode((text + padding).encode('ascii'))
+
+
+def _signing_key():
+    # Derive a dedicated key so the AES key in ENCRYPTION_KEY is never used
+    # directly for signing.
+    encryption_key = config.crypt_helper.decode(config.ENCRYPTION_KEY)
+    return hmac.new(encryption_key, b'api_key', hashlib.sha256).digest()
+
+
+class SignedApiKey(object):
+    """
+    Stateless API key signed with a key derived from config.ENCRYPTION_KEY.
+
+    The key carries the user id, an expiry time and the user's api key
+    generation, so it can be verified without a database lookup.  Bumping
+    User.api_key_generation revokes every key issued before.  A key made
+    for a scope is only valid for that scope and not as an api key.
+    """
+
+    def __init__(self, key, user_id, expiration, generation, scope=None):
+        self.key = key
+        self.user_id = user_id
+        self.expiration = expiration
+        self.generation = generation
+        self.scope = scope
+
+    @classmethod
+    def make(cls, user_id, generation, hours_duration, scope=None):
+        expiration = int(time.time() + hours_duration * 3600)
+        fields = [user_id, expiration, generation]
+        if scope is not None:
+            fields.append(scope)
+        payload = _b64encode(json.dumps(fields).encode('utf8'))
+        signature = hmac.new(_signing_key(), payload.encode('ascii'), hashlib.sha256).digest()
+        key = '{}.{}'.format(payload, _b64encode(signature))
+        return cls(key, user_id, expiration, generation, scope)
+
+    @classmethod
+    def parse(cls, key, scope=None):
+        """
+        Returns the SignedApiKey for a valid, unexpired key for `scope` or None.
+        """
+        bits = key.split('.')
+        if len(bits) != 2:
+            return None
+        payload, signature = bits
+        try:
+            expected = hmac.new(_signing_key(), payload.encode('ascii'), hashlib.sha256).digest()
+            if not hmac.compare_digest(_b64decode(signature), expected):
+                return None
+            fields = json.loads(_b64decode(payload).decode('utf8'))
+            user_id, expiration, generation = fields[:3]
+            key_scope = fields[3] if len(fields) > 3 else None
+        except (binascii.Error, UnicodeError, ValueError, TypeError):
+            return None
+        if expiration < time.time() or key_scope != scope:
+            return None
+        return cls(key, user_id, expiration, generation, scope)
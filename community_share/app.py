@@ -9,6 +9,7 @@ from flask.ext.compress import Compress
 from flask_webpack import Webpack
 
 from community_share import config, store, flask_sslify
+from community_share.label_index import label_index
 from community_share.app_exceptions import BadRequest
 from community_share.routes.user_routes import register_user_routes
 from community_share.routes.search_routes import register_search_routes
@@ -68,6 +69,10 @@ def make_app():
 
     community_share.api.register_routes(app)
 
+    @app.before_first_request
+    def warm_up_label_index():
+        label_index.warm_up()
+
     @app.teardown_appcontext
     def close_db_connection(exception):
         store.session.remove()
@@ -3,6 +3,7 @@ import logging
 from flask import request
 
 from community_share import store
+from community_share.credentials import credential_cache
 from community_share.models.user import User
 
 logger = logging.getLogger(__name__)
@@ -30,7 +31,12 @@ def get_requesting_user():
             else:
                 user = store.session.query(User).filter_by(email=email, active=True).first()
                 if user is not None:
-                    if user.is_password_correct(password):
+                    # Skip the expensive hash verification for credentials
+                    # we have recently verified.
+                    if credential_cache.is_verified(user, password):
+                        authorized_user = user
+                    elif user.is_password_correct(password):
+                        credential_cache.add(user, password)
                         authorized_user = user
     if authorized_user is not None:
         if not authorized_user.active:
@@ -0,0 +1,111 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class CredentialCache(object):
+    """
+    Bounded, expiring cache of email/password pairs that have already been
+    verified against a user's password hash.
+
+    Entries are keyed by an HMAC of (email, password, password_hash) using a
+    per-process secret so plaintext passwords are never stored.  Because the
+    stored hash is part of the key, changing a password also makes any old
+    entries unreachable.
+    """
+
+    def __init__(self, max_size=1000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._secret = os.urandom(32)
+        # key -> (user_id, expires_at), oldest first
+        self._entries = OrderedDict()
+        self._keys_by_user_id = {}
+        self._lock = threading.Lock()
+
+    def set_config(self, config):
+        self.max_size = int(config.CREDENTIAL_CACHE_SIZE)
+        self.ttl = float(config.CREDENTIAL_CACHE_TTL)
+        self.clear()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 and self.ttl > 0
+
+    def _make_key(self, email, password, password_hash):
+        message = json.dumps([email, password, password_hash]).encode('utf8')
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def _remove(self, key):
+        user_id, _ = self._entries.pop(key)
+        keys = self._keys_by_user_id.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user_id[user_id]
+
+    def is_verified(self, user, password):
+        """
+        Returns True if this password was recently verified for this user.
+        """
+        if not (self.enabled and user.password_hash):
+            return False
+        key = self._make_key(user.email, password, user.password_hash)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] != user.id or entry[1] < now):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return True
+
+    def add(self, user, password):
+        if not (self.enabled and user.password_hash):
+            return
+        key = self._make_key(user.email, password, user.password_hash)
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (user.id, expires_at)
+            self._keys_by_user_id.setdefault(user.id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in list(self._keys_by_user_id.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user_id.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+            }
+
+
+credential_cache = CredentialCache()
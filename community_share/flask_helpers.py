@@ -49,19 +49,11 @@ def serialize(user, raw_item, fields=None):
     if raw_item is None:
         return None
 
-    item = raw_item.serialize(user)
-
-    if item is None:
-        return None
-
-    if fields is None:
-        return item
-
-    return {key: item[key] for key in item if key in fields + ['id']}
+    return raw_item.serialize(user, fields=fields)
 
 
 def serialize_many(user, raw_items, fields=None):
-    items = [serialize(user, item, fields) for item in raw_items]
+    items = [item.serialize(user, fields=fields) for item in raw_items if item is not None]
 
     return [item for item in items if item is not None]
 
@@ -0,0 +1,97 @@
+import math
+
+import numpy
+
+EARTH_RADIUS_MILES = 3958.8
+
+# Locations are bucketed into cells of GRID_DEGREES by GRID_DEGREES, about
+# 35 miles north to south.
+GRID_DEGREES = 0.5
+N_GRID_ROWS = int(180 / GRID_DEGREES)
+N_GRID_COLUMNS = int(360 / GRID_DEGREES)
+# Past this many cells a radius covers too much of the map for the cells to
+# narrow anything down.
+MAX_GRID_CELLS = 400
+
+
+def _grid_row(latitude):
+    return min(int(math.floor((latitude + 90) / GRID_DEGREES)), N_GRID_ROWS - 1)
+
+
+def _grid_column(longitude):
+    return int(math.floor((longitude + 180) / GRID_DEGREES)) % N_GRID_COLUMNS
+
+
+def grid_cell(latitude, longitude):
+    '''
+    The grid cell containing a location, or None if the location is unknown.
+    '''
+    cell = None
+    if latitude is not None and longitude is not None:
+        cell = _grid_row(latitude) * N_GRID_COLUMNS + _grid_column(longitude)
+    return cell
+
+
+def grid_cells_within(latitude, longitude, radius):
+    '''
+    The grid cells that hold every location within `radius` miles of a
+    location, or None if there are more than MAX_GRID_CELLS of them.
+    '''
+    latitude_span = math.degrees(radius / EARTH_RADIUS_MILES)
+    south = max(latitude - latitude_span, -90)
+    north = min(latitude + latitude_span, 90)
+    widest = max(abs(south), abs(north))
+    if widest >= 90:
+        longitude_span = 180
+    else:
+        longitude_span = latitude_span / math.cos(math.radians(widest))
+    rows = range(_grid_row(south), _grid_row(north) + 1)
+    if longitude_span >= 180:
+        columns = range(N_GRID_COLUMNS)
+    else:
+        first = int(math.floor((longitude - longitude_span + 180) / GRID_DEGREES))
+        last = int(math.floor((longitude + longitude_span + 180) / GRID_DEGREES))
+        columns = sorted({column % N_GRID_COLUMNS for column in range(first, last + 1)})
+    cells = None
+    if len(rows) * len(columns) <= MAX_GRID_CELLS:
+        cells = [row * N_GRID_COLUMNS + column for row in rows for column in columns]
+    return cells
+
+
+def haversine_distances(latitude, longitude, latitudes, longitudes):
+    '''
+    Distances in miles from a location to arrays of locations.
+    '''
+    latitude = math.radians(latitude)
+    latitudes = numpy.radians(latitudes)
+    delta_latitudes = latitudes - latitude
+    delta_longitudes = numpy.radians(longitudes) - math.radians(longitude)
+    a = (
+        numpy.sin(delta_latitudes / 2)**2 +
+        math.cos(latitude) * numpy.cos(latitudes) * numpy.sin(delta_longitudes / 2)**2
+    )
+    return 2 * EARTH_RADIUS_MILES * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1)))
+
+
+def rank_nearby(candidates, latitude, longitude, radius):
+    '''
+    Orders (id, matches, latitude, longitude, distance) candidates by most
+    matches, then by nearest, then by id.  Candidates further than `radius`
+    miles away or without a location are dropped, as are candidates further
+    than their own `distance` when they have one.
+    '''
+    ranked = []
+    if candidates:
+        columns = numpy.array([candidate[1:] for candidate in candidates], dtype=float)
+        matches, latitudes, longitudes, max_distances = columns.T
+        ids = numpy.array([candidate[0] for candidate in candidates])
+        distances = haversine_distances(latitude, longitude, latitudes, longitudes)
+        # Unknown locations and distances are NaN, which compares false.
+        with numpy.errstate(invalid='ignore'):
+            within = (distances <= radius) & (
+                ~(max_distances > 0) | (distances <= max_distances)
+            )
+        within = numpy.flatnonzero(within)
+        order = numpy.lexsort((ids[within], distances[within], -matches[within]))
+        ranked = [candidates[index][0] for index in within[order]]
+    return ranked
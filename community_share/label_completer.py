@@ -0,0 +1,194 @@
+import logging
+import threading
+import time
+
+from sqlalchemy import and_, event, func
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+logger = logging.getLogger(__name__)
+
+# Most completions kept for each prefix.
+MAX_COMPLETIONS = 50
+
+
+class _Node(object):
+    __slots__ = ('children', 'top')
+
+    def __init__(self):
+        self.children = {}
+        # Indexes into the completer's names of the most popular labels
+        # starting with this node's prefix, most popular first.
+        self.top = ()
+
+
+def _fill_top(node, own):
+    # Children are filled first so their lists can be merged.  Names are
+    # numbered by popularity, so the smallest indexes are the most popular.
+    for child in node.children.values():
+        _fill_top(child, own)
+    if len(node.children) == 1 and node not in own:
+        # Most nodes are part of a single word, and share their child's list.
+        node.top = next(iter(node.children.values())).top
+    else:
+        merged = set(own.get(node, ()))
+        for child in node.children.values():
+            merged.update(child.top)
+        node.top = tuple(sorted(merged)[:MAX_COMPLETIONS])
+
+
+def build_trie(names):
+    '''
+    A trie over `names`, normalized label names ordered most popular first,
+    that completes the start of the label or of any word in it.
+    '''
+    root = _Node()
+    own = {}
+    for index, name in enumerate(names):
+        words = name.split(' ')
+        for word_index in range(len(words)):
+            node = root
+            for character in ' '.join(words[word_index:]):
+                node = node.children.setdefault(character, _Node())
+            own.setdefault(node, []).append(index)
+    _fill_top(root, own)
+    return root
+
+
+class LabelCompleter(object):
+    """
+    In-process trie of the active labels' names for autocompletion, with
+    the labels ranked by how many active searches use them.
+
+    Label changes committed through this process rebuild the trie on the
+    next lookup.  Changes from other processes are picked up when it is
+    rebuilt in a background thread once it is older than `ttl` seconds.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._root = None
+        self._names = []
+        self.built_at = None
+        self._changed = False
+        self._rebuilding = False
+
+    def set_config(self, config):
+        with self._lock:
+            self.ttl = int(config.LABEL_COMPLETER_TTL)
+            self._reset()
+
+    def mark_changed(self):
+        self._changed = True
+
+    def rebuild(self):
+        from community_share import store
+        from community_share.models.search import Label, Search, search_label_table
+
+        start = time.time()
+        self._changed = False
+        # A session of its own so the caller's session is left alone.
+        session = store.session.session_factory()
+        try:
+            n_searches = func.count(Search.id)
+            query = session.query(Label.name, n_searches)
+            query = query.outerjoin(search_label_table, search_label_table.c.label_id == Label.id)
+            query = query.outerjoin(
+                Search,
+                and_(Search.id == search_label_table.c.search_id, Search.active == True),
+            )
+            query = query.filter(Label.active == True)
+            query = query.group_by(Label.id, Label.name)
+            query = query.order_by(n_searches.desc(), Label.normalized_name)
+            names = [name for name, _ in query]
+        finally:
+            session.close()
+        root = build_trie([Label.normalize_name(name) for name in names])
+        with self._lock:
+            self._root = root
+            self._names = names
+            self.built_at = time.time()
+        logger.info(
+            'Rebuilt label completions for {0} labels in {1:.3f} seconds'.format(
+                len(names), self.built_at - start
+            )
+        )
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Failed to rebuild label completions')
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def _refresh(self):
+        if self.built_at is None or self._changed:
+            self.rebuild()
+        else:
+            with self._lock:
+                stale = not self._rebuilding and time.time() - self.built_at > self.ttl
+                if stale:
+                    self._rebuilding = True
+            if stale:
+                thread = threading.Thread(target=self._rebuild_in_background, daemon=True)
+                thread.start()
+
+    def complete(self, prefix, number=10):
+        '''
+        The names of the `number` most popular labels starting with `prefix`,
+        or with a word starting with it.
+        '''
+        from community_share.models.search import Label
+
+        self._refresh()
+        root, names = self._root, self._names
+        node = root
+        for character in Label.normalize_name(prefix):
+            node = node.children.get(character)
+            if node is None:
+                break
+        completions = []
+        if node is not None:
+            completions = [names[index] for index in node.top[:number]]
+        return completions
+
+
+label_completer = LabelCompleter()
+
+
+def _changes_labels(session, instance):
+    from community_share.models.search import Label, Search
+
+    changes = False
+    if isinstance(instance, Label):
+        changes = True
+    elif isinstance(instance, Search):
+        # Searches count towards the popularity of their labels while active.
+        changes = instance in session.new or instance in session.deleted or any(
+            get_history(instance, fieldname).has_changes() for fieldname in ('labels', 'active')
+        )
+    return changes
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_label_changes(session, flush_context):
+    instances = list(session.new) + list(session.dirty) + list(session.deleted)
+    if any(_changes_labels(session, instance) for instance in instances):
+        session.info['label_completer_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_label_changes(session):
+    if session.info.pop('label_completer_changed', False):
+        label_completer.mark_changed()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_label_changes(session):
+    session.info.pop('label_completer_changed', None)
@@ -0,0 +1,313 @@
+import heapq
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from community_share import geo
+
+logger = logging.getLogger(__name__)
+
+
+class LabelIndex(object):
+    """
+    In-process inverted index from normalized label name to the ids of the
+    active searches using it, partitioned by (searcher_role, searching_for_role).
+
+    Searches committed through this process are indexed as they commit.
+    Searches changed by other processes are picked up when the index is
+    rebuilt, which happens in a background thread once it is older than
+    `ttl` seconds.  Matches are checked against the database before they
+    are returned, so a stale index can miss new searches but never returns
+    inactive ones.
+
+    Searches with a location are also bucketed by grid cell so searches near
+    a location can be ranked without looking at the rest.
+
+    Until the index has been built `ranked_search_ids` returns None and
+    callers fall back to SQL.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # partition -> label -> set of search ids
+        self._postings = defaultdict(lambda: defaultdict(set))
+        # partition -> grid cell -> set of search ids
+        self._cells = defaultdict(lambda: defaultdict(set))
+        # search id -> (partition, labels, location) so a search can be
+        # removed.
+        self._indexed = {}
+        self.built_at = None
+        self._rebuilding = False
+        # Updates committed while a rebuild is reading the database.
+        self._updates_during_rebuild = None
+
+    def set_config(self, config):
+        with self._lock:
+            self.ttl = int(config.LABEL_INDEX_TTL)
+            self._reset()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    @property
+    def is_warm(self):
+        return self.built_at is not None
+
+    def _remove(self, search_id):
+        indexed = self._indexed.pop(search_id, None)
+        if indexed is not None:
+            partition, labels, location = indexed
+            postings = self._postings[partition]
+            for label in labels:
+                postings[label].discard(search_id)
+                if not postings[label]:
+                    del postings[label]
+            if location is not None:
+                cells = self._cells[partition]
+                cell = geo.grid_cell(location[0], location[1])
+                cells[cell].discard(search_id)
+                if not cells[cell]:
+                    del cells[cell]
+
+    def _add(self, search_id, partition, labels, location):
+        postings = self._postings[partition]
+        for label in labels:
+            postings[label].add(search_id)
+        cell = None
+        if location is not None:
+            cell = geo.grid_cell(location[0], location[1])
+        if cell is None:
+            location = None
+        else:
+            self._cells[partition][cell].add(search_id)
+        self._indexed[search_id] = (partition, labels, location)
+
+    def _apply(self, updates):
+        for search_id, partition, active, labels, location in updates:
+            self._remove(search_id)
+            if active:
+                self._add(search_id, partition, labels, location)
+
+    def apply_updates(self, updates):
+        '''
+        Applies (search_id, (searcher_role, searching_for_role), active,
+        labels, (latitude, longitude, distance)) tuples for searches
+        committed by this process.
+        '''
+        with self._lock:
+            if self._updates_during_rebuild is not None:
+                self._updates_during_rebuild.extend(updates)
+            if self.is_warm:
+                self._apply(updates)
+
+    def rebuild(self):
+        from community_share import store
+        from community_share.models.search import Label, Search, search_label_table
+
+        start = time.time()
+        with self._lock:
+            self._updates_during_rebuild = []
+        # A session of its own so the caller's session is left alone.
+        session = store.session.session_factory()
+        try:
+            query = session.query(
+                Search.id,
+                Search.searcher_role,
+                Search.searching_for_role,
+                Label.normalized_name,
+                Search.latitude,
+                Search.longitude,
+                Search.distance,
+            )
+            query = query.join(search_label_table, search_label_table.c.search_id == Search.id)
+            query = query.join(Label, Label.id == search_label_table.c.label_id)
+            query = query.filter(Search.active == True)
+            labels_by_search = defaultdict(set)
+            partitions = {}
+            locations = {}
+            for row in query:
+                search_id, searcher_role, searching_for_role, label = row[:4]
+                labels_by_search[search_id].add(label)
+                partitions[search_id] = (searcher_role, searching_for_role)
+                locations[search_id] = row[4:]
+        except Exception:
+            with self._lock:
+                self._updates_during_rebuild = None
+            raise
+        finally:
+            session.close()
+        with self._lock:
+            self._postings = defaultdict(lambda: defaultdict(set))
+            self._cells = defaultdict(lambda: defaultdict(set))
+            self._indexed = {}
+            for search_id, labels in labels_by_search.items():
+                self._add(
+                    search_id, partitions[search_id], frozenset(labels), locations[search_id]
+                )
+            self._apply(self._updates_during_rebuild)
+            self._updates_during_rebuild = None
+            self.built_at = time.time()
+        logger.info(
+            'Rebuilt label index with {0} searches in {1:.3f} seconds'.format(
+                len(labels_by_search), self.built_at - start
+            )
+        )
+
+    def warm_up(self):
+        '''
+        Builds the index if it is enabled.  Called when a web worker starts.
+        '''
+        if self.enabled:
+            self.rebuild()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Failed to rebuild label index')
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def refresh_if_stale(self):
+        with self._lock:
+            stale = (
+                self.is_warm and not self._rebuilding and time.time() - self.built_at > self.ttl
+            )
+            if stale:
+                self._rebuilding = True
+        if stale:
+            thread = threading.Thread(target=self._rebuild_in_background, daemon=True)
+            thread.start()
+
+    def _ranked_candidates(self, labels, partition, number):
+        with self._lock:
+            postings = self._postings.get(partition, {})
+            counts = Counter()
+            for label in labels:
+                counts.update(postings.get(label, ()))
+        # Most matches first, oldest search first among equals.
+        top = heapq.nsmallest(number, counts.items(), key=lambda item: (-item[1], item[0]))
+        return [search_id for search_id, _ in top], len(counts)
+
+    def _ranked_nearby(self, labels, partition, near):
+        latitude, longitude, radius = near
+        cells = geo.grid_cells_within(latitude, longitude, radius)
+        with self._lock:
+            postings = self._postings.get(partition, {})
+            nearby = None
+            if cells is not None:
+                cell_index = self._cells.get(partition, {})
+                nearby = set().union(*(cell_index.get(cell, ()) for cell in cells))
+            counts = Counter()
+            for label in labels:
+                search_ids = postings.get(label, ())
+                if nearby is not None:
+                    search_ids = nearby.intersection(search_ids)
+                counts.update(search_ids)
+            candidates = [
+                (search_id, matches) + (self._indexed[search_id][2] or (None, None, None))
+                for search_id, matches in counts.items()
+            ]
+        return geo.rank_nearby(candidates, latitude, longitude, radius)
+
+    def ranked_search_ids(
+            self,
+            labelnames,
+            searcher_role,
+            searching_for_role,
+            offset=0,
+            number=10,
+            near=None,
+    ):
+        '''
+        Ids of the searches matching the most of `labelnames`, which are
+        normalized label names, or None when the index hasn't been built yet.
+
+        With `near`, a (latitude, longitude, radius) tuple, only searches
+        within the radius are returned and equal matches are nearest first.
+        '''
+        if not (self.enabled and self.is_warm):
+            return None
+        self.refresh_if_stale()
+        from community_share import store
+        from community_share.models.search import Search
+        from community_share.models.user import User
+
+        labels = set(labelnames)
+        partition = (searcher_role, searching_for_role)
+        wanted = offset + number
+        n_candidates = wanted
+        n_checked = 0
+        eligible = []
+        nearby = None
+        if near is not None:
+            nearby = self._ranked_nearby(labels, partition, near)
+        while True:
+            if nearby is None:
+                candidates, n_matching = self._ranked_candidates(labels, partition, n_candidates)
+            else:
+                candidates, n_matching = nearby[:n_candidates], len(nearby)
+            unchecked = candidates[n_checked:]
+            if unchecked:
+                query = store.session.query(Search.id).join(Search.searcher_user)
+                query = query.filter(Search.id.in_(unchecked))
+                query = query.filter(Search.active == True)
+                query = query.filter(Search.searcher_role == searcher_role)
+                query = query.filter(Search.searching_for_role == searching_for_role)
+                query = query.filter(User.email_confirmed == True)
+                query = query.filter(User.active == True)
+                eligible_ids = {search_id for search_id, in query}
+                eligible += [search_id for search_id in unchecked if search_id in eligible_ids]
+            n_checked = len(candidates)
+            if len(eligible) >= wanted or n_checked >= n_matching:
+                break
+            n_candidates *= 2
+        return eligible[offset:wanted]
+
+
+label_index = LabelIndex()
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_search_changes(session, flush_context):
+    from community_share.models.search import Search
+
+    changed = [
+        instance for instance in list(session.new) + list(session.dirty)
+        if isinstance(instance, Search)
+    ]
+    updates = session.info.setdefault('label_index_updates', [])
+    for search in changed:
+        updates.append((
+            search.id,
+            (search.searcher_role, search.searching_for_role),
+            # New searches can still have active unset here, it defaults to true.
+            search.active is not False,
+            frozenset(label.normalized_name for label in search.labels),
+            (search.latitude, search.longitude, search.distance),
+        ))
+    for instance in session.deleted:
+        if isinstance(instance, Search):
+            updates.append((instance.id, None, False, frozenset(), None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_search_changes(session):
+    updates = session.info.pop('label_index_updates', None)
+    if updates:
+        label_index.apply_updates(updates)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_search_changes(session):
+    session.info.pop('label_index_updates', None)
@@ -1,11 +1,17 @@
 import re
+import json
 import logging
+import threading
+import time
 import hmac, hashlib
+from collections import deque, namedtuple
 
 import html2text
 import requests
+from requests.adapters import HTTPAdapter
 
-from community_share import config
+from community_share import config, store
+from community_share.models.outbox import OutboxEmail
 
 logger = logging.getLogger(__name__)
 
@@ -29,12 +35,13 @@ def verify_email(api_key, token, timestamp, signature):
 
 
 class Email(object):
-    def __init__(self, from_address, to_address, subject, content, new_content):
+    def __init__(self, from_address, to_address, subject, content, new_content, message_id=None):
         self.from_address = from_address
         self.to_address = to_address
         self.subject = subject
         self.new_content = new_content
         self.content = content
+        self.message_id = message_id
 
     def make_reply(self, new_content):
         new_from_address = self.to_address
@@ -93,6 +100,32 @@ class Email(object):
         return links
 
 
+class BatchEmail(object):
+    '''
+    The same email to many recipients.  `recipient_variables` maps each
+    recipient's address to the values of their variables, which are
+    written %recipient.<name>% in the subject and content.
+    '''
+
+    def __init__(self, from_address, subject, content, recipient_variables):
+        self.from_address = from_address
+        self.subject = subject
+        self.content = content
+        self.recipient_variables = recipient_variables
+
+    def to_emails(self):
+        emails = []
+        for to_address, variables in sorted(self.recipient_variables.items()):
+            subject = self.subject
+            content = self.content
+            for name, value in variables.items():
+                placeholder = '%recipient.{0}%'.format(name)
+                subject = subject.replace(placeholder, str(value))
+                content = content.replace(placeholder, str(value))
+            emails.append(Email(self.from_address, to_address, subject, content, content))
+        return emails
+
+
 class QueueMailer(object):
     def __init__(self):
         self.queue = []
@@ -110,8 +143,77 @@ class DummyMailer(object):
         logger.info(text)
 
 
-class MailgunMailer(object):
+class OutboxMailer(object):
     def send(email):
+        '''
+        Adds the email to the outbox in the current transaction.  The worker
+        sends it once the transaction commits.
+        '''
+        store.session.add(OutboxEmail.from_email(email))
+        return ''
+
+    def send_batch(batch_email):
+        '''
+        Adds an email for each recipient of the batch to the outbox in the
+        current transaction.  The worker sends them in batches of up to
+        MailgunMailer.MAX_BATCH_RECIPIENTS.
+        '''
+        outbox_emails = OutboxEmail.from_batch_email(
+            batch_email, MailgunMailer.MAX_BATCH_RECIPIENTS
+        )
+        store.session.add_all(outbox_emails)
+        return ''
+
+
+BatchMetric = namedtuple('BatchMetric', ['n_recipients', 'seconds', 'status_code'])
+
+
+class MailgunMailer(object):
+    """
+    Sends through the Mailgun API over a pool of kept-alive connections,
+    and sends batches with one request for up to MAX_BATCH_RECIPIENTS
+    recipients.  The latency of the latest batches is kept in
+    `batch_metrics`.
+    """
+
+    MAX_BATCH_RECIPIENTS = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session = None
+        self.batch_metrics = deque(maxlen=100)
+
+    @property
+    def session(self):
+        # Made on first use, once the configuration is loaded.
+        with self._lock:
+            if self._session is None:
+                pool_size = int(config.MAILGUN_POOL_SIZE)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+        return self._session
+
+    def _post(self, payload):
+        response = self.session.post(
+            '{0}/{1}/messages'.format(config.MAILGUN_API_URL, config.MAILGUN_DOMAIN),
+            auth=('api', config.MAILGUN_API_KEY),
+            data=payload,
+            timeout=float(config.MAILGUN_TIMEOUT_SECONDS),
+        )
+        error_message = ''
+        if not response.ok:
+            logger.error(
+                'Mailgun API failed with status {0}: {1}'.format(
+                    response.status_code, response.text
+                )
+            )
+            error_message = 'Server failed to connect to email service.'
+        return response, error_message
+
+    def send(self, email):
         error_message = ''
         if not (email.to_address.endswith('@example.com')):
             payload = {
@@ -121,15 +223,10 @@ class MailgunMailer(object):
                 'text': html2text.html2text(email.content),
                 'html': email.content,
             }
+            if email.message_id is not None:
+                payload['h:Message-Id'] = email.message_id
             logger.info('Sending mail request to mailgun - {}'.format(payload))
-            r = requests.post(
-                'https://api.mailgun.net/v2/{0}/messages'.format(config.MAILGUN_DOMAIN),
-                auth=('api', config.MAILGUN_API_KEY),
-                data=payload,
-            )
-            if not r.ok:
-                logger.error('Mailgun API failed with message: {0}'.format(r.json()['message']))
-                error_message = 'Server failed to connect to email service.'
+            response, error_message = self._post(payload)
             text = dummy_template.format(email=email)
             logger.debug(text)
         else:
@@ -137,14 +234,97 @@ class MailgunMailer(object):
             logger.info(text)
         return error_message
 
+    def send_batch(self, batch_email):
+        '''
+        Sends a BatchEmail with one request per MAX_BATCH_RECIPIENTS
+        recipients, Mailgun filling in each recipient's variables.
+        '''
+        to_addresses = [
+            to_address for to_address in sorted(batch_email.recipient_variables)
+            if not to_address.endswith('@example.com')
+        ]
+        text = html2text.html2text(batch_email.content)
+        error_messages = []
+        for start in range(0, len(to_addresses), self.MAX_BATCH_RECIPIENTS):
+            batch = to_addresses[start:start + self.MAX_BATCH_RECIPIENTS]
+            payload = {
+                'from': batch_email.from_address,
+                'to': batch,
+                'subject': batch_email.subject,
+                'text': text,
+                'html': batch_email.content,
+                'recipient-variables': json.dumps({
+                    to_address: batch_email.recipient_variables[to_address]
+                    for to_address in batch
+                }),
+            }
+            start_time = time.time()
+            response, error_message = self._post(payload)
+            metric = BatchMetric(len(batch), time.time() - start_time, response.status_code)
+            self.batch_metrics.append(metric)
+            logger.info(
+                'Sent batch of {0} emails to mailgun in {1:.3f} seconds with status {2}'.format(
+                    *metric
+                )
+            )
+            if error_message:
+                error_messages.append(error_message)
+        return ', '.join(error_messages)
+
 
 mailer_type_to_mail = {
     'DUMMY': DummyMailer,
-    'MAILGUN': MailgunMailer,
+    'MAILGUN': MailgunMailer(),
     'QUEUE': QueueMailer(),
+    'OUTBOX': OutboxMailer,
 }
 
 
 def get_mailer():
     mailer = mailer_type_to_mail[config.MAILER_TYPE]
     return mailer
+
+
+def sends_in_transaction():
+    '''
+    True if the mailer adds emails to the outbox in the current transaction,
+    so what they are about is committed with them.  Other mailers send
+    straight away, so what emails are about is committed first.
+    '''
+    return get_mailer() is OutboxMailer
+
+
+def send_batch(batch_email):
+    '''
+    Sends a BatchEmail with the configured mailer, see deliver_batch.  The
+    outbox mailer adds it to the outbox for the worker to send.
+    '''
+    return deliver_batch(get_mailer(), batch_email)
+
+
+def deliver_batch(mailer, batch_email):
+    '''
+    Sends a BatchEmail in batches if the mailer can, and else as one email
+    for each recipient.
+    '''
+    if hasattr(mailer, 'send_batch'):
+        error_message = mailer.send_batch(batch_email)
+    else:
+        error_messages = [mailer.send(email) for email in batch_email.to_emails()]
+        error_message = ', '.join(e for e in error_messages if e)
+    return error_message
+
+
+def get_delivery_mailer():
+    '''
+    The mailer the worker delivers the outbox through.
+    '''
+    mailer = mailer_type_to_mail[config.MAIL_DELIVERY]
+    return mailer
+
+
+def receives_from_mailgun():
+    delivery = config.MAILER_TYPE
+    if delivery == 'OUTBOX':
+        delivery = config.MAIL_DELIVERY
+    return delivery == 'MAILGUN'
@@ -358,18 +358,55 @@ def send_conversation_message(message):
     return error_message
 
 
-def request_signup_email_confirmation(user, template=None, subject=None):
+def make_email_confirmation_secret(user):
     secret_info = {
         'userId': user.id,
         'email': user.email,
         'action': 'email_confirmation',
     }
     hours_duration = 24 * 14
-    secret = Secret.create_secret(secret_info, hours_duration)
+    return Secret.make(secret_info, hours_duration)
+
+
+def make_email_confirmation_url(secret):
     url = '{BASEURL}/#/confirmemail?key={secret_key}'.format(
         BASEURL=config.BASEURL,
         secret_key=secret.key,
     )
+    return url
+
+
+def request_signup_email_confirmations(users, template, subject):
+    '''
+    Sends the same email confirmation request to each of `users`, as one
+    batch with each user's link as a recipient variable.
+    '''
+    recipient_variables = {}
+    for user in users:
+        secret = make_email_confirmation_secret(user)
+        store.session.add(secret)
+        recipient_variables[user.email] = {'url': make_email_confirmation_url(secret)}
+    store.session.commit()
+    email = mail.BatchEmail(
+        from_address=config.DONOTREPLY_EMAIL_ADDRESS,
+        subject=subject,
+        content=template.format(url='%recipient.url%'),
+        recipient_variables=recipient_variables,
+    )
+    error_message = mail.send_batch(email)
+    # The outbox mailer adds the emails to the session.
+    store.session.commit()
+    return error_message
+
+
+def request_signup_email_confirmation(user, template=None, subject=None):
+    secret = make_email_confirmation_secret(user)
+    store.session.add(secret)
+    if mail.sends_in_transaction():
+        store.session.flush()
+    else:
+        store.session.commit()
+    url = make_email_confirmation_url(secret)
     if template is None:
         template = '''<p>A community share account has been created and attached to this email address.<p>
 
@@ -0,0 +1,179 @@
+'''
+A local stand-in for the Mailgun messages API, for sending mail without
+network access.  Run it and point MAILGUN_API_URL at the URL it prints:
+
+    python -m community_share.mailgun_standin --port 8025
+
+It accepts the requests MailgunMailer makes, including batches with
+recipient variables, and keeps a message for each recipient.  Like
+Mailgun, it keeps a message sent again with the same Message-Id as another
+message.  It can be told to fail or delay requests to exercise retries,
+and counts requests and connections.
+'''
+
+import argparse
+import base64
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_PATH_PATTERN = re.compile(r'^/v2/([^/]+)/messages$')
+RECIPIENT_VARIABLE_PATTERN = re.compile(r'%recipient\.(\w+)%')
+
+# Most recipients Mailgun accepts in one request.
+MAX_RECIPIENTS = 1000
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Connections are kept alive between requests, as with Mailgun.
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.standin.count_connection()
+
+    def _respond(self, status, data):
+        body = json.dumps(data).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        standin = self.server.standin
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf8'))
+        match = MESSAGES_PATH_PATTERN.match(self.path)
+        if match is None:
+            self._respond(404, {'message': 'Not found'})
+        elif not standin.is_authorized(self.headers.get('Authorization', '')):
+            self._respond(401, {'message': 'Forbidden'})
+        else:
+            status, data = standin.receive(match.group(1), form)
+            self._respond(status, data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class MailgunStandin(object):
+    def __init__(self, host='127.0.0.1', port=0, api_key=None):
+        self.api_key = api_key
+        # Seconds each request waits before being answered.
+        self.delay = 0
+        self.messages = []
+        self.n_requests = 0
+        self.n_connections = 0
+        self._lock = threading.Lock()
+        self._failures = []
+        self._server = _Server((host, port), _Handler)
+        self._server.standin = self
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{0}:{1}/v2'.format(host, port)
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        '''
+        Serves in a background thread.
+        '''
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def fail_next(self, n_requests, status=500):
+        '''
+        Answers the next `n_requests` messages with `status` without keeping them.
+        '''
+        with self._lock:
+            self._failures.extend([status] * n_requests)
+
+    def count_connection(self):
+        with self._lock:
+            self.n_connections += 1
+
+    def is_authorized(self, authorization):
+        authorized = True
+        if self.api_key is not None:
+            expected = base64.b64encode('api:{0}'.format(self.api_key).encode('utf8'))
+            authorized = authorization == 'Basic {0}'.format(expected.decode('ascii'))
+        return authorized
+
+    def receive(self, domain, form):
+        '''
+        Handles a post of `form`, with the lists of values of each field.
+        '''
+        if self.delay:
+            time.sleep(self.delay)
+        fields = {key: values[-1] for key, values in form.items()}
+        to_addresses = [
+            to_address.strip() for value in form.get('to', []) for to_address in value.split(',')
+            if to_address.strip()
+        ]
+        recipient_variables = json.loads(fields.get('recipient-variables', '{}'))
+        missing = [field for field in ('from', 'to') if not fields.get(field)]
+        if not (fields.get('text') or fields.get('html')):
+            missing.append('text')
+        with self._lock:
+            self.n_requests += 1
+            failure = self._failures.pop(0) if self._failures else None
+            if failure is not None:
+                status, data = failure, {'message': 'Service unavailable'}
+            elif missing:
+                status, data = 400, {'message': "'{0}' parameter is missing".format(missing[0])}
+            elif len(to_addresses) > MAX_RECIPIENTS:
+                status, data = 400, {'message': 'Too many recipients'}
+            else:
+                message_id = fields.get('h:Message-Id') or '<{0}@{1}>'.format(
+                    uuid.uuid4().hex, domain
+                )
+                for to_address in to_addresses:
+                    message = dict(fields, to=to_address, domain=domain, message_id=message_id)
+                    # Recipient variables are filled in as Mailgun does.
+                    variables = recipient_variables.get(to_address, {})
+                    for field in ('subject', 'text', 'html'):
+                        if field in message:
+                            message[field] = RECIPIENT_VARIABLE_PATTERN.sub(
+                                lambda match: str(variables.get(match.group(1), '')),
+                                message[field],
+                            )
+                    self.messages.append(message)
+                    logger.info('Received {0} to {1}'.format(message_id, to_address))
+                status, data = 200, {'id': message_id, 'message': 'Queued. Thank you.'}
+        return status, data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the Mailgun API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--api-key', dest='api_key', default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    standin = MailgunStandin(args.host, args.port, args.api_key)
+    print('Mailgun stand-in listening on {0}'.format(standin.url))
+    try:
+        standin.serve_forever()
+    except KeyboardInterrupt:
+        pass
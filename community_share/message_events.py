@@ -0,0 +1,274 @@
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, or_, text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# The Postgres channel new messages are announced on.
+CHANNEL = 'message_created'
+
+# Most messages sent in one go when a stream catches up.
+BATCH_SIZE = 100
+
+
+class Subscription(object):
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._event = threading.Event()
+
+    def notify(self):
+        self._event.set()
+
+    def wait(self, timeout):
+        '''
+        Waits up to `timeout` seconds for new messages.  True if there may be
+        some.
+        '''
+        notified = self._event.wait(timeout)
+        self._event.clear()
+        return notified
+
+
+class MessageBroker(object):
+    """
+    Wakes up the message streams of users when a message is added to one
+    of their conversations.
+
+    Without Postgres, messages committed through this process are published
+    after they commit, which is enough for a single process.  With Postgres,
+    new messages are announced with NOTIFY in the transaction that adds them,
+    so the announcement is delivered when it commits, and a thread in each
+    process LISTENs and publishes them, wherever they were committed.
+
+    Streams are only woken up.  They read the messages themselves, so a
+    missed wake up delays messages until the next heartbeat rather than
+    losing them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # user id -> subscriptions
+        self._subscriptions = defaultdict(set)
+        self._listener = None
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        self._start_listener()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def publish(self, user_ids):
+        with self._lock:
+            subscriptions = [
+                subscription for user_id in user_ids
+                for subscription in self._subscriptions.get(user_id, ())
+            ]
+        for subscription in subscriptions:
+            subscription.notify()
+
+    def _start_listener(self):
+        from community_share import store
+
+        if store.engine.dialect.name == 'postgresql':
+            with self._lock:
+                if self._listener is None:
+                    self._listener = threading.Thread(target=self._listen, daemon=True)
+                    self._listener.start()
+
+    def _listen(self):
+        from community_share import store
+
+        while True:
+            connection = None
+            try:
+                connection = store.engine.raw_connection()
+                # Notifications are only delivered outside transactions.
+                connection.connection.set_isolation_level(0)
+                cursor = connection.cursor()
+                cursor.execute('LISTEN {0}'.format(CHANNEL))
+                logger.info('Listening for new messages')
+                while True:
+                    if select.select([connection.connection], [], [], 60) != ([], [], []):
+                        connection.connection.poll()
+                        notifies = connection.connection.notifies
+                        user_ids = set()
+                        while notifies:
+                            payload = json.loads(notifies.pop(0).payload)
+                            user_ids.update(payload['user_ids'])
+                        self.publish(user_ids)
+            except Exception:
+                logger.exception('Lost the connection listening for new messages')
+                time.sleep(5)
+            finally:
+                if connection is not None:
+                    connection.invalidate()
+
+
+message_broker = MessageBroker()
+
+
+def _conversation_user_ids(session, messages):
+    from community_share.models.conversation import Conversation
+
+    conversation_ids = {message.conversation_id for message in messages}
+    query = session.query(Conversation.userA_id, Conversation.userB_id)
+    query = query.filter(Conversation.id.in_(conversation_ids))
+    return {user_id for user_ids in query for user_id in user_ids}
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_new_messages(session, flush_context):
+    from community_share.models.conversation import Message
+
+    messages = [instance for instance in session.new if isinstance(instance, Message)]
+    if messages:
+        user_ids = _conversation_user_ids(session, messages)
+        if session.get_bind().dialect.name == 'postgresql':
+            # Delivered to the listeners when the transaction commits.
+            session.execute(
+                text('SELECT pg_notify(:channel, :payload)'),
+                {'channel': CHANNEL, 'payload': json.dumps({'user_ids': sorted(user_ids)})},
+            )
+        else:
+            session.info.setdefault('message_event_user_ids', set()).update(user_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_new_messages(session):
+    user_ids = session.info.pop('message_event_user_ids', None)
+    if user_ids:
+        message_broker.publish(user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_new_messages(session):
+    session.info.pop('message_event_user_ids', None)
+
+
+def get_new_messages(user_id, after_id, seen_ids=(), since=None, limit=BATCH_SIZE):
+    '''
+    Messages in the user's conversations, oldest first, with ids after
+    `after_id` or created since `since`, except those in `seen_ids`.
+
+    Ids are taken when messages are added but messages are only read once
+    they commit, so one can be read after a message with a larger id.
+    Reading recent messages again finds those committed late.
+    '''
+    from community_share import store
+    from community_share.models.conversation import Message
+
+    query = store.session.query(Message).filter(
+        Message.conversation_id.in_(_user_conversation_ids(user_id))
+    )
+    condition = Message.id > after_id
+    if since is not None:
+        condition = or_(condition, Message.date_created >= since)
+    query = query.filter(condition)
+    if seen_ids:
+        query = query.filter(~Message.id.in_(list(seen_ids)))
+    return query.order_by(Message.id).limit(limit).all()
+
+
+def get_recent_messages(user_id, up_to_id, since):
+    '''
+    The dates of the messages in the user's conversations, by id, with ids
+    up to `up_to_id` and created since `since`.
+    '''
+    from community_share import store
+    from community_share.models.conversation import Message
+
+    query = store.session.query(Message.id, Message.date_created).filter(
+        Message.conversation_id.in_(_user_conversation_ids(user_id)),
+        Message.id <= up_to_id,
+        Message.date_created >= since,
+    )
+    return dict(query)
+
+
+def get_last_message_id(user_id):
+    from community_share import store
+    from community_share.models.conversation import Message
+
+    query = store.session.query(func.max(Message.id))
+    return query.filter(Message.conversation_id.in_(_user_conversation_ids(user_id))).scalar() or 0
+
+
+def _user_conversation_ids(user_id):
+    from community_share import store
+    from community_share.models.conversation import Conversation
+
+    return store.session.query(Conversation.id).filter(
+        or_(Conversation.userA_id == user_id, Conversation.userB_id == user_id)
+    )
+
+
+def stream_messages(user_id, last_event_id=None):
+    '''
+    Yields server-sent events with the messages added to the user's
+    conversations after the message `last_event_id`, or after connecting,
+    with a comment as a heartbeat while there are none.  The stream ends
+    after config.MESSAGE_STREAM_SECONDS and clients reconnect with the id of
+    the last event they saw.
+
+    Messages created in the last config.MESSAGE_STREAM_RESCAN_SECONDS are
+    read again, so messages committed later than that after they were added
+    can still be missed.  After a reconnect those recent messages are sent
+    again, so clients skip messages whose ids they already have.
+    '''
+    from flask import json as flask_json
+
+    from community_share import config, store
+    from community_share.models.user import User
+
+    heartbeat = float(config.MESSAGE_STREAM_HEARTBEAT_SECONDS)
+    rescan = timedelta(seconds=float(config.MESSAGE_STREAM_RESCAN_SECONDS))
+    deadline = time.time() + float(config.MESSAGE_STREAM_SECONDS)
+    subscription = message_broker.subscribe(user_id)
+    try:
+        # The dates of the recent messages sent, by id.
+        seen = {}
+        if last_event_id is None:
+            last_event_id = get_last_message_id(user_id)
+            seen = get_recent_messages(user_id, last_event_id, datetime.utcnow() - rescan)
+        yield 'retry: {0}\n\n'.format(int(heartbeat * 1000))
+        while True:
+            since = datetime.utcnow() - rescan
+            # Older messages are not read again.
+            seen = {
+                message_id: date_created for message_id, date_created in seen.items()
+                if date_created >= since
+            }
+            messages = get_new_messages(user_id, last_event_id, seen, since)
+            if messages:
+                requester = store.session.query(User).get(user_id)
+                for message in messages:
+                    seen[message.id] = message.date_created
+                    last_event_id = max(last_event_id, message.id)
+                    serialized = flask_json.dumps(message.serialize(requester))
+                    yield 'id: {0}\nevent: message\ndata: {1}\n\n'.format(
+                        last_event_id, serialized
+                    )
+            # Connections aren't held while waiting.
+            store.session.remove()
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            if len(messages) < BATCH_SIZE and not subscription.wait(min(heartbeat, remaining)):
+                yield ': heartbeat\n\n'
+    finally:
+        message_broker.unsubscribe(subscription)
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String
 
 from community_share import Base
 from community_share.models.user import User
@@ -15,6 +15,11 @@ class PageView(Base):
     next_path = Column('next_path', String(255))
     prev_path = Column('prev_path', String(255))
 
+    __table_args__ = (
+        Index('ix_page_views_user_id', user_id),
+        Index('ix_page_views_viewed_at', viewed_at),
+    )
+
     def __init__(self, user_id, next_path, prev_path):
         self.user_id = user_id
         self.viewed_at = datetime.utcnow()
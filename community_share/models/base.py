@@ -1,15 +1,21 @@
 import logging
 import datetime
+import operator
 import dateutil
 from dateutil import parser
 from typing import Any, Dict, List, Optional
 
-from sqlalchemy import Column, String, DateTime, Boolean
+from sqlalchemy import Column, String, DateTime, Boolean, and_, case, inspect, or_, orm, text
 
 from community_share import Base, store
+from community_share.utils import clamped
 
 logger = logging.getLogger(__name__)
 
+_eager_load_options_cache = {}
+_projection_options_cache = {}
+_serializer_plans_cache = {}
+
 
 class ValidationException(Exception):
     pass
@@ -45,6 +51,42 @@ class Serializable(object):
     def has_admin_rights(self, requester):
         return (requester is not None and requester.is_administrator)
 
+    @classmethod
+    def rights_conditions(cls, requester):
+        '''
+        SQL conditions on the rows `requester` has standard and admin rights
+        to, matching `has_standard_rights` and `has_admin_rights`, so lists
+        only load readable rows and resolve rights once for all of them.
+        None when rights can only be checked on each item.
+        '''
+        return None
+
+    @classmethod
+    def resolve_roles(cls, items, requester):
+        '''
+        The role `requester` has on each of `items`, 'admin', 'standard' or
+        None, keyed by id and read with one query.  None when the class
+        doesn't declare `rights_conditions`.
+        '''
+        conditions = cls.rights_conditions(requester)
+        roles = None
+        if conditions is not None:
+            standard_condition, admin_condition = conditions
+            roles = {}
+            item_ids = [item.id for item in items]
+            if item_ids:
+                is_admin = case([(admin_condition, True)], else_=False)
+                is_standard = case([(standard_condition, True)], else_=False)
+                query = store.session.query(cls.id, is_admin, is_standard)
+                for item_id, admin, standard in query.filter(cls.id.in_(item_ids)):
+                    if admin:
+                        roles[item_id] = 'admin'
+                    elif standard:
+                        roles[item_id] = 'standard'
+                    else:
+                        roles[item_id] = None
+        return roles
+
     def has_delete_rights(self, requester):
         has_rights = False
         if requester is not None:
@@ -56,28 +98,227 @@ class Serializable(object):
 
     custom_serializers = {}
 
-    def serialize(self, requester, exclude: List[str] = []) -> Optional[Dict[str, Any]]:
+    # Fields left out when a custom serializer serializes a related item,
+    # keyed by the name of the relationship.
+    NESTED_EXCLUDES = {}
+
+    # Relationships nested deeper than this are left to lazy loading.
+    EAGER_LOAD_MAX_DEPTH = 4
+
+    @classmethod
+    def _serialized_relationships(cls, exclude=()):
+        '''
+        Relationships read by `serialize`, either directly or through a custom
+        serializer of the same name.
+        '''
+        mapper = inspect(cls, raiseerr=False)
+        if mapper is None:
+            return []
+        fieldnames = (
+            set(cls.STANDARD_READABLE_FIELDS) | set(cls.ADMIN_READABLE_FIELDS)
+        ) - set(exclude)
+        return [
+            prop for key, prop in sorted(mapper.relationships.items()) if key in fieldnames
+        ]
+
+    @classmethod
+    def _eager_load_paths(cls, path=(), exclude=()):
+        for prop in cls._serialized_relationships(exclude):
+            if prop in path:
+                continue
+            new_path = path + (prop, )
+            yield new_path
+            target = prop.mapper.class_
+            if (len(new_path) < cls.EAGER_LOAD_MAX_DEPTH and
+                    issubclass(target, Serializable)):
+                nested_exclude = cls.NESTED_EXCLUDES.get(prop.key, ())
+                for sub_path in target._eager_load_paths(new_path, nested_exclude):
+                    yield sub_path
+
+    @staticmethod
+    def _eager_load_option(path):
+        option = None
+        for prop in path:
+            attribute = getattr(prop.parent.class_, prop.key)
+            strategy = 'subqueryload' if prop.uselist else 'joinedload'
+            if option is None:
+                option = getattr(orm, strategy)(attribute)
+            else:
+                option = getattr(option, strategy)(attribute)
+        return option
+
+    @classmethod
+    def eager_load_options(cls, exclude=()):
+        '''
+        Loader options that load every relationship read by `serialize` up
+        front so serializing a list of items issues a constant number of
+        queries.  Collections are loaded with a subquery and single items
+        with a join.  Relationships in `exclude` aren't loaded.
+        '''
+        key = (cls, tuple(sorted(exclude)))
+        options = _eager_load_options_cache.get(key)
+        if options is None:
+            options = [
+                cls._eager_load_option(path) for path in cls._eager_load_paths(exclude=exclude)
+            ]
+            _eager_load_options_cache[key] = options
+        return options
+
+    # Attributes read by a serialized field, for fields that don't just read
+    # the attribute of the same name.
+    FIELD_DEPENDENCIES = {}
+
+    @classmethod
+    def projection_options(cls, fields=None):
+        '''
+        Loader options for serializing only `fields`.  Only the columns and
+        relationships those fields read are loaded, the rest of the columns
+        are deferred and the rest of the relationships are left alone.
+        With no fields this is `eager_load_options`.
+        '''
+        if fields is None:
+            return cls.eager_load_options()
+        # Unknown fields are dropped first so request arguments can't grow the
+        # cache without bound.
+        readable = set(cls.ADMIN_READABLE_FIELDS) | set(cls.STANDARD_READABLE_FIELDS)
+        fields = readable.intersection(fields)
+        key = (cls, frozenset(fields))
+        options = _projection_options_cache.get(key)
+        if options is None:
+            mapper = inspect(cls)
+            column_keys = {
+                mapper.get_property_by_column(column).key
+                for column in mapper.primary_key
+            }
+            relationship_keys = set()
+            for fieldname in fields:
+                for attribute in cls.FIELD_DEPENDENCIES.get(fieldname, [fieldname]):
+                    if attribute in mapper.relationships:
+                        relationship_keys.add(attribute)
+                        prop = mapper.relationships[attribute]
+                        column_keys |= {
+                            mapper.get_property_by_column(column).key
+                            for column in prop.local_columns
+                        }
+                    elif attribute in mapper.column_attrs:
+                        column_keys.add(attribute)
+            options = [orm.load_only(*sorted(column_keys))]
+            options += [
+                cls._eager_load_option(path) for path in cls._eager_load_paths()
+                if path[0].key in relationship_keys
+            ]
+            _projection_options_cache[key] = options
+        return options
+
+    @classmethod
+    def _serializer_plan(cls, role, exclude=(), fields=None):
+        '''
+        Compiles the fields readable by `role` into attribute getters and
+        custom serializers. Plans are cached per class, role, exclude and
+        fields, so serializing a list of items only looks fields up once.
+        '''
+        if fields is not None:
+            # Unknown fields are dropped first so request arguments can't grow
+            # the cache without bound.
+            readable = set(cls.ADMIN_READABLE_FIELDS) | set(cls.STANDARD_READABLE_FIELDS)
+            fields = tuple(sorted(readable.intersection(fields)))
+        key = (cls, role, tuple(exclude), fields)
+        plan = _serializer_plans_cache.get(key)
+        if plan is None:
+            if role == 'admin':
+                fieldnames = set(cls.ADMIN_READABLE_FIELDS)
+            else:
+                fieldnames = set(cls.STANDARD_READABLE_FIELDS)
+            fieldnames -= set(exclude)
+            if fields is not None:
+                fieldnames &= set(fields)
+            if hasattr(cls, 'id'):
+                fieldnames.add('id')
+            getters = []
+            serializers = []
+            for fieldname in sorted(fieldnames):
+                if fieldname in cls.custom_serializers:
+                    serializers.append((fieldname, cls.custom_serializers[fieldname]))
+                else:
+                    getters.append((fieldname, operator.attrgetter(fieldname)))
+            plan = (tuple(getters), tuple(serializers))
+            _serializer_plans_cache[key] = plan
+        return plan
+
+    # Fields that can be serialized differently when asked for with
+    # expand=<field>:<argument>.  Maps the field to a function parsing the
+    # argument, raising ValueError if it is invalid, and a function taking
+    # the item, the requester and the parsed argument.
+    EXPANSIONS = {}
+
+    @classmethod
+    def parse_expand(cls, values):
+        '''
+        Parses expand arguments of the form <field>:<argument> into a dict
+        from field to parsed argument.
+        '''
+        expand = {}
+        for value in values:
+            fieldname, _, argument = value.partition(':')
+            if fieldname not in cls.EXPANSIONS:
+                raise ValueError('{0} can not be expanded'.format(fieldname))
+            parse_argument, _ = cls.EXPANSIONS[fieldname]
+            expand[fieldname] = parse_argument(argument)
+        return expand
+
+    @classmethod
+    def prefetch_expansions(cls, items, expand):
+        '''
+        Loads what expanding `items` needs in bulk.  Does nothing by default.
+        '''
+        pass
+
+    def serialize(
+            self,
+            requester,
+            exclude: List[str] = [],
+            fields: Optional[List[str]] = None,
+            expand: Optional[Dict[str, Any]] = None,
+            role: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
         """
         Serializes readable fields by user role
 
         :param requester: user requesting data
         :param exclude: optional list of fields by name to exclude
+        :param fields: optional list of fields by name to restrict to, the id is always included
+        :param expand: optional parsed expand arguments, from `parse_expand`
+        :param role: optional role of the requester, from `resolve_roles`, to skip checking rights
         :return: readable fields for user or None if no permission
         """
-        if self.has_admin_rights(requester):
-            fieldnames = self.ADMIN_READABLE_FIELDS
-        elif self.has_standard_rights(requester):
-            fieldnames = self.STANDARD_READABLE_FIELDS
-        else:
-            return None
+        if role is None:
+            if self.has_admin_rights(requester):
+                role = 'admin'
+            elif self.has_standard_rights(requester):
+                role = 'standard'
+            else:
+                return None
 
-        return {
-            key: (
-                self.custom_serializers[key](self, requester)
-                if key in self.custom_serializers else getattr(self, key)
-            )
-            for key in (set(fieldnames) - set(exclude)) | ({'id'} if hasattr(self, 'id') else set())
-        }
+        expanded = []
+        if expand:
+            if role == 'admin':
+                readable = self.ADMIN_READABLE_FIELDS
+            else:
+                readable = self.STANDARD_READABLE_FIELDS
+            expanded = [
+                fieldname for fieldname in sorted(expand)
+                if fieldname in readable and fieldname not in exclude and
+                (fields is None or fieldname in fields)
+            ]
+            exclude = list(exclude) + expanded
+        getters, serializers = self._serializer_plan(role, exclude, fields)
+        serialized = {fieldname: getter(self) for fieldname, getter in getters}
+        for fieldname, serializer in serializers:
+            serialized[fieldname] = serializer(self, requester)
+        for fieldname in expanded:
+            _, expander = self.EXPANSIONS[fieldname]
+            serialized[fieldname] = expander(self, requester, expand[fieldname])
+        return serialized
 
     def delete(self, requester):
         previously_deleted = not self.active
@@ -145,6 +386,110 @@ class Serializable(object):
             item = cls.admin_deserialize_add(data)
         return item
 
+    @classmethod
+    def bulk_get_or_create(cls, key, rows):
+        '''
+        The instances whose `key` column has the values in `rows`, dicts of
+        column values, as a dict from key value to instance.  Rows whose key
+        doesn't exist yet are inserted, leaving existing ones unchanged, and
+        the first row is used when several have the same key.
+
+        Only conflicts on `key` are ignored, other constraint violations
+        raise IntegrityError.  On Postgres this is one statement, and
+        concurrent callers inserting the same key don't fail on the unique
+        constraint.
+        '''
+        table = cls.__table__
+        key_column = table.c[key]
+        rows_by_key = {}
+        for row in rows:
+            rows_by_key.setdefault(row[key], row)
+        instances = {}
+        if rows_by_key:
+            # Every row needs the same columns.  The statements are text so
+            # the columns' Python defaults are filled in here.
+            columns = set().union(*rows_by_key.values())
+            defaults = {}
+            for column in table.c:
+                default = column.default
+                if default is None or default.is_sequence:
+                    continue
+                if not (default.is_scalar or default.is_callable):
+                    raise ValueError(
+                        'Column {0} has a SQL expression default'.format(column.key)
+                    )
+                defaults[column.key] = default
+                columns.add(column.key)
+            rows = []
+            for row in rows_by_key.values():
+                values = {}
+                for column in columns:
+                    if column in row:
+                        values[column] = row[column]
+                    elif column in defaults:
+                        default = defaults[column]
+                        # Callable defaults are wrapped to take an execution context.
+                        values[column] = default.arg(None) if default.is_callable else default.arg
+                    else:
+                        values[column] = None
+                rows.append(values)
+            keys = list(rows_by_key)
+            params = {
+                '{0}_{1}'.format(column, index): value
+                for index, row in enumerate(rows) for column, value in row.items()
+            }
+            if store.engine.dialect.name == 'postgresql':
+                query = store.session.query(cls).from_statement(cls._upsert_statement(key, rows))
+                query = query.params(**params)
+                instances = {getattr(instance, key): instance for instance in query}
+            else:
+                store.session.execute(text(cls._insert_statement(key, rows)), params)
+            # Postgres doesn't return rows committed by others while the
+            # statement ran, so those are read separately as on SQLite.
+            missing = [value for value in keys if value not in instances]
+            if missing:
+                query = store.session.query(cls).filter(key_column.in_(missing))
+                instances.update((getattr(instance, key), instance) for instance in query)
+        return instances
+
+    @classmethod
+    def _insert_statement(cls, key, rows):
+        # Inserts the rows whose key doesn't exist.  Parameters are named
+        # <column>_<row index>.
+        preparer = store.engine.dialect.identifier_preparer
+        columns = sorted(rows[0])
+        values = ', '.join(
+            '({0})'.format(', '.join(':{0}_{1}'.format(column, index) for column in columns))
+            for index in range(len(rows))
+        )
+        statement = (
+            'INSERT INTO {table} ({columns}) VALUES {values} '
+            'ON CONFLICT ({key}) DO NOTHING'
+        ).format(
+            table=preparer.format_table(cls.__table__),
+            columns=', '.join(preparer.quote(column) for column in columns),
+            values=values,
+            key=preparer.quote(key),
+        )
+        return statement
+
+    @classmethod
+    def _upsert_statement(cls, key, rows):
+        # Postgres only.  The select doesn't see the rows the insert adds, so
+        # nothing is returned twice.
+        preparer = store.engine.dialect.identifier_preparer
+        statement = (
+            'WITH inserted AS ({insert} RETURNING *) '
+            'SELECT * FROM inserted UNION ALL '
+            'SELECT * FROM {table} WHERE {key} IN ({keys})'
+        ).format(
+            insert=cls._insert_statement(key, rows),
+            table=preparer.format_table(cls.__table__),
+            key=preparer.quote(key),
+            keys=', '.join(':{0}_{1}'.format(key, index) for index in range(len(rows))),
+        )
+        return text(statement)
+
     CONDITION_MAPPING = {
         'greaterthanorequal': lambda x, y: (x >= y),
         'greaterthan': lambda x, y: (x > y),
@@ -152,10 +497,75 @@ class Serializable(object):
         'lessthan': lambda x, y: (x < y),
     }
 
+    # Columns list endpoints can be ordered by. Keyset pagination compares
+    # against them so they should not be nullable.
+    ORDER_BY_FIELDS = ['id']
+    DEFAULT_ORDER_BY = 'id'
+    DEFAULT_PAGE_LIMIT = 100
+    MAX_PAGE_LIMIT = 1000
+    PAGINATION_ARGS = ('limit', 'after_id', 'order_by', 'unpaged')
+
+    @classmethod
+    def paginate_query(cls, query, args):
+        '''
+        Applies keyset pagination from the request arguments.
+
+        `order_by` names one of ORDER_BY_FIELDS, prefixed with '-' for
+        descending order, and ties are broken by id.  `after_id` is the id
+        of the last item on the previous page.  `unpaged=true` leaves the
+        query unbounded.
+
+        Returns the query, which fetches one item more than the page so
+        the caller can tell whether there is a next page, and the limit,
+        which is None when unpaged.
+        '''
+        if args.get('unpaged', None) == 'true':
+            return query, None
+        try:
+            limit = int(args.get('limit', cls.DEFAULT_PAGE_LIMIT))
+        except ValueError:
+            raise ValueError('limit must be an integer')
+        limit = clamped(1, cls.MAX_PAGE_LIMIT, limit)
+        order_by = args.get('order_by', cls.DEFAULT_ORDER_BY)
+        descending = order_by.startswith('-')
+        fieldname = order_by.lstrip('-')
+        if fieldname not in cls.ORDER_BY_FIELDS:
+            raise ValueError('Cannot order by {0}'.format(fieldname))
+        column = getattr(cls, fieldname)
+        after_id = args.get('after_id', None)
+        if after_id is not None:
+            try:
+                after_id = int(after_id)
+            except ValueError:
+                raise ValueError('after_id must be an integer')
+            if descending:
+                id_condition = cls.id < after_id
+            else:
+                id_condition = cls.id > after_id
+            if fieldname == 'id':
+                condition = id_condition
+            else:
+                after_value = store.session.query(column).filter(cls.id == after_id).as_scalar()
+                if descending:
+                    column_condition = column < after_value
+                else:
+                    column_condition = column > after_value
+                condition = or_(column_condition, and_(column == after_value, id_condition))
+            query = query.filter(condition)
+        if descending:
+            ordering = [column.desc(), cls.id.desc()]
+        else:
+            ordering = [column.asc(), cls.id.asc()]
+        query = query.order_by(None).order_by(*ordering)
+        query = query.limit(limit + 1)
+        return query, limit
+
     @classmethod
     def _args_to_filter_params(cls, args):
         filter_args = [(cls.active == True)]
         for key in args.keys():
+            if key in cls.PAGINATION_ARGS:
+                continue
             bits = key.split('.')
             if hasattr(cls, bits[0]):
                 if len(bits) > 2:
@@ -192,6 +602,10 @@ class Serializable(object):
     @classmethod
     def _args_to_query(cls, args, requester=None):
         filter_args = cls._args_to_filter_params(args)
+        conditions = cls.rights_conditions(requester)
+        if conditions is not None:
+            # Rows the requester can't read aren't loaded.
+            filter_args.append(or_(*conditions))
         query = store.session.query(cls).filter(*filter_args)
         return query
 
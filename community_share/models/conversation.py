@@ -2,9 +2,10 @@ import logging
 from datetime import datetime
 import re
 
-from sqlalchemy import Column, Integer, Boolean, DateTime, Table, ForeignKey
-from sqlalchemy import String, or_, and_
-from sqlalchemy.orm import relationship, validates
+from sqlalchemy import Column, Integer, Boolean, DateTime, Table, ForeignKey, Index
+from sqlalchemy import String, or_, and_, case, event, false, func, select, true
+from sqlalchemy.orm import Session, contains_eager, relationship, validates
+from sqlalchemy.orm.attributes import get_history
 
 from community_share import store, Base, mail_actions, config
 from community_share.models.base import Serializable
@@ -50,6 +51,8 @@ class Conversation(Base, Serializable):
         'admin_can_delete': False
     }
 
+    ORDER_BY_FIELDS = ['id', 'date_created']
+
     id = Column(Integer, primary_key=True)
     active = Column(Boolean, default=True, nullable=False)
     date_created = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -58,6 +61,12 @@ class Conversation(Base, Serializable):
     userA_id = Column(Integer, ForeignKey('user.id'), nullable=False)
     userB_id = Column(Integer, ForeignKey('user.id'), nullable=False)
 
+    __table_args__ = (
+        Index('ix_conversation_userA_id', userA_id),
+        Index('ix_conversation_userB_id', userB_id),
+        Index('ix_conversation_date_created', date_created),
+    )
+
     messages = relationship('Message', order_by="Message.date_created")
     userA = relationship('User', primaryjoin='Conversation.userA_id == User.id')
     userB = relationship('User', primaryjoin='Conversation.userB_id == User.id')
@@ -106,6 +115,32 @@ class Conversation(Base, Serializable):
                     has_rights = True
         return has_rights
 
+    def mark_messages_viewed(self, user_id, up_to_id):
+        '''
+        Marks the messages sent to the user up to the message `up_to_id` as
+        viewed, with one update, and recounts their unread messages.
+        Returns the number of messages marked and the number still unread.
+        '''
+        messages = Message.__table__
+        received = and_(
+            messages.c.conversation_id == self.id,
+            messages.c.sender_user_id != user_id,
+        )
+        result = store.session.execute(
+            messages.update().where(
+                and_(received, messages.c.id <= up_to_id, messages.c.viewed == False)
+            ).values(viewed=True)
+        )
+        # The update bypasses the session, so the counter is kept in sync here.
+        unread_count = select([func.count()]).where(and_(received, messages.c.viewed == False))
+        entries = InboxEntry.__table__
+        store.session.execute(
+            entries.update().where(
+                and_(entries.c.conversation_id == self.id, entries.c.user_id == user_id)
+            ).values(unread_count=unread_count.as_scalar())
+        )
+        return result.rowcount, store.session.execute(unread_count).scalar()
+
     def serialize_userA(self, requester):
         return self.userA.serialize(requester)
 
@@ -121,6 +156,38 @@ class Conversation(Base, Serializable):
         'messages': serialize_messages,
     }
 
+    @staticmethod
+    def parse_last_messages(argument):
+        match = re.match(r'^last\s*(\d+)$', argument.strip())
+        if match is None or not 0 < int(match.group(1)) <= Message.MAX_PAGE_LIMIT:
+            raise ValueError(
+                'messages can be expanded with last N for N up to {0}'.format(
+                    Message.MAX_PAGE_LIMIT
+                )
+            )
+        return int(match.group(1))
+
+    def expand_messages(self, requester, number):
+        messages = getattr(self, '_last_messages', None)
+        if messages is None:
+            messages = Message.page(self.id, number)
+        return [message.serialize(requester) for message in messages[-number:]]
+
+    EXPANSIONS = {'messages': (parse_last_messages.__func__, expand_messages)}
+
+    @classmethod
+    def prefetch_expansions(cls, conversations, expand):
+        '''
+        Loads the last messages of all the conversations in one query.
+        '''
+        number = expand.get('messages')
+        if number is not None:
+            last_messages = {conversation.id: [] for conversation in conversations}
+            for message in Message.last_messages(list(last_messages), number):
+                last_messages[message.conversation_id].append(message)
+            for conversation in conversations:
+                conversation._last_messages = last_messages[conversation.id]
+
     @classmethod
     def args_to_query(cls, args, requester):
         user_id = args.get('user_id', None)
@@ -146,10 +213,14 @@ class Conversation(Base, Serializable):
                             ),
                         )
                     if with_unviewed_messages:
-                        query = query.join(Message)
-                        query = query.filter(
-                            and_(Message.viewed == False, Message.sender_user_id != user_id),
+                        query = query.join(
+                            InboxEntry,
+                            and_(
+                                InboxEntry.conversation_id == Conversation.id,
+                                InboxEntry.user_id == user_id,
+                            ),
                         )
+                        query = query.filter(InboxEntry.unread_count > 0)
                     if messages_date_created_greaterthan:
                         query = query.join(Message)
                         query = query.filter(
@@ -198,12 +269,75 @@ class Message(Base, Serializable):
     viewed = Column(Boolean, nullable=False, default=False)
     date_created = Column(DateTime, nullable=False, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index('ix_message_conversation_id_date_created', conversation_id, date_created),
+        Index('ix_message_unviewed', conversation_id, postgresql_where=(viewed == False)),
+    )
+
     sender_user = relationship('User')
     conversation = relationship(
         'Conversation',
         primaryjoin='Message.conversation_id == Conversation.id',
     )
 
+    @classmethod
+    def page(cls, conversation_id, limit, before_id=None, after_id=None):
+        '''
+        Up to `limit` messages of a conversation, oldest first.  These are the
+        latest messages, or the latest before the message `before_id`, or the
+        earliest after the message `after_id`, where an `after_id` of 0 is
+        before every message.
+        '''
+        query = store.session.query(Message).filter(Message.conversation_id == conversation_id)
+        newest_first = after_id is None
+        cursor_id = before_id if after_id is None else after_id
+        if cursor_id:
+            cursor_date = store.session.query(Message.date_created).filter(
+                Message.id == cursor_id, Message.conversation_id == conversation_id
+            ).as_scalar()
+            if newest_first:
+                query = query.filter(
+                    or_(
+                        Message.date_created < cursor_date,
+                        and_(Message.date_created == cursor_date, Message.id < cursor_id),
+                    )
+                )
+            else:
+                query = query.filter(
+                    or_(
+                        Message.date_created > cursor_date,
+                        and_(Message.date_created == cursor_date, Message.id > cursor_id),
+                    )
+                )
+        if newest_first:
+            query = query.order_by(Message.date_created.desc(), Message.id.desc())
+        else:
+            query = query.order_by(Message.date_created, Message.id)
+        messages = query.limit(limit).all()
+        if newest_first:
+            messages.reverse()
+        return messages
+
+    @classmethod
+    def last_messages(cls, conversation_ids, number):
+        '''
+        The last `number` messages of each conversation, oldest first.
+        '''
+        messages = []
+        if conversation_ids:
+            position = func.row_number().over(
+                partition_by=Message.conversation_id,
+                order_by=(Message.date_created.desc(), Message.id.desc()),
+            ).label('position')
+            positions = store.session.query(Message.id, position).filter(
+                Message.conversation_id.in_(conversation_ids)
+            ).subquery()
+            query = store.session.query(Message).join(positions, positions.c.id == Message.id)
+            query = query.filter(positions.c.position <= number)
+            query = query.order_by(Message.conversation_id, Message.date_created, Message.id)
+            messages = query.all()
+        return messages
+
     @classmethod
     def has_add_rights(cls, data, user):
         '''
@@ -222,12 +356,19 @@ class Message(Base, Serializable):
         return has_rights
 
     def receiver_user(self):
-        if (self.sender_user_id == self.conversation.userA.id):
+        if (self.sender_user_id == self.conversation.userA_id):
             receiver_user = self.conversation.userB
         else:
             receiver_user = self.conversation.userA
         return receiver_user
 
+    def receiver_user_id(self):
+        if (self.sender_user_id == self.conversation.userA_id):
+            receiver_user_id = self.conversation.userB_id
+        else:
+            receiver_user_id = self.conversation.userA_id
+        return receiver_user_id
+
     def has_standard_rights(self, requester):
         has_rights = False
         if requester is not None:
@@ -235,7 +376,7 @@ class Message(Base, Serializable):
                 has_rights = True
             elif requester.id == self.sender_user_id:
                 has_rights = True
-            elif requester.id == self.receiver_user().id:
+            elif requester.id == self.receiver_user_id():
                 has_rights = True
         return has_rights
 
@@ -244,10 +385,32 @@ class Message(Base, Serializable):
         if requester is not None:
             if requester.is_administrator:
                 has_rights = True
-            elif requester.id == self.receiver_user().id:
+            elif requester.id == self.receiver_user_id():
                 has_rights = True
         return has_rights
 
+    @classmethod
+    def rights_conditions(cls, requester):
+        if requester is None:
+            conditions = (false(), false())
+        elif requester.is_administrator:
+            conditions = (true(), true())
+        else:
+            is_receiver = Message.conversation.has(
+                or_(
+                    and_(
+                        Conversation.userA_id == Message.sender_user_id,
+                        Conversation.userB_id == requester.id,
+                    ),
+                    and_(
+                        Conversation.userA_id != Message.sender_user_id,
+                        Conversation.userA_id == requester.id,
+                    ),
+                )
+            )
+            conditions = (or_(Message.sender_user_id == requester.id, is_receiver), is_receiver)
+        return conditions
+
     def on_add(self, requester):
         mail_actions.send_conversation_message(self)
 
@@ -295,3 +458,156 @@ class Message(Base, Serializable):
             except ValueError:
                 pass
         return message_id
+
+
+class InboxEntry(Base, Serializable):
+    '''
+    A conversation as it appears in the inbox of one of its users, with the
+    number of messages they haven't viewed and the latest message.  Kept up
+    to date as conversations and messages are flushed.
+    '''
+    __tablename__ = 'inbox_entry'
+
+    STANDARD_READABLE_FIELDS = []
+    ADMIN_READABLE_FIELDS = [
+        'conversation_id',
+        'conversation',
+        'other_user',
+        'unread_count',
+        'last_message',
+        'last_activity',
+    ]
+
+    MAX_LIMIT = 100
+    DEFAULT_LIMIT = 20
+
+    conversation_id = Column(Integer, ForeignKey('conversation.id'), primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    other_user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    unread_count = Column(Integer, nullable=False, default=0)
+    last_message_id = Column(Integer, ForeignKey('message.id'))
+    # When the last message was sent, or the conversation was started.
+    last_activity = Column(DateTime, nullable=False)
+
+    __table_args__ = (Index('ix_inbox_entry_user_id_last_activity', user_id, last_activity), )
+
+    conversation = relationship(Conversation)
+    other_user = relationship(User, foreign_keys=[other_user_id])
+    last_message = relationship(Message)
+
+    def has_admin_rights(self, requester):
+        has_rights = False
+        if requester is not None:
+            if requester.is_administrator:
+                has_rights = True
+            elif requester.id == self.user_id:
+                has_rights = True
+        return has_rights
+
+    # Summaries only read what was loaded with the entry.
+    def serialize_conversation(self, requester):
+        return {'id': self.conversation.id, 'title': self.conversation.title}
+
+    def serialize_other_user(self, requester):
+        return {'id': self.other_user.id, 'name': self.other_user.name}
+
+    def serialize_last_message(self, requester):
+        message = self.last_message
+        serialized = None
+        if message is not None:
+            serialized = {
+                'id': message.id,
+                'sender_user_id': message.sender_user_id,
+                'content': message.content,
+                'date_created': message.date_created,
+                'viewed': message.viewed,
+            }
+        return serialized
+
+    custom_serializers = {
+        'conversation': serialize_conversation,
+        'other_user': serialize_other_user,
+        'last_message': serialize_last_message,
+    }
+
+    @classmethod
+    def inbox(cls, user_id, unread_only=False, limit=DEFAULT_LIMIT, offset=0):
+        '''
+        The user's active conversations, most recently active first, read in
+        one query along with their latest messages and the other users.
+        '''
+        query = store.session.query(cls).filter(cls.user_id == user_id)
+        query = query.join(cls.conversation).filter(Conversation.active == True)
+        query = query.join(cls.other_user)
+        query = query.outerjoin(cls.last_message)
+        query = query.options(
+            contains_eager(cls.conversation),
+            contains_eager(cls.other_user),
+            contains_eager(cls.last_message),
+        )
+        if unread_only:
+            query = query.filter(cls.unread_count > 0)
+        query = query.order_by(cls.last_activity.desc(), cls.conversation_id.desc())
+        return query.limit(limit).offset(offset).all()
+
+
+@event.listens_for(Session, 'after_flush')
+def update_inbox_entries(session, flush_context):
+    '''
+    Adds inbox entries for new conversations, and counts new and viewed
+    messages into them.  Counters are updated in the database rather than
+    read and written back so concurrent messages aren't lost.
+    '''
+    table = InboxEntry.__table__
+    for instance in session.new:
+        if isinstance(instance, Conversation):
+            session.execute(
+                table.insert(),
+                [
+                    {
+                        'conversation_id': instance.id,
+                        'user_id': user_id,
+                        'other_user_id': other_user_id,
+                        'unread_count': 0,
+                        'last_activity': instance.date_created,
+                    } for user_id, other_user_id in (
+                        (instance.userA_id, instance.userB_id),
+                        (instance.userB_id, instance.userA_id),
+                    )
+                ],
+            )
+    for instance in list(session.new) + list(session.dirty):
+        if not isinstance(instance, Message):
+            continue
+        is_receiver = table.c.user_id != instance.sender_user_id
+        if instance in session.new:
+            newer = or_(table.c.last_message_id == None, table.c.last_message_id < instance.id)
+            values = {
+                'last_message_id': case([(newer, instance.id)], else_=table.c.last_message_id),
+                'last_activity': case(
+                    [(newer, instance.date_created)], else_=table.c.last_activity
+                ),
+            }
+            if not instance.viewed:
+                values['unread_count'] = (
+                    table.c.unread_count + case([(is_receiver, 1)], else_=0)
+                )
+            session.execute(
+                table.update().where(table.c.conversation_id == instance.conversation_id)
+                .values(**values)
+            )
+        else:
+            history = get_history(instance, 'viewed')
+            changed = history.added and history.deleted
+            if changed and bool(history.added[0]) != bool(history.deleted[0]):
+                if instance.viewed:
+                    unread_count = case(
+                        [(table.c.unread_count > 0, table.c.unread_count - 1)], else_=0
+                    )
+                else:
+                    unread_count = table.c.unread_count + 1
+                session.execute(
+                    table.update().where(
+                        and_(table.c.conversation_id == instance.conversation_id, is_receiver)
+                    ).values(unread_count=unread_count)
+                )
@@ -1,10 +1,10 @@
 import logging
 
 from sqlalchemy import Column, Integer, String, Boolean
-from sqlalchemy import ForeignKey, UniqueConstraint
+from sqlalchemy import ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 
-from community_share import Base, store
+from community_share import Base
 from community_share.models.base import Serializable, ValidationException
 
 logger = logging.getLogger(__name__)
@@ -25,23 +25,13 @@ class InstitutionAssociation(Base, Serializable):
     role = Column(String(100), nullable=False)
     unique_constraint = UniqueConstraint('user_id', 'institution_id')
 
+    __table_args__ = (Index('ix_institution_association_user_id', user_id), )
+
     user = relationship('User')
     institution = relationship('Institution')
 
     def deserialize_institution(self, data):
-        name = data.get('name', None)
-        institution_type = data.get('institution_type', None)
-        institution = None
-        if name:
-            self.institution = store.session.query(Institution).filter_by(name=name).first()
-        if not self.institution:
-            if len(name) > INSTITUTION_NAME_LENGTH:
-                error_message = 'Institution name must be less than {} characters.'
-                raise ValidationException(error_message.format(INSTITUTION_NAME_LENGTH))
-            else:
-                self.institution = Institution.admin_deserialize_add(data)
-        else:
-            self.institution.institution_type = institution_type
+        self.institution = Institution.get_or_create_from_data([data])[data.get('name')]
 
     def serialize_institution(self, requester):
         return self.institution.serialize(requester)
@@ -72,3 +62,24 @@ class Institution(Base, Serializable):
 
     def has_standard_rights(self, requester):
         return True
+
+    @classmethod
+    def get_or_create_from_data(cls, data_list):
+        '''
+        The institutions named in a list of serialized institutions, by name,
+        creating those that don't exist.  Existing institutions take the
+        institution type given for them.
+        '''
+        rows = []
+        for data in data_list:
+            name = data.get('name', None)
+            if not name:
+                raise ValidationException('Missing necessary field: name')
+            if len(name) > INSTITUTION_NAME_LENGTH:
+                error_message = 'Institution name must be less than {} characters.'
+                raise ValidationException(error_message.format(INSTITUTION_NAME_LENGTH))
+            rows.append({'name': name, 'institution_type': data.get('institution_type', None)})
+        institutions = cls.bulk_get_or_create('name', rows)
+        for row in rows:
+            institutions[row['name']].institution_type = row['institution_type']
+        return institutions
@@ -0,0 +1,207 @@
+'''
+Outgoing emails.  OutboxMailer adds them in the same transaction as the
+change they are about, so they are sent if and only if it commits, and the
+worker delivers them, retrying failures, see worker.dispatch_outbox.
+
+Emails are sent at least once.  One whose dispatcher stops after sending
+it but before recording it is sent again once its lease runs out, and
+Mailgun delivers both.
+'''
+
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, Integer, String, DateTime, Index, and_, or_
+
+from community_share import Base, store
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+SENT = 'sent'
+FAILED = 'failed'
+
+
+class OutboxEmail(Base):
+    __tablename__ = 'outbox_email'
+
+    id = Column(Integer, primary_key=True)
+    # Sent as the Message-Id of emails outside batches, so copies sent again share it.
+    idempotency_key = Column(String(32), nullable=False, unique=True)
+    from_address = Column(String, nullable=False)
+    to_address = Column(String, nullable=False)
+    subject = Column(String)
+    content = Column(String)
+    new_content = Column(String)
+    # Emails added as one batch share a key and are sent together.  Their
+    # subject and content have the %recipient.<name>% placeholders filled
+    # in from the recipient variables, as JSON.
+    batch_key = Column(String(32))
+    recipient_variables = Column(String)
+    status = Column(String(10), nullable=False, default=PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # Set by the dispatcher that claimed the email for its current attempt.
+    claim = Column(String(32))
+    last_error = Column(String)
+    date_created = Column(DateTime, nullable=False, default=datetime.utcnow)
+    date_sent = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_outbox_email_status_next_attempt_at', status, next_attempt_at),
+    )
+
+    # The claim under which claim_due returned the email.
+    held_claim = None
+
+    @classmethod
+    def from_email(cls, email):
+        return cls(
+            idempotency_key=uuid.uuid4().hex,
+            from_address=email.from_address,
+            to_address=email.to_address,
+            subject=email.subject,
+            content=email.content,
+            new_content=email.new_content,
+        )
+
+    @classmethod
+    def from_batch_email(cls, batch_email, max_recipients):
+        '''
+        An outbox email for each recipient of the batch.  Up to
+        `max_recipients` share a batch key, so each batch is sent with one
+        request and fails or succeeds as a whole.
+        '''
+        recipients = sorted(batch_email.recipient_variables.items())
+        outbox_emails = []
+        for start in range(0, len(recipients), max_recipients):
+            batch_key = uuid.uuid4().hex
+            outbox_emails.extend(
+                cls(
+                    idempotency_key=uuid.uuid4().hex,
+                    from_address=batch_email.from_address,
+                    to_address=to_address,
+                    subject=batch_email.subject,
+                    content=batch_email.content,
+                    new_content=batch_email.content,
+                    batch_key=batch_key,
+                    recipient_variables=json.dumps(variables),
+                )
+                for to_address, variables in recipients[start:start + max_recipients]
+            )
+        return outbox_emails
+
+    @classmethod
+    def to_batch_email(cls, outbox_emails):
+        '''
+        The batch email for outbox emails added as one batch.  It has no
+        Message-Id since each recipient's copy would share it.
+        '''
+        from community_share.mail import BatchEmail
+
+        first = outbox_emails[0]
+        return BatchEmail(
+            first.from_address,
+            first.subject,
+            first.content,
+            {
+                outbox_email.to_address: json.loads(outbox_email.recipient_variables)
+                for outbox_email in outbox_emails
+            },
+        )
+
+    def to_email(self, domain):
+        from community_share.mail import Email
+
+        return Email(
+            self.from_address,
+            self.to_address,
+            self.subject,
+            self.content,
+            self.new_content,
+            message_id='<{0}@{1}>'.format(self.idempotency_key, domain),
+        )
+
+    @classmethod
+    def claim_due(cls, limit, lease_seconds):
+        '''
+        Claims up to `limit` pending emails whose next attempt is due, with
+        the due emails of the same batches, and counts the attempt.  Their
+        next attempt is pushed back by `lease_seconds` so other dispatchers
+        skip them while they are sent, and they are retried after that if
+        the dispatcher dies.  Commits.
+        '''
+        now = datetime.utcnow()
+        due = and_(cls.status == PENDING, cls.next_attempt_at <= now)
+        due_emails = store.session.query(cls.id, cls.batch_key).filter(due)
+        due_emails = due_emails.order_by(cls.next_attempt_at, cls.id).limit(limit).all()
+        due_ids = [email_id for email_id, batch_key in due_emails]
+        batch_keys = {batch_key for email_id, batch_key in due_emails if batch_key is not None}
+        claimed = []
+        if due_ids:
+            claim = uuid.uuid4().hex
+            selected = cls.id.in_(due_ids)
+            if batch_keys:
+                selected = or_(selected, cls.batch_key.in_(batch_keys))
+            # Conditions are checked again by the update so only one
+            # dispatcher claims each email.
+            store.session.execute(
+                cls.__table__.update().where(and_(selected, due)).values(
+                    claim=claim,
+                    attempts=cls.attempts + 1,
+                    next_attempt_at=now + timedelta(seconds=lease_seconds),
+                )
+            )
+            store.session.commit()
+            claimed = store.session.query(cls).filter(cls.claim == claim).all()
+            # Kept apart from the claim column, which reloads after commits.
+            for outbox_email in claimed:
+                outbox_email.held_claim = claim
+        return claimed
+
+    def _update_if_claimed(self, **values):
+        '''
+        Updates the email if it is still pending under the claim it was
+        sent with.  Once the lease has run out another dispatcher may have
+        claimed it again, and then only that dispatcher records the attempt.
+        True if the email was updated.
+        '''
+        email_id = self.id
+        table = OutboxEmail.__table__
+        result = store.session.execute(
+            table.update().where(and_(
+                table.c.id == email_id,
+                table.c.claim == self.held_claim,
+                table.c.status == PENDING,
+            )).values(**values)
+        )
+        store.session.expire(self)
+        updated = result.rowcount == 1
+        if not updated:
+            logger.warning('Email {0} was claimed again while it was sent'.format(email_id))
+        return updated
+
+    def record_sent(self):
+        return self._update_if_claimed(status=SENT, date_sent=datetime.utcnow(), last_error=None)
+
+    def record_failure(self, error_message, max_attempts, retry_seconds):
+        '''
+        Retries the email after `retry_seconds`, doubled for each attempt
+        after the first, or gives up after `max_attempts`.
+        '''
+        values = {'last_error': error_message}
+        if self.attempts >= max_attempts:
+            values['status'] = FAILED
+        else:
+            delay = retry_seconds * 2 ** (self.attempts - 1)
+            values['next_attempt_at'] = datetime.utcnow() + timedelta(seconds=delay)
+        updated = self._update_if_claimed(**values)
+        if updated and values.get('status') == FAILED:
+            logger.error(
+                'Giving up on email {0} to {1} after {2} attempts: {3}'.format(
+                    self.id, self.to_address, self.attempts, error_message
+                )
+            )
+        return updated
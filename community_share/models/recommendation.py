@@ -0,0 +1,82 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, Boolean, DateTime, Float, String, ForeignKey, Index
+from sqlalchemy.orm import relationship
+
+from community_share import Base
+from community_share.models.base import Serializable
+from community_share.models.user import User
+
+logger = logging.getLogger(__name__)
+
+
+class Recommendation(Base, Serializable):
+    '''
+    A user the user should contact, computed nightly by
+    community_share.recommendations.
+    '''
+    __tablename__ = 'recommendation'
+
+    STANDARD_READABLE_FIELDS = []
+    ADMIN_READABLE_FIELDS = [
+        'id',
+        'user_id',
+        'searcher_role',
+        'rank',
+        'recommended_user_id',
+        'recommended_user',
+        'score',
+        'date_created',
+    ]
+
+    PERMISSIONS = {
+        'all_can_read_many': False,
+        'standard_can_read_many': True,
+        'admin_can_delete': False
+    }
+
+    ORDER_BY_FIELDS = ['id', 'rank']
+    DEFAULT_ORDER_BY = 'rank'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    # The role the user is searching as.
+    searcher_role = Column(String(20), nullable=False)
+    rank = Column(Integer, nullable=False)
+    recommended_user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    score = Column(Float, nullable=False)
+    active = Column(Boolean, nullable=False, default=True)
+    date_created = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (Index('ix_recommendation_user_id_rank', user_id, rank), )
+
+    recommended_user = relationship(User, foreign_keys=[recommended_user_id])
+
+    def has_admin_rights(self, requester):
+        has_rights = False
+        if requester is not None:
+            if requester.is_administrator:
+                has_rights = True
+            elif requester.id == self.user_id:
+                has_rights = True
+        return has_rights
+
+    def serialize_recommended_user(self, requester):
+        return self.recommended_user.serialize(requester)
+
+    custom_serializers = {'recommended_user': serialize_recommended_user}
+
+    @classmethod
+    def args_to_query(cls, args, requester):
+        # Users can only list their own recommendations.
+        query = None
+        user_id = args.get('user_id', None)
+        if user_id is not None:
+            try:
+                user_id = int(user_id)
+            except ValueError:
+                raise ValueError('user_id must be an integer')
+        if requester.is_administrator or (user_id is not None and requester.id == user_id):
+            query = cls._args_to_query(args, requester)
+        return query
@@ -1,12 +1,14 @@
 import logging
 from datetime import datetime
 
-from sqlalchemy import Table, ForeignKey, DateTime, Column
+from sqlalchemy import Table, ForeignKey, DateTime, Column, Index, and_, event, select
 from sqlalchemy import Integer, String, Boolean, Float
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import Session, relationship, validates
+from sqlalchemy.orm.attributes import get_history
 
-from community_share import Base, store
+from community_share import Base, geo
 from community_share.models.base import Serializable
+from community_share.zipcodes import zipcode_table
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +17,8 @@ search_label_table = Table(
     Base.metadata,
     Column('search_id', Integer, ForeignKey('search.id')),
     Column('label_id', Integer, ForeignKey('label.id')),
+    Index('ix_search_label_search_id', 'search_id'),
+    Index('ix_search_label_label_id', 'label_id'),
 )
 
 
@@ -88,10 +92,50 @@ class Search(Base, Serializable):
     zipcode = Column(String(20))
     latitude = Column(Float)
     longitude = Column(Float)
+    # Miles from the location that matching searches can be.
     distance = Column(Float, nullable=True)
+    # Kept up to date from the location, see community_share.geo.
+    grid_cell = Column(Integer)
+    # The materialized matches in search_match are stale while match_version
+    # is ahead of the matched_version they were computed for.
+    match_version = Column(Integer, nullable=False, default=1)
+    matched_version = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index(
+            'ix_search_roles_active',
+            searcher_role,
+            searching_for_role,
+            postgresql_where=(active == True),
+        ),
+        Index(
+            'ix_search_roles_grid_cell_active',
+            searcher_role,
+            searching_for_role,
+            grid_cell,
+            postgresql_where=(active == True),
+        ),
+        Index('ix_search_searcher_user_id', searcher_user_id),
+        Index(
+            'ix_search_stale_matches',
+            id,
+            postgresql_where=and_(active == True, match_version > matched_version),
+        ),
+    )
 
     labels = relationship('Label', secondary=search_label_table)
 
+    # Changes to these can change which searches match this one.
+    MATCHING_FIELDS = [
+        'searcher_role',
+        'searching_for_role',
+        'labels',
+        'active',
+        'latitude',
+        'longitude',
+        'distance',
+    ]
+
     @classmethod
     def has_add_rights(cls, data, user):
         has_rights = False
@@ -133,22 +177,123 @@ class Search(Base, Serializable):
 
     custom_deserializers = {'labels': deserialize_labels}
 
+    def admin_deserialize_update(self, data, add=False):
+        super().admin_deserialize_update(data, add=add)
+        # Coordinates sent along with the zipcode are kept.
+        if 'zipcode' in data and not ('latitude' in data and 'longitude' in data):
+            self.latitude, self.longitude = zipcode_table.lookup(self.zipcode) or (None, None)
+
+
+@event.listens_for(Search, 'before_insert')
+@event.listens_for(Search, 'before_update')
+def set_grid_cell(mapper, connection, search):
+    search.grid_cell = geo.grid_cell(search.latitude, search.longitude)
+
+
+class SearchMatch(Base):
+    '''
+    The materialized matches of a search, ordered by rank.  Kept up to date
+    by search_utils.refresh_stale_search_matches.
+    '''
+    __tablename__ = 'search_match'
+
+    search_id = Column(Integer, ForeignKey('search.id', ondelete='CASCADE'), primary_key=True)
+    rank = Column(Integer, primary_key=True, autoincrement=False)
+    matched_search_id = Column(
+        Integer, ForeignKey('search.id', ondelete='CASCADE'), nullable=False
+    )
+    # The number of labels the searches have in common.
+    score = Column(Integer, nullable=False)
+
+    __table_args__ = (Index('ix_search_match_matched_search_id', matched_search_id), )
+
+
+def _changed_for_matching(search, session):
+    changed = search in session.new or search in session.deleted
+    if not changed:
+        changed = any(
+            get_history(search, fieldname).has_changes() for fieldname in Search.MATCHING_FIELDS
+        )
+    return changed
+
+
+@event.listens_for(Session, 'before_flush')
+def mark_search_matches_stale(session, flush_context, instances):
+    '''
+    Marks the materialized matches stale for searches that are changing and
+    for the searches that share a label with them, which are the ones whose
+    matches they can enter or leave.
+    '''
+    from community_share.models.user import User
+
+    changed = set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, Search):
+            if _changed_for_matching(instance, session):
+                changed.add(instance)
+        elif isinstance(instance, User) and instance not in session.new:
+            # Only searches by active users with confirmed emails match.
+            if any(
+                get_history(instance, fieldname).has_changes()
+                for fieldname in ('active', 'email_confirmed')
+            ):
+                changed.update(instance.searches)
+    labelnames_by_roles = {}
+    for search in changed:
+        if search not in session.new and search not in session.deleted:
+            search.match_version = Search.match_version + 1
+        # The labels the search has, and had before this flush.
+        labelnames = labelnames_by_roles.setdefault(
+            (search.searching_for_role, search.searcher_role), set()
+        )
+        labelnames.update(
+            label.normalized_name for label in get_history(search, 'labels').sum()
+        )
+    for (searcher_role, searching_for_role), labelnames in labelnames_by_roles.items():
+        if labelnames:
+            overlapping_search_ids = select([search_label_table.c.search_id]).select_from(
+                search_label_table.join(Label, Label.id == search_label_table.c.label_id)
+            ).where(Label.normalized_name.in_(labelnames))
+            statement = Search.__table__.update().where(
+                and_(
+                    Search.searcher_role == searcher_role,
+                    Search.searching_for_role == searching_for_role,
+                    Search.active == True,
+                    Search.id.in_(overlapping_search_ids),
+                )
+            ).values(match_version=Search.match_version + 1)
+            session.execute(statement)
+
 
 class Label(Base, Serializable):
     __tablename__ = 'label'
 
     id = Column(Integer, primary_key=True)
     name = Column(String(50), nullable=False, unique=True)
+    # Labels are matched and deduplicated on this, set from the name.
+    normalized_name = Column(String(50), nullable=False, unique=True)
     active = Column(Boolean, default=True)
     description = Column(String)
 
+    @staticmethod
+    def normalize_name(name):
+        return ' '.join(name.split()).lower()
+
+    @validates('name')
+    def validate_name(self, key, name):
+        self.normalized_name = self.normalize_name(name)
+        return name
+
     @classmethod
     def name_list_to_object_list(cls, names):
-        labels = store.session.query(Label).filter(Label.name.in_(names)).all()
-        missing_labelnames = set(names)
-        for label in labels:
-            missing_labelnames.remove(label.name)
-        for labelname in missing_labelnames:
-            new_label = Label(name=labelname)
-            labels.append(new_label)
+        # The first spelling of a new label is the one kept.
+        labels_by_normalized_name = cls.bulk_get_or_create(
+            'normalized_name',
+            [{'name': name, 'normalized_name': cls.normalize_name(name)} for name in names],
+        )
+        labels = []
+        for name in names:
+            label = labels_by_normalized_name[cls.normalize_name(name)]
+            if label not in labels:
+                labels.append(label)
         return labels
@@ -2,11 +2,11 @@ import logging
 from datetime import datetime, timedelta
 import pytz
 
-from sqlalchemy import Table, ForeignKey, DateTime, Column
+from sqlalchemy import Table, ForeignKey, DateTime, Column, Index
 from sqlalchemy import Integer, String, Boolean, Float
 from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql.expression import func
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, false, true
 
 from community_share import time_format, mail_actions
 from community_share import store, Base, config
@@ -66,6 +66,8 @@ class Share(Base, Serializable):
         'admin_can_delete': True
     }
 
+    ORDER_BY_FIELDS = ['id', 'date_created']
+
     id = Column(Integer, primary_key=True)
     conversation_id = Column(Integer, ForeignKey('conversation.id'), nullable=False)
     educator_user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
@@ -77,6 +79,20 @@ class Share(Base, Serializable):
     description = Column(String, nullable=False)
     date_created = Column(DateTime, nullable=False, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index(
+            'ix_share_educator_user_id_active',
+            educator_user_id,
+            postgresql_where=(active == True),
+        ),
+        Index(
+            'ix_share_community_partner_user_id_active',
+            community_partner_user_id,
+            postgresql_where=(active == True),
+        ),
+        Index('ix_share_conversation_id_active', conversation_id, postgresql_where=(active == True)),
+    )
+
     events = relationship(
         'Event',
         primaryjoin='and_(Event.share_id == Share.id, Event.active == True)',
@@ -114,8 +130,25 @@ class Share(Base, Serializable):
             has_rights = True
         return has_rights
 
+    @classmethod
+    def rights_conditions(cls, requester):
+        if requester is None:
+            conditions = (false(), false())
+        elif requester.is_administrator:
+            conditions = (true(), true())
+        else:
+            conditions = (true(), Share.is_partner_condition(requester.id))
+        return conditions
+
+    @staticmethod
+    def is_partner_condition(user_id):
+        return or_(Share.educator_user_id == user_id, Share.community_partner_user_id == user_id)
+
     def serialize_events(self, requester):
-        serialized = [e.serialize(requester, exclude=['share']) for e in self.events if e.active]
+        serialized = [
+            e.serialize(requester, exclude=self.NESTED_EXCLUDES['events']) for e in self.events
+            if e.active
+        ]
         return serialized
 
     def deserialize_events(self, data_list):
@@ -136,6 +169,8 @@ class Share(Base, Serializable):
     def serialize_community_partner(self, requester):
         return self.community_partner.serialize(requester)
 
+    NESTED_EXCLUDES = {'events': ['share']}
+
     custom_serializers = {
         'educator': serialize_educator,
         'community_partner': serialize_community_partner,
@@ -259,6 +294,8 @@ class Event(Base, Serializable):
         'admin_can_delete': True
     }
 
+    ORDER_BY_FIELDS = ['id', 'date_created', 'datetime_start']
+
     id = Column(Integer, primary_key=True)
     share_id = Column(Integer, ForeignKey('share.id'), nullable=False)
     date_created = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -269,6 +306,12 @@ class Event(Base, Serializable):
     description = Column(String, nullable=True)
     location = Column(String(100), nullable=False)
 
+    __table_args__ = (
+        Index('ix_event_share_id', share_id),
+        Index('ix_event_datetime_start', datetime_start),
+        Index('ix_event_datetime_stop', datetime_stop),
+    )
+
     answers = relationship('Answer')
 
     @validates('datetime_start', 'datetime_stop')
@@ -341,7 +384,8 @@ class Event(Base, Serializable):
         if user.is_administrator:
             has_rights = True
         else:
-            share = store.session.query(Share).filter(Share.id == self.share_id).first()
+            # Usually loaded with the event, so this doesn't query.
+            share = self.share
             if share is not None:
                 if user.id == share.educator_user_id:
                     has_rights = True
@@ -349,8 +393,18 @@ class Event(Base, Serializable):
                     has_rights = True
         return has_rights
 
+    @classmethod
+    def rights_conditions(cls, requester):
+        if requester is None:
+            conditions = (false(), false())
+        elif requester.is_administrator:
+            conditions = (true(), true())
+        else:
+            conditions = (true(), Event.share.has(Share.is_partner_condition(requester.id)))
+        return conditions
+
     def serialize_share(self, requester):
-        return self.share.serialize(requester, exclude=['events'])
+        return self.share.serialize(requester, exclude=self.NESTED_EXCLUDES['share'])
 
     def serialize_datetime_start(self, requester):
         return time_format.to_iso8601(self.datetime_start)
@@ -361,6 +415,8 @@ class Event(Base, Serializable):
     def serialize_answers(self, requester):
         return [a.serialize(requester) for a in self.answers]
 
+    NESTED_EXCLUDES = {'share': ['events']}
+
     custom_serializers = {
         'share': serialize_share,
         'datetime_start': serialize_datetime_start,
@@ -401,6 +457,8 @@ class EventReminder(Base):
     date_created = Column(DateTime, nullable=False, default=datetime.utcnow)
     typ = Column(String(20), nullable=False)
 
+    __table_args__ = (Index('ix_eventreminder_event_id', event_id), )
+
     @classmethod
     def get_oneday_reminder_events(cls):
         typ = 'oneday_before'
@@ -3,7 +3,7 @@ import time
 
 import logging
 
-from sqlalchemy import Column, Integer, String, Date, Float, or_
+from sqlalchemy import Column, Integer, String, Date, Float, Index, or_
 
 from community_share import Base, store
 from community_share.models.user import User, UserReview
@@ -21,6 +21,8 @@ class Statistic(Base):
     date = Column(Date, nullable=False)
     value = Column(Float, nullable=False)
 
+    __table_args__ = (Index('ix_statistic_date', date), )
+
     @staticmethod
     def date_now():
         now = datetime.datetime.utcnow()
@@ -3,7 +3,7 @@ import logging
 import json
 
 from sqlalchemy import Column, Integer, String, DateTime, Boolean
-from sqlalchemy import ForeignKey, CheckConstraint
+from sqlalchemy import ForeignKey, CheckConstraint, false, or_, true
 from sqlalchemy.orm import relationship
 
 from community_share import Base
@@ -58,13 +58,18 @@ class Question(Base, Serializable):
     requires_share_id = Column(Boolean, nullable=False, default=False)
     requires_event_id = Column(Boolean, nullable=False, default=False)
     requires_user_id = Column(Boolean, nullable=False, default=False)
-    order = Column(Integer)
+    # Not nullable so questions can be paged through in survey order.
+    order = Column(Integer, nullable=False, default=0)
 
     creator = relationship('User')
     suggested_answers = relationship('SuggestedAnswer')
 
     PERMISSIONS = {'all_can_read_many': True, 'standard_can_read_many': True}
 
+    # Questions are listed in survey order.
+    ORDER_BY_FIELDS = ['id', 'order']
+    DEFAULT_ORDER_BY = 'order'
+
     def __init__(self, *args, **kwargs):
         self.long_answer = False
         self.active = True
@@ -153,6 +158,8 @@ class Answer(Base, Serializable):
 
     PERMISSIONS = {'all_can_read_many': True, 'standard_can_read_many': True}
 
+    ORDER_BY_FIELDS = ['id', 'date_created']
+
     id = Column(Integer, primary_key=True)
     question_id = Column(Integer, ForeignKey('question.id'), nullable=False)
     responder_id = Column(Integer, ForeignKey('user.id'), nullable=False)
@@ -195,3 +202,15 @@ class Answer(Base, Serializable):
             elif self.responder_id == requester.id:
                 has_rights = True
         return has_rights
+
+    @classmethod
+    def rights_conditions(cls, requester):
+        if requester is None:
+            conditions = (false(), false())
+        elif requester.is_administrator:
+            conditions = (true(), true())
+        else:
+            is_responder = Answer.responder_id == requester.id
+            is_public = Answer.question.has(Question.public == True)
+            conditions = (or_(is_public, is_responder), is_responder)
+        return conditions
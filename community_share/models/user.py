@@ -4,21 +4,25 @@ import csv
 import io
 
 from sqlalchemy import Column, Integer, String, DateTime, \
-    Boolean, and_, or_, update
-from sqlalchemy import ForeignKey, CheckConstraint
+    Boolean, Float, and_, or_, update
+from sqlalchemy import ForeignKey, CheckConstraint, Index
 from sqlalchemy.orm import relationship, backref, validates
 
-import passlib
-from passlib import context
-
 from community_share import store, Base, config
+from community_share.api_keys import SignedApiKey
+from community_share.credentials import credential_cache
+from community_share.password_hashing import password_hasher, pwd_context
 from community_share.models.base import Serializable, ValidationException
 from community_share.models.secret import Secret
 from community_share.models.search import Search
 from community_share.models.institution import InstitutionAssociation, Institution
+from community_share.zipcodes import zipcode_table
 
 logger = logging.getLogger(__name__)
 
+# The scope of the keys that only authorize message streams.
+STREAM_TOKEN_SCOPE = 'message_stream'
+
 
 class User(Base, Serializable):
     __tablename__ = 'user'
@@ -111,10 +115,15 @@ class User(Base, Serializable):
     educator_profile_search_id = Column(Integer)
     community_partner_profile_search_id = Column(Integer)
     wants_update_emails = Column(Boolean, nullable=False, default=False)
+    # Incremented to revoke all outstanding signed api keys.
+    api_key_generation = Column(Integer, nullable=False, default=0)
 
     picture_filename = Column(String(100))
     bio = Column(String(1000))
     zipcode = Column(String(50))
+    # Filled in from the zipcode.
+    latitude = Column(Float)
+    longitude = Column(Float)
     phonenumber = Column(String(50))
     website = Column(String(100))
     twitter_handle = Column(String(100))
@@ -123,6 +132,12 @@ class User(Base, Serializable):
     gender = Column(String(100))
     ethnicity = Column(String(100))
 
+    __table_args__ = (
+        Index('ix_user_email_active', email, postgresql_where=(active == True)),
+        Index('ix_user_date_created', date_created),
+        Index('ix_user_last_active_active', last_active, postgresql_where=(active == True)),
+    )
+
     searches = relationship(
         "Search",
         primaryjoin="Search.searcher_user_id == User.id",
@@ -140,12 +155,9 @@ class User(Base, Serializable):
         foreign_keys="User.community_partner_profile_search_id",
     )
 
-    pwd_context = passlib.context.CryptContext(
-        schemes=['sha512_crypt'],
-        default='sha512_crypt',
-        all__vary_rounds=0.1,
-        sha512_crypt__vary_rounds=8000,
-    )
+    # Hashing during requests goes through password_hasher; this is kept for
+    # scripts that hash directly.
+    pwd_context = pwd_context
 
     @validates('email')
     def validate_email(self, key, email):
@@ -156,6 +168,12 @@ class User(Base, Serializable):
             raise ValidationException('That email is already being used.')
         return email
 
+    @validates('active')
+    def validate_active(self, key, active):
+        if not active:
+            credential_cache.invalidate_user(self.id)
+        return active
+
     def searches_as(self, role):
         searches = store.session.query(Search)
         searches = searches.filter_by(
@@ -192,7 +210,7 @@ class User(Base, Serializable):
         if not self.password_hash:
             is_correct = False
         else:
-            is_correct = self.pwd_context.verify(password, self.password_hash)
+            is_correct = password_hasher.verify(password, self.password_hash)
         return is_correct
 
     @classmethod
@@ -206,8 +224,10 @@ class User(Base, Serializable):
         output = None
         error_messages = self.is_password_valid(password)
         if not error_messages:
-            password_hash = User.pwd_context.encrypt(password)
+            password_hash = password_hasher.encrypt(password)
             self.password_hash = password_hash
+            credential_cache.invalidate_user(self.id)
+            self.revoke_api_keys()
         return error_messages
 
     def __repr__(self):
@@ -234,7 +254,10 @@ class User(Base, Serializable):
     def serialize_educator_profile_search(self, requester):
         search = self.educator_profile_search
         if (search and search.active):
-            serialized = search.serialize(requester, exclude=['searcher_user'])
+            serialized = search.serialize(
+                requester,
+                exclude=self.NESTED_EXCLUDES['educator_profile_search'],
+            )
         else:
             serialized = None
         return serialized
@@ -242,7 +265,10 @@ class User(Base, Serializable):
     def serialize_community_partner_profile_search(self, requester):
         search = self.community_partner_profile_search
         if (search and search.active):
-            serialized = search.serialize(requester, exclude=['searcher_user'])
+            serialized = search.serialize(
+                requester,
+                exclude=self.NESTED_EXCLUDES['community_partner_profile_search'],
+            )
         else:
             serialized = None
         return serialized
@@ -253,6 +279,17 @@ class User(Base, Serializable):
             url = config.UPLOAD_LOCATION + self.picture_filename
         return url
 
+    FIELD_DEPENDENCIES = {
+        'picture_url': ['picture_filename'],
+        'is_educator': ['educator_profile_search'],
+        'is_community_partner': ['community_partner_profile_search'],
+    }
+
+    NESTED_EXCLUDES = {
+        'educator_profile_search': ['searcher_user'],
+        'community_partner_profile_search': ['searcher_user'],
+    }
+
     custom_serializers = {
         'institution_associations': serialize_institution_associations,
         'picture_url': serialize_picture_url,
@@ -271,9 +308,19 @@ class User(Base, Serializable):
         if data_list is None:
             data_list = []
         data_list = [d for d in data_list if d != {}]
-        self.institution_associations = [
-            InstitutionAssociation.admin_deserialize(data) for data in data_list
-        ]
+        # The institutions are looked up and created together rather than by
+        # each association.
+        institutions = Institution.get_or_create_from_data(
+            [data['institution'] for data in data_list if 'institution' in data]
+        )
+        associations = []
+        for data in data_list:
+            association_data = {k: v for k, v in data.items() if k != 'institution'}
+            association = InstitutionAssociation.admin_deserialize(association_data)
+            if 'institution' in data:
+                association.institution = institutions[data['institution'].get('name')]
+            associations.append(association)
+        self.institution_associations = associations
         for ia in self.institution_associations:
             ia.user = self
 
@@ -304,16 +351,73 @@ class User(Base, Serializable):
         'bio': deserialize_bio,
     }
 
+    def admin_deserialize_update(self, data, add=False):
+        super().admin_deserialize_update(data, add=add)
+        if 'zipcode' in data:
+            self.latitude, self.longitude = zipcode_table.lookup(self.zipcode) or (None, None)
+
     def make_api_key(self):
-        secret_data = {
-            'userId': self.id,
-            'action': 'api_key',
-        }
-        secret = Secret.create_secret(info=secret_data, hours_duration=24)
-        return secret
+        '''
+        Returns an object whose `key` attribute is the new api key.
+        '''
+        if config.API_KEY_MODE == 'SIGNED':
+            api_key = SignedApiKey.make(
+                self.id,
+                self.api_key_generation or 0,
+                hours_duration=24,
+            )
+        else:
+            secret_data = {
+                'userId': self.id,
+                'action': 'api_key',
+            }
+            api_key = Secret.create_secret(info=secret_data, hours_duration=24)
+        return api_key
+
+    def make_stream_token(self):
+        '''
+        Returns a short-lived key that only authorizes the user's message
+        stream, for clients that must put it in the url.
+        '''
+        return SignedApiKey.make(
+            self.id,
+            self.api_key_generation or 0,
+            hours_duration=float(config.MESSAGE_STREAM_TOKEN_SECONDS) / 3600,
+            scope=STREAM_TOKEN_SCOPE,
+        )
+
+    def revoke_api_keys(self):
+        self.api_key_generation = (self.api_key_generation or 0) + 1
 
     @classmethod
     def from_api_key(self, key):
+        signed_key = SignedApiKey.parse(key)
+        if signed_key is not None:
+            # Signed keys are verified without touching the secret table.
+            user = self.from_signed_key(signed_key)
+        else:
+            user = self.from_secret_api_key(key)
+        return user
+
+    @classmethod
+    def from_stream_token(self, token):
+        signed_key = SignedApiKey.parse(token, scope=STREAM_TOKEN_SCOPE)
+        if signed_key is not None:
+            user = self.from_signed_key(signed_key)
+        else:
+            user = None
+        return user
+
+    @classmethod
+    def from_signed_key(self, signed_key):
+        user = store.session.query(User).get(signed_key.user_id)
+        if user is not None and user.api_key_generation != signed_key.generation:
+            logger.debug('api key for {0} has been revoked'.format(user))
+            user = None
+        return user
+
+    @classmethod
+    def from_secret_api_key(self, key):
         secret = Secret.lookup_secret(key)
         logger.debug('key is {0}'.format(key))
         logger.debug('secret is {0}'.format(secret))
@@ -333,6 +437,8 @@ class User(Base, Serializable):
         # Importing here to prevent circular reference
         from community_share import mail_actions
         from community_share.models.share import Event, Share
+        credential_cache.invalidate_user(self.id)
+        self.revoke_api_keys()
         mail_actions.send_account_deletion_message(self)
         # Delete all upcoming events.
         upcoming_events = store.session.query(Event).filter(
@@ -365,19 +471,16 @@ class User(Base, Serializable):
         """
         searchText can match name, email, institution name
         """
-        query = store.session.query(User).outerjoin(InstitutionAssociation).outerjoin(Institution)
+        query = store.session.query(User)
         if search_text:
-            name_condition = User.name.ilike('%' + search_text + '%')
-            email_condition = User.email.ilike('%' + search_text + '%')
-            institution_condition = Institution.name.ilike('%' + search_text + '%')
-            biography_condition = User.bio.ilike('%' + search_text + '%')
-            query = query.filter(or_(name_condition, email_condition, \
-                                     institution_condition, biography_condition))
+            query = query.filter(user_search.match_condition(search_text))
         if date_created_greaterthan:
             query = query.filter(User.date_created > date_created_greaterthan)
         if date_created_lessthan:
             query = query.filter(User.date_created < date_created_lessthan)
         query = query.filter(User.active == True)
+        query = query.order_by(User.id)
+        query = query.options(*User.eager_load_options())
         users = query.limit(number).offset(offset)
 
         return users
@@ -431,6 +534,7 @@ class UserReview(Base, Serializable):
     __table_args__ = (
         CheckConstraint('rating>=0', 'Rating is negative'),
         CheckConstraint('rating<=5', 'Rating is greater than 5'),
+        Index('ix_userreview_date_created', date_created),
     )
 
     event = relationship('Event')
@@ -465,3 +569,4 @@ class UserReview(Base, Serializable):
 
 from community_share.models.conversation import Conversation
 from community_share.models.share import Event
+from community_share.models import user_search
@@ -0,0 +1,216 @@
+'''
+Text search over users' names, emails, bios and institution names.
+
+On Postgres the columns have trigram indexes, so substring matches with
+ILIKE are served from an index, and the name, email and bio have a
+full-text index for matching words in any order.
+
+On SQLite, used for local and test runs, an FTS4 table holds the same text
+and is kept up to date as users are flushed.  It matches the beginnings of
+words rather than any substring.
+'''
+
+import logging
+import re
+
+from sqlalchemy import DDL, event, func, or_, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from community_share import store
+from community_share.models.institution import Institution, InstitutionAssociation
+from community_share.models.user import User
+
+logger = logging.getLogger(__name__)
+
+SEARCH_FIELDS = ('name', 'email', 'bio', 'institution')
+
+# The expression the full-text index is built on.  Queries have to repeat
+# it exactly for the index to be used.
+USER_TSVECTOR = (
+    "to_tsvector('simple', coalesce(\"user\".name, '') || ' ' || "
+    "coalesce(\"user\".email, '') || ' ' || coalesce(\"user\".bio, ''))"
+)
+
+POSTGRES_USER_DDL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX ix_user_name_trgm ON "user" USING gin (name gin_trgm_ops)',
+    'CREATE INDEX ix_user_email_trgm ON "user" USING gin (email gin_trgm_ops)',
+    'CREATE INDEX ix_user_bio_trgm ON "user" USING gin (bio gin_trgm_ops)',
+    'CREATE INDEX ix_user_search_vector ON "user" USING gin ({0})'.format(USER_TSVECTOR),
+]
+POSTGRES_INSTITUTION_DDL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX ix_institution_name_trgm ON institution USING gin (name gin_trgm_ops)',
+]
+
+for statement in POSTGRES_USER_DDL:
+    event.listen(User.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+for statement in POSTGRES_INSTITUTION_DDL:
+    event.listen(
+        Institution.__table__,
+        'after_create',
+        DDL(statement).execute_if(dialect='postgresql'),
+    )
+event.listen(
+    User.__table__,
+    'after_create',
+    DDL('CREATE VIRTUAL TABLE user_search USING fts4(name, email, bio, institution)')
+    .execute_if(dialect='sqlite'),
+)
+event.listen(
+    User.__table__,
+    'before_drop',
+    DDL('DROP TABLE IF EXISTS user_search').execute_if(dialect='sqlite'),
+)
+
+
+def _words(search_text):
+    # Split as the FTS tokenizer and to_tsvector do.
+    return re.findall(r'[^\W_]+', search_text.lower())
+
+
+def _escape_like(search_text):
+    return re.sub(r'([\\%_])', r'\\\1', search_text)
+
+
+def _fts_condition(fts_query):
+    matching_ids = text('SELECT docid FROM user_search WHERE user_search MATCH :fts_query')
+    return User.id.in_(matching_ids.bindparams(fts_query=fts_query))
+
+
+def _sqlite_condition(search_text, fields):
+    words = _words(search_text)
+    if set(fields) == set(SEARCH_FIELDS):
+        condition = _fts_condition(' '.join('{0}*'.format(word) for word in words))
+    else:
+        condition = or_(
+            *[
+                _fts_condition(' '.join('{0}:{1}*'.format(field, word) for word in words))
+                for field in fields
+            ]
+        )
+    return condition
+
+
+def _like_condition(search_text, fields):
+    pattern = '%{0}%'.format(_escape_like(search_text))
+    conditions = []
+    for field in fields:
+        if field == 'institution':
+            institution_user_ids = select([InstitutionAssociation.user_id]).select_from(
+                InstitutionAssociation.__table__.join(Institution.__table__)
+            ).where(Institution.name.ilike(pattern, escape='\\'))
+            conditions.append(User.id.in_(institution_user_ids))
+        else:
+            conditions.append(getattr(User, field).ilike(pattern, escape='\\'))
+    words = _words(search_text)
+    postgres = store.engine.dialect.name == 'postgresql'
+    if postgres and words and set(fields) >= {'name', 'email', 'bio'}:
+        tsquery = ' & '.join('{0}:*'.format(word) for word in words)
+        conditions.append(text(USER_TSVECTOR).op('@@')(func.to_tsquery('simple', tsquery)))
+    return or_(*conditions)
+
+
+def match_condition(search_text, fields=SEARCH_FIELDS):
+    '''
+    A condition on User matching users with `search_text` in any of
+    `fields`, which are taken from SEARCH_FIELDS.
+    '''
+    unknown_fields = set(fields) - set(SEARCH_FIELDS)
+    if unknown_fields:
+        raise ValueError('Unknown search fields: {0}'.format(', '.join(sorted(unknown_fields))))
+    if store.engine.dialect.name == 'sqlite' and _words(search_text):
+        condition = _sqlite_condition(search_text, fields)
+    else:
+        condition = _like_condition(search_text, fields)
+    return condition
+
+
+def _institution_names(user):
+    return ' '.join(
+        association.institution.name for association in user.institution_associations
+        if association.institution is not None
+    )
+
+
+def _index_users(connection, users):
+    user_ids = [user.id for user in users]
+    connection.execute(
+        text('DELETE FROM user_search WHERE docid IN ({0})'.format(
+            ', '.join(str(int(user_id)) for user_id in user_ids)
+        ))
+    )
+    connection.execute(
+        text(
+            'INSERT INTO user_search (docid, name, email, bio, institution) '
+            'VALUES (:docid, :name, :email, :bio, :institution)'
+        ),
+        [
+            {
+                'docid': user.id,
+                'name': user.name,
+                'email': user.email,
+                'bio': user.bio,
+                'institution': _institution_names(user),
+            } for user in users
+        ],
+    )
+
+
+def rebuild_index():
+    '''
+    Rebuilds the SQLite search table from the user table, for databases
+    filled without going through the ORM.  Postgres needs nothing.
+    '''
+    if store.engine.dialect.name == 'sqlite':
+        with store.engine.begin() as connection:
+            connection.execute(text('DELETE FROM user_search'))
+            connection.execute(
+                text(
+                    'INSERT INTO user_search (docid, name, email, bio, institution) '
+                    'SELECT "user".id, "user".name, "user".email, "user".bio, '
+                    '(SELECT group_concat(institution.name, \' \') '
+                    'FROM institution_association JOIN institution '
+                    'ON institution.id = institution_association.institution_id '
+                    'WHERE institution_association.user_id = "user".id) '
+                    'FROM "user"'
+                )
+            )
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_sqlite_index(session, flush_context):
+    if session.get_bind().dialect.name != 'sqlite':
+        return
+    users = set()
+    deleted_user_ids = set()
+    for instance in list(session.new) + list(session.dirty):
+        if isinstance(instance, User):
+            if instance in session.new or any(
+                    get_history(instance, fieldname).has_changes()
+                    for fieldname in ('name', 'email', 'bio', 'institution_associations')):
+                users.add(instance)
+        elif isinstance(instance, InstitutionAssociation) and instance.user is not None:
+            users.add(instance.user)
+        elif isinstance(instance, Institution):
+            if get_history(instance, 'name').has_changes():
+                users.update(
+                    association.user
+                    for association in session.query(InstitutionAssociation).filter(
+                        InstitutionAssociation.institution_id == instance.id
+                    ) if association.user is not None
+                )
+    for instance in session.deleted:
+        if isinstance(instance, User):
+            deleted_user_ids.add(instance.id)
+    users = [user for user in users if user.id not in deleted_user_ids]
+    connection = session.connection()
+    if users:
+        _index_users(connection, users)
+    if deleted_user_ids:
+        connection.execute(
+            text('DELETE FROM user_search WHERE docid IN ({0})'.format(
+                ', '.join(str(int(user_id)) for user_id in deleted_user_ids)
+            ))
+        )
@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
+
+import passlib
+from passlib import context
+
+logger = logging.getLogger(__name__)
+
+pwd_context = passlib.context.CryptContext(
+    schemes=['sha512_crypt'],
+    default='sha512_crypt',
+    all__vary_rounds=0.1,
+    sha512_crypt__vary_rounds=8000,
+)
+
+
+# These run in the worker processes so they must be picklable module level
+# functions.
+def _encrypt(password):
+    return pwd_context.encrypt(password)
+
+
+def _verify(password, password_hash):
+    return pwd_context.verify(password, password_hash)
+
+
+class PasswordHasher(object):
+    """
+    Hashes and verifies passwords in a pool of worker processes so that a
+    burst of signups or logins doesn't stall the other requests handled by
+    this process.
+
+    The calling thread still waits for the result, so other requests only
+    proceed meanwhile when the web process serves them from other threads,
+    as the gthread workers in the Procfile do.  Under sync gunicorn workers
+    the pool gives no concurrency.
+
+    With no workers configured hashing runs synchronously on the calling
+    thread, which is what the tests use.
+    """
+
+    def __init__(self, n_workers=0):
+        self.n_workers = n_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.n_hashes = 0
+        self.total_hash_time = 0.0
+        self.max_hash_time = 0.0
+
+    def set_config(self, config):
+        self.shutdown()
+        self.n_workers = int(config.PASSWORD_HASH_WORKERS)
+
+    def _get_executor(self):
+        # The pool is created lazily so that each forked web worker gets its own.
+        with self._lock:
+            if self._executor is None and self.n_workers > 0:
+                self._executor = futures.ProcessPoolExecutor(max_workers=self.n_workers)
+            return self._executor
+
+    def _run(self, func, *args):
+        start = time.perf_counter()
+        with self._lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            executor = self._get_executor()
+            if executor is None:
+                result = func(*args)
+            else:
+                try:
+                    result = executor.submit(func, *args).result()
+                except BrokenProcessPool:
+                    logger.error('Password hashing pool is broken. Hashing synchronously.')
+                    self.shutdown()
+                    result = func(*args)
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.queue_depth -= 1
+                self.n_hashes += 1
+                self.total_hash_time += duration
+                self.max_hash_time = max(self.max_hash_time, duration)
+        return result
+
+    def encrypt(self, password):
+        return self._run(_encrypt, password)
+
+    def verify(self, password, password_hash):
+        return self._run(_verify, password, password_hash)
+
+    def stats(self):
+        with self._lock:
+            if self.n_hashes:
+                mean_hash_time = self.total_hash_time / self.n_hashes
+            else:
+                mean_hash_time = None
+            return {
+                'workers': self.n_workers,
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'n_hashes': self.n_hashes,
+                'mean_hash_time': mean_hash_time,
+                'max_hash_time': self.max_hash_time,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+password_hasher = PasswordHasher()
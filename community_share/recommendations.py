@@ -0,0 +1,163 @@
+import datetime
+import logging
+import time
+
+import numpy
+import scipy.sparse
+from sqlalchemy import func
+
+from community_share import store, config
+from community_share.models.recommendation import Recommendation
+from community_share.models.search import Search, search_label_table
+from community_share.models.user import User
+
+logger = logging.getLogger(__name__)
+
+# Rows of the score matrix computed at a time.
+CHUNK_SIZE = 1000
+
+# The day this process last updated recommendations, so days when nobody
+# gets any aren't recomputed on every check.
+_last_updated_date = None
+
+
+def get_user_labels(searcher_role, searching_for_role):
+    '''
+    (user_id, label_id) pairs from the active searches of active users with
+    confirmed emails.
+    '''
+    query = store.session.query(Search.searcher_user_id, search_label_table.c.label_id)
+    query = query.join(search_label_table, search_label_table.c.search_id == Search.id)
+    query = query.join(User, User.id == Search.searcher_user_id)
+    query = query.filter(Search.active == True)
+    query = query.filter(Search.searcher_role == searcher_role)
+    query = query.filter(Search.searching_for_role == searching_for_role)
+    query = query.filter(User.active == True)
+    query = query.filter(User.email_confirmed == True)
+    return query.distinct().all()
+
+
+def make_incidence_matrix(user_labels, label_columns):
+    '''
+    The sorted user ids and a sparse matrix with a row for each of them and a
+    one in the column of each of their labels.
+    '''
+    user_ids = numpy.unique([user_id for user_id, _ in user_labels])
+    rows = numpy.searchsorted(user_ids, [user_id for user_id, _ in user_labels])
+    columns = [label_columns[label_id] for _, label_id in user_labels]
+    matrix = scipy.sparse.csr_matrix(
+        (numpy.ones(len(user_labels)), (rows, columns)),
+        shape=(len(user_ids), len(label_columns)),
+    )
+    return user_ids, matrix
+
+
+def top_scores(indices, data, candidate_ids, user_id, limit):
+    '''
+    The `limit` best (candidate_id, score) pairs from the nonzero scores of
+    a row, best first and then by candidate id, leaving out the user.
+    '''
+    keep = candidate_ids[indices] != user_id
+    indices = indices[keep]
+    data = data[keep]
+    if len(data) > limit:
+        # Everything tied with the last score kept is a candidate.
+        threshold = numpy.partition(data, len(data) - limit)[len(data) - limit]
+        best = data >= threshold
+        indices = indices[best]
+        data = data[best]
+    order = numpy.lexsort((candidate_ids[indices], -data))[:limit]
+    return [(int(candidate_ids[indices[i]]), float(data[i])) for i in order]
+
+
+def compute_recommendations(searcher_role, searching_for_role, limit):
+    '''
+    Yields (user_id, [(recommended_user_id, score), ...]) for every user
+    searching as `searcher_role`.
+
+    Users are scored against the users they are searching for by the labels
+    they have in common, each weighted by its inverse document frequency
+    among the candidates so that rarer labels count for more.
+    '''
+    user_labels = get_user_labels(searcher_role, searching_for_role)
+    candidate_labels = get_user_labels(searching_for_role, searcher_role)
+    if user_labels and candidate_labels:
+        label_ids = sorted({label_id for _, label_id in user_labels + candidate_labels})
+        label_columns = {label_id: column for column, label_id in enumerate(label_ids)}
+        user_ids, users = make_incidence_matrix(user_labels, label_columns)
+        candidate_ids, candidates = make_incidence_matrix(candidate_labels, label_columns)
+
+        n_candidates_with_label = numpy.asarray(candidates.sum(axis=0)).ravel()
+        idf = numpy.log((1 + len(candidate_ids)) / (1 + n_candidates_with_label)) + 1
+        weighted_candidates = candidates.dot(scipy.sparse.diags(idf)).T.tocsc()
+
+        for start in range(0, len(user_ids), CHUNK_SIZE):
+            scores = users[start:start + CHUNK_SIZE].dot(weighted_candidates).tocsr()
+            for row, user_id in enumerate(user_ids[start:start + CHUNK_SIZE]):
+                row_slice = slice(scores.indptr[row], scores.indptr[row + 1])
+                recommended = top_scores(
+                    scores.indices[row_slice],
+                    scores.data[row_slice],
+                    candidate_ids,
+                    user_id,
+                    limit,
+                )
+                yield int(user_id), recommended
+
+
+def update_recommendations(searcher_role=Search.EDUCATOR_ROLE):
+    '''
+    Replaces the recommendations for users searching as `searcher_role` in
+    one transaction, so readers see either the old set or the new one.
+    '''
+    start = time.time()
+    searching_for_role = {
+        Search.EDUCATOR_ROLE: Search.COMMUNITY_PARTNER_ROLE,
+        Search.COMMUNITY_PARTNER_ROLE: Search.EDUCATOR_ROLE,
+    }[searcher_role]
+    now = datetime.datetime.utcnow()
+    table = Recommendation.__table__
+    store.session.execute(table.delete().where(table.c.searcher_role == searcher_role))
+    rows = []
+    n_users = 0
+    for user_id, recommended in compute_recommendations(
+            searcher_role,
+            searching_for_role,
+            int(config.RECOMMENDATION_LIMIT),
+    ):
+        n_users += 1
+        rows += [
+            {
+                'user_id': user_id,
+                'searcher_role': searcher_role,
+                'rank': rank,
+                'recommended_user_id': recommended_user_id,
+                'score': score,
+                'active': True,
+                'date_created': now,
+            } for rank, (recommended_user_id, score) in enumerate(recommended)
+        ]
+        if len(rows) >= CHUNK_SIZE:
+            store.session.execute(table.insert(), rows)
+            rows = []
+    if rows:
+        store.session.execute(table.insert(), rows)
+    store.session.commit()
+    logger.info(
+        'Updated {0} recommendations for {1} users in {2:.1f} seconds'.format(
+            searcher_role, n_users, time.time() - start
+        )
+    )
+
+
+def check_recommendations():
+    '''
+    Updates the recommendations if they weren't updated today.
+    '''
+    global _last_updated_date
+    today = datetime.datetime.utcnow().date()
+    if _last_updated_date != today:
+        last_updated = store.session.query(func.max(Recommendation.date_created)).scalar()
+        if last_updated is None or last_updated.date() < today:
+            update_recommendations()
+        _last_updated_date = today
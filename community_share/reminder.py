@@ -23,9 +23,10 @@ def send_reminders():
         ]
         for reminder in event_reminders:
             store.session.add(reminder)
-        store.session.commit()
+        # Committed with the reminders when the emails go through the outbox.
         for event in events:
             mail_actions.send_event_reminder_message(event)
+        store.session.commit()
 
     # Send review reminder one day after they finish.
     send_review_reminders = False
@@ -42,3 +43,4 @@ def send_reminders():
                     # FIXME: Would be nice to have a check in case they
                     # already reviewed it.
                     mail_actions.send_review_reminder_message(user, event)
+        store.session.commit()
@@ -1,4 +1,5 @@
 import logging
+from urllib.parse import urlencode
 
 from flask import jsonify, request, Blueprint
 
@@ -6,7 +7,7 @@ from sqlalchemy import Boolean
 from sqlalchemy.exc import IntegrityError, InvalidRequestError
 from sqlalchemy.orm.attributes import instance_state
 
-from community_share import store
+from community_share import mail, store
 from community_share.utils import StatusCodes, is_integer
 from community_share.authorization import get_requesting_user
 from community_share.models.base import ValidationException
@@ -66,15 +67,49 @@ def make_server_error_response(message=None):
     return response
 
 
-def make_many_response(requester, items):
-    serialized = [item.serialize(requester) for item in items]
+def make_many_response(requester, items, links=None, expand=None):
+    items = list(items)
+    if expand and items:
+        type(items[0]).prefetch_expansions(items, expand)
+    roles = None
+    if items:
+        roles = type(items[0]).resolve_roles(items, requester)
+    if roles is None:
+        serialized = [item.serialize(requester, expand=expand) for item in items]
+    else:
+        serialized = [
+            item.serialize(requester, expand=expand, role=roles[item.id])
+            for item in items if roles.get(item.id) is not None
+        ]
     serialized = [s for s in serialized if s is not None]
     response_data = {'data': serialized}
+    if links is not None:
+        response_data['links'] = links
     response = jsonify(response_data)
     return response
 
 
-def make_single_response(requester, item, include_user=None):
+def make_page_response(requester, Item, query, expand=None):
+    '''
+    Runs a list query with the pagination requested in the arguments and
+    links to the next page when there is one.
+    '''
+    query, limit = Item.paginate_query(query, request.args)
+    # Expanded relationships are loaded by the expansion instead.
+    items = query.options(*Item.eager_load_options(exclude=tuple(expand or ()))).all()
+    links = [{'rel': 'self', 'href': request.url}]
+    if limit is not None and len(items) > limit:
+        items = items[:limit]
+        args = request.args.to_dict(flat=False)
+        args['after_id'] = items[-1].id
+        links.append({
+            'rel': 'next_page',
+            'href': '{0}?{1}'.format(request.base_url, urlencode(args, doseq=True)),
+        })
+    return make_many_response(requester, items, links=links, expand=expand)
+
+
+def make_single_response(requester, item, include_user=None, expand=None):
     '''
     Sometimes we want to include the current user info in the response
     since it might be changed by a request.
@@ -82,7 +117,7 @@ def make_single_response(requester, item, include_user=None):
     if item is None:
         response = make_not_found_response()
     else:
-        serialized = item.serialize(requester)
+        serialized = item.serialize(requester, expand=expand)
         if serialized is None:
             response = make_forbidden_response()
         else:
@@ -109,12 +144,12 @@ def make_blueprint(Item, resourceName):
                 if (Item.PERMISSIONS.get('standard_can_read_many', False) or
                     Item.PERMISSIONS.get('all_can_read_many', False)):
                     try:
+                        expand = Item.parse_expand(request.args.getlist('expand'))
                         query = Item.args_to_query(request.args, requester)
                         if query is None:
                             response = make_forbidden_response()
                         else:
-                            items = query.all()
-                            response = make_many_response(requester, items)
+                            response = make_page_response(requester, Item, query, expand)
                     except ValueError as e:
                         error_message = ', '.join(e.args)
                         response = make_bad_request_response(e.args[0])
@@ -122,9 +157,9 @@ def make_blueprint(Item, resourceName):
                     response = make_forbidden_response()
             else:
                 try:
+                    expand = Item.parse_expand(request.args.getlist('expand'))
                     query = Item.args_to_query(request.args, requester)
-                    items = query.all()
-                    response = make_many_response(requester, items)
+                    response = make_page_response(requester, Item, query, expand)
                 except ValueError as e:
                     error_message = ', '.join(e.args)
                     response = make_bad_request_response(e.args[0])
@@ -139,10 +174,15 @@ def make_blueprint(Item, resourceName):
             response = make_bad_request_user()
         else:
             item = store.session.query(Item).filter_by(id=id, active=True).first()
-            if item is None:
-                response = make_not_found_response()
+            try:
+                expand = Item.parse_expand(request.args.getlist('expand'))
+            except ValueError as e:
+                response = make_bad_request_response(e.args[0])
             else:
-                response = make_single_response(requester, item)
+                if item is None:
+                    response = make_not_found_response()
+                else:
+                    response = make_single_response(requester, item, expand=expand)
         return response
 
     @api.route(API_MANY_FORMAT.format(resourceName), methods=['POST'])
@@ -162,7 +202,11 @@ def make_blueprint(Item, resourceName):
             try:
                 item = Item.admin_deserialize_add(data)
                 store.session.add(item)
-                store.session.commit()
+                if mail.sends_in_transaction():
+                    # Emails from on_add are committed with the item.
+                    store.session.flush()
+                else:
+                    store.session.commit()
                 refreshed_item = store.session.query(Item).filter_by(id=item.id).first()
                 refreshed_item.on_add(requester)
                 # commit again in case on_add changed it.
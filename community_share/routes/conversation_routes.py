@@ -1,5 +1,13 @@
-from community_share.models.conversation import Conversation, Message
+from urllib.parse import urlencode
+
+from flask import Response, jsonify, request, stream_with_context
+
+from community_share import message_events, store
+from community_share.authorization import get_requesting_user
+from community_share.models.conversation import Conversation, InboxEntry, Message
+from community_share.models.user import User
 from community_share.routes import base_routes
+from community_share.utils import int_or
 
 
 def register_conversation_routes(app):
@@ -9,3 +17,150 @@ def register_conversation_routes(app):
 
     message_blueprint = base_routes.make_blueprint(Message, 'message')
     app.register_blueprint(message_blueprint)
+
+    @app.route('/api/inbox', methods=['GET'])
+    def get_inbox():
+        requester = get_requesting_user()
+        limit = int_or(request.args.get('limit'), InboxEntry.DEFAULT_LIMIT)
+        offset = int_or(request.args.get('offset'), 0)
+        if requester is None:
+            response = base_routes.make_not_authorized_response()
+        elif not 0 < limit <= InboxEntry.MAX_LIMIT or offset < 0:
+            response = base_routes.make_bad_request_response(
+                'limit must be between 1 and {0}'.format(InboxEntry.MAX_LIMIT)
+            )
+        else:
+            unread_only = request.args.get('unread', 'false') == 'true'
+            # One more than asked for shows whether there is a next page.
+            entries = InboxEntry.inbox(requester.id, unread_only, limit + 1, offset)
+            links = [{'rel': 'self', 'href': request.url}]
+            if len(entries) > limit:
+                entries = entries[:limit]
+                args = request.args.to_dict()
+                args['offset'] = offset + limit
+                links.append({
+                    'rel': 'next_page',
+                    'href': '{0}?{1}'.format(request.base_url, urlencode(args)),
+                })
+            response = base_routes.make_many_response(requester, entries, links=links)
+        return response
+
+    @app.route('/api/conversation/<int:conversation_id>/messages', methods=['GET'])
+    def get_conversation_messages(conversation_id):
+        requester = get_requesting_user()
+        limit = int_or(request.args.get('limit'), Message.DEFAULT_PAGE_LIMIT)
+        before_id = request.args.get('before_id', None)
+        after_id = request.args.get('after_id', None)
+        cursor_ids = [int_or(i, None) for i in (before_id, after_id) if i is not None]
+        if requester is None:
+            response = base_routes.make_not_authorized_response()
+        elif not 0 < limit <= Message.MAX_PAGE_LIMIT:
+            response = base_routes.make_bad_request_response(
+                'limit must be between 1 and {0}'.format(Message.MAX_PAGE_LIMIT)
+            )
+        elif before_id is not None and after_id is not None:
+            response = base_routes.make_bad_request_response(
+                'before_id and after_id can not be used together'
+            )
+        elif None in cursor_ids:
+            response = base_routes.make_bad_request_response('Message ids must be integers')
+        else:
+            conversation = store.session.query(Conversation).filter_by(
+                id=conversation_id, active=True
+            ).first()
+            if conversation is None:
+                response = base_routes.make_not_found_response()
+            elif not conversation.has_admin_rights(requester):
+                response = base_routes.make_forbidden_response()
+            else:
+                before_id = int_or(before_id, None)
+                after_id = int_or(after_id, None)
+                # One more than asked for shows whether the page is the last.
+                messages = Message.page(conversation_id, limit + 1, before_id, after_id)
+                more = len(messages) > limit
+                if after_id is None:
+                    messages = messages[-limit:]
+                else:
+                    messages = messages[:limit]
+                links = [{'rel': 'self', 'href': request.url}]
+                # Older messages are in previous pages.  There is always a next
+                # page, to poll for new messages.
+                if messages and (more or after_id is not None):
+                    args = {'limit': limit, 'before_id': messages[0].id}
+                    links.append({
+                        'rel': 'prev_page',
+                        'href': '{0}?{1}'.format(request.base_url, urlencode(args)),
+                    })
+                if messages:
+                    next_after_id = messages[-1].id
+                elif after_id is not None:
+                    next_after_id = after_id
+                else:
+                    # Nothing is older than an empty page, so new messages
+                    # are after all of them.
+                    next_after_id = 0
+                args = {'limit': limit, 'after_id': next_after_id}
+                links.append({
+                    'rel': 'next_page',
+                    'href': '{0}?{1}'.format(request.base_url, urlencode(args)),
+                })
+                response = base_routes.make_many_response(requester, messages, links=links)
+        return response
+
+    @app.route('/api/conversation/<int:conversation_id>/viewed', methods=['POST'])
+    def mark_messages_viewed(conversation_id):
+        requester = get_requesting_user()
+        data = request.get_json(silent=True) or {}
+        up_to_id = data.get('up_to_id', None)
+        if requester is None:
+            response = base_routes.make_not_authorized_response()
+        elif not isinstance(up_to_id, int) or isinstance(up_to_id, bool):
+            response = base_routes.make_bad_request_response('up_to_id must be a message id')
+        else:
+            conversation = store.session.query(Conversation).filter_by(
+                id=conversation_id, active=True
+            ).first()
+            if conversation is None:
+                response = base_routes.make_not_found_response()
+            elif not conversation.is_in_conversation(requester):
+                # Messages are marked viewed for their receiver.
+                response = base_routes.make_forbidden_response()
+            else:
+                n_viewed, unread_count = conversation.mark_messages_viewed(requester.id, up_to_id)
+                store.session.commit()
+                response = jsonify({'data': {'viewed': n_viewed, 'unread_count': unread_count}})
+        return response
+
+    @app.route('/api/messages/stream_token', methods=['GET'])
+    def get_stream_token():
+        requester = get_requesting_user()
+        if requester is None:
+            response = base_routes.make_not_authorized_response()
+        else:
+            token = requester.make_stream_token()
+            response = jsonify({'data': {'token': token.key, 'expiration': token.expiration}})
+        return response
+
+    @app.route('/api/messages/stream', methods=['GET'])
+    def stream_messages():
+        requester = get_requesting_user()
+        token = request.args.get('token', None)
+        if requester is None and token is not None:
+            # EventSource can't send headers, so a stream token, which expires
+            # soon and authorizes nothing else, can be in the URL.
+            requester = User.from_stream_token(token)
+            if requester is not None and not requester.active:
+                requester = None
+        # Reconnecting clients send the id of the last event they saw.
+        last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+        if requester is None:
+            response = base_routes.make_not_authorized_response()
+        elif last_event_id is not None and int_or(last_event_id, None) is None:
+            response = base_routes.make_bad_request_response('Last-Event-ID must be an integer')
+        else:
+            events = message_events.stream_messages(requester.id, int_or(last_event_id, None))
+            response = Response(stream_with_context(events), mimetype='text/event-stream')
+            response.headers['Cache-Control'] = 'no-cache'
+            # Stops proxies from buffering the stream.
+            response.headers['X-Accel-Buffering'] = 'no'
+        return response
@@ -5,9 +5,9 @@ import hashlib, hmac
 from flask import request
 
 from community_share.models.conversation import Message
-from community_share.mail import Email, get_mailer
+from community_share.mail import Email, get_mailer, receives_from_mailgun
 from community_share.mail_actions import append_conversation_link
-from community_share import config, store
+from community_share import store
 from community_share.routes import base_routes
 
 logger = logging.getLogger(__name__)
@@ -19,7 +19,7 @@ def register_email_routes(app):
 
         logger.debug('Received an email.')
 
-        if config.MAILER_TYPE == 'MAILGUN':
+        if receives_from_mailgun():
             verify = True
         else:
             verify = False
@@ -55,5 +55,6 @@ def register_email_routes(app):
                 new_content=forward_new_content,
             )
             error_message = get_mailer().send(forward_email)
+            store.session.commit()
         response = base_routes.make_OK_response()
         return response
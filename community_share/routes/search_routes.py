@@ -1,10 +1,12 @@
-from flask import jsonify
+from flask import jsonify, request
 
 from community_share.models.search import Search, Label
+from community_share.models.recommendation import Recommendation
 from community_share import search_utils, store
 from community_share.routes import base_routes
 from community_share.authorization import get_requesting_user
-from community_share.utils import is_integer
+from community_share.label_completer import label_completer, MAX_COMPLETIONS
+from community_share.utils import int_or, is_integer
 
 
 def register_search_routes(app):
@@ -12,12 +14,31 @@ def register_search_routes(app):
     search_blueprint = base_routes.make_blueprint(Search, 'search')
     app.register_blueprint(search_blueprint)
 
+    recommendation_blueprint = base_routes.make_blueprint(Recommendation, 'recommendation')
+    app.register_blueprint(recommendation_blueprint)
+
     @app.route('/api/labels')
     def get_labels():
-        labels = store.session.query(Label).filter(Label.active == True).all()
-        labelnames = [label.name for label in labels]
+        query = store.session.query(Label.name).filter(Label.active == True)
+        labelnames = [name for name, in query.order_by(Label.id)]
         response_data = {'data': labelnames}
         response = jsonify(response_data)
+        # Clients send the ETag back and get a 304 while the labels are unchanged.
+        response.add_etag()
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    @app.route('/api/labels/complete')
+    def complete_labels():
+        prefix = request.args.get('prefix', '')
+        number = int_or(request.args.get('number'), 10)
+        if not 0 < number <= MAX_COMPLETIONS:
+            response = base_routes.make_bad_request_response(
+                'number must be between 1 and {0}'.format(MAX_COMPLETIONS)
+            )
+        else:
+            completions = label_completer.complete(prefix, number)
+            response = jsonify({'data': completions})
         return response
 
     @app.route(base_routes.API_PAGINATION_FORMAT.format('search') + '/results', methods=['GET'])
@@ -7,7 +7,7 @@ from werkzeug.utils import secure_filename
 from community_share.models.user import User, UserReview
 from community_share.models.institution import Institution
 from community_share.authorization import get_requesting_user
-from community_share import mail_actions
+from community_share import mail, mail_actions
 from community_share.routes import base_routes
 from community_share import store
 from community_share.models.base import ValidationException
@@ -52,8 +52,13 @@ def register_user_routes(app):
                     response = base_routes.make_bad_request_response(error_message)
                 else:
                     store.session.add(user)
-                    store.session.commit()
+                    if mail.sends_in_transaction():
+                        # The confirmation email is committed with the user.
+                        store.session.flush()
+                    else:
+                        store.session.commit()
                     error_message = mail_actions.request_signup_email_confirmation(user)
+                    store.session.commit()
                     secret = user.make_api_key()
                     serialized = user.serialize(user)
                     warning_message = 'Failed to send email confirmation: {0}'.format(error_message)
@@ -96,6 +101,7 @@ def register_user_routes(app):
             response = base_routes.make_not_found_response()
         else:
             error_message = mail_actions.request_password_reset(user)
+            store.session.commit()
             if error_message:
                 response = base_routes.make_server_error_response(error_message)
             else:
@@ -144,6 +150,7 @@ def register_user_routes(app):
             response = base_routes.make_not_authorized_response()
         else:
             error_message = mail_actions.request_signup_email_confirmation(requester)
+            store.session.commit()
             if error_message:
                 response = base_routes.make_server_error_response(error_message)
             else:
@@ -1,8 +1,119 @@
+import logging
+
+from sqlalchemy.orm import subqueryload
 from sqlalchemy.sql.expression import func
 
-from community_share.models.search import Search, Label
+from community_share.models.search import Search, SearchMatch, Label, search_label_table
 from community_share.models.user import User
-from community_share import store
+from community_share import store, config, geo
+from community_share.label_index import label_index
+
+logger = logging.getLogger(__name__)
+
+
+def _label_matches_query(columns, labelnames, searcher_role, searching_for_role):
+    query = store.session.query(Search.id, func.count(Label.id).label('matches'), *columns)
+    query = query.join(Search.labels)
+    query = query.filter(Label.normalized_name.in_(labelnames))
+    query = query.filter(Search.active == True)
+    query = query.filter(Search.searcher_role == searcher_role)
+    query = query.filter(Search.searching_for_role == searching_for_role)
+    query = query.join(Search.searcher_user)
+    query = query.filter(User.email_confirmed == True)
+    query = query.filter(User.active == True)
+    query = query.group_by(Search.id)
+    return query
+
+
+def get_search_ids_ordered_by_label_matches_from_db(
+        labelnames,
+        searcher_role,
+        searching_for_role,
+        offset_number,
+        max_number,
+):
+    query = _label_matches_query([], labelnames, searcher_role, searching_for_role)
+    query = query.order_by('matches DESC')
+    return [search_id for search_id, _ in query.offset(offset_number).limit(max_number)]
+
+
+def get_search_ids_near_from_db(
+        labelnames,
+        searcher_role,
+        searching_for_role,
+        near,
+        offset_number,
+        max_number,
+):
+    latitude, longitude, radius = near
+    query = _label_matches_query(
+        [Search.latitude, Search.longitude, Search.distance],
+        labelnames,
+        searcher_role,
+        searching_for_role,
+    )
+    cells = geo.grid_cells_within(latitude, longitude, radius)
+    if cells is None:
+        query = query.filter(Search.grid_cell != None)
+    else:
+        query = query.filter(Search.grid_cell.in_(cells))
+    ranked = geo.rank_nearby(query.all(), latitude, longitude, radius)
+    return ranked[offset_number:offset_number + max_number]
+
+
+def get_ranked_search_ids(
+        labelnames,
+        searcher_role,
+        searching_for_role,
+        offset_number,
+        max_number,
+        near=None,
+        use_index=True,
+):
+    search_ids = None
+    if use_index:
+        search_ids = label_index.ranked_search_ids(
+            labelnames,
+            searcher_role,
+            searching_for_role,
+            offset=offset_number,
+            number=max_number,
+            near=near,
+        )
+    if search_ids is None and near is not None:
+        search_ids = get_search_ids_near_from_db(
+            labelnames,
+            searcher_role,
+            searching_for_role,
+            near,
+            offset_number,
+            max_number,
+        )
+    elif search_ids is None:
+        # The index hasn't been built in this process yet.
+        search_ids = get_search_ids_ordered_by_label_matches_from_db(
+            labelnames,
+            searcher_role,
+            searching_for_role,
+            offset_number,
+            max_number,
+        )
+    return search_ids
+
+
+def load_searches(search_ids):
+    # Load the matching searches in a second query so everything they
+    # serialize can be eager loaded without being grouped by.
+    if search_ids:
+        searches_by_id = {
+            search.id: search
+            for search in store.session.query(Search).filter(Search.id.in_(search_ids))
+            .options(*Search.eager_load_options())
+        }
+        searches = [searches_by_id[search_id] for search_id in search_ids]
+    else:
+        searches = []
+    return searches
 
 
 def get_searches_ordered_by_label_matches(
@@ -11,33 +122,133 @@ def get_searches_ordered_by_label_matches(
         searching_for_role,
         offset_number=0,
         max_number=10,
+        near=None,
 ):
 
     if offset_number > 0:
         offset_number *= max_number
 
-    labelnames = [label.name.lower() for label in labels]
-    query = store.session.query(Search, func.count(Label.id).label('matches'))
-    query = query.join(Search.labels)
-    query = query.filter(func.lower(Label.name).in_(labelnames))
-    query = query.filter(Search.active == True)
-    query = query.filter(Search.searcher_role == searcher_role)
-    query = query.filter(Search.searching_for_role == searching_for_role)
+    labelnames = [label.normalized_name for label in labels]
+    search_ids = get_ranked_search_ids(
+        labelnames,
+        searcher_role,
+        searching_for_role,
+        offset_number,
+        max_number,
+        near=near,
+    )
+    return load_searches(search_ids)
+
+
+def get_near(search):
+    # Searches with a location and a distance only match searches within
+    # that distance.
+    near = None
+    if search.latitude is not None and search.longitude is not None and search.distance:
+        near = (search.latitude, search.longitude, search.distance)
+    return near
+
+
+def get_materialized_search_ids(search, offset_number, max_number):
+    query = store.session.query(SearchMatch.matched_search_id)
+    query = query.join(Search, Search.id == SearchMatch.matched_search_id)
     query = query.join(Search.searcher_user)
+    query = query.filter(SearchMatch.search_id == search.id)
+    query = query.filter(SearchMatch.rank >= offset_number)
+    query = query.filter(SearchMatch.rank < offset_number + max_number)
+    # Skip searches that stopped matching since the matches were computed.
+    query = query.filter(Search.active == True)
     query = query.filter(User.email_confirmed == True)
     query = query.filter(User.active == True)
-    query = query.group_by(Search.id)
-    query = query.order_by('matches DESC')
-    searches_and_count = query.offset(offset_number).limit(max_number)
-    searches = [sc[0] for sc in searches_and_count]
-    return searches
+    query = query.order_by(SearchMatch.rank)
+    return [search_id for search_id, in query]
 
 
-def find_matching_searches(search, page):
-    searches = get_searches_ordered_by_label_matches(
-        search.labels,
+def refresh_search_matches(search):
+    '''
+    Recomputes the materialized matches of a search.  The caller commits.
+    '''
+    version = search.match_version
+    labelnames = [label.normalized_name for label in search.labels]
+    # Other processes' changes only reach the label index when it is
+    # rebuilt, so rank in SQL to see every committed search.
+    search_ids = get_ranked_search_ids(
+        labelnames,
         searcher_role=search.searching_for_role,
         searching_for_role=search.searcher_role,
-        offset_number=page,
+        offset_number=0,
+        max_number=int(config.SEARCH_MATCH_LIMIT),
+        near=get_near(search),
+        use_index=False,
+    )
+    scores = {}
+    if search_ids:
+        query = store.session.query(search_label_table.c.search_id, func.count())
+        query = query.join(Label, Label.id == search_label_table.c.label_id)
+        query = query.filter(search_label_table.c.search_id.in_(search_ids))
+        query = query.filter(Label.normalized_name.in_(labelnames))
+        query = query.group_by(search_label_table.c.search_id)
+        scores = dict(query.all())
+    store.session.execute(
+        SearchMatch.__table__.delete().where(SearchMatch.search_id == search.id)
     )
+    if search_ids:
+        store.session.execute(
+            SearchMatch.__table__.insert(),
+            [
+                {
+                    'search_id': search.id,
+                    'rank': rank,
+                    'matched_search_id': matched_search_id,
+                    'score': scores.get(matched_search_id, 0),
+                } for rank, matched_search_id in enumerate(search_ids)
+            ],
+        )
+    # Changes made while ranking leave the search stale for the next refresh.
+    store.session.execute(
+        Search.__table__.update().where(Search.id == search.id).values(matched_version=version)
+    )
+
+
+def refresh_stale_search_matches(batch_size=100):
+    '''
+    Recomputes the materialized matches of the searches marked stale and
+    returns how many were refreshed.
+    '''
+    n_refreshed = 0
+    last_id = 0
+    while True:
+        query = store.session.query(Search).options(subqueryload(Search.labels))
+        query = query.filter(Search.id > last_id)
+        query = query.filter(Search.active == True)
+        query = query.filter(Search.match_version > Search.matched_version)
+        searches = query.order_by(Search.id).limit(batch_size).all()
+        if not searches:
+            break
+        for search in searches:
+            refresh_search_matches(search)
+        store.session.commit()
+        last_id = searches[-1].id
+        n_refreshed += len(searches)
+    if n_refreshed:
+        logger.info('Refreshed the matches of {0} searches'.format(n_refreshed))
+    return n_refreshed
+
+
+def find_matching_searches(search, page, max_number=10):
+    offset_number = page * max_number
+    if search.matched_version > 0 and offset_number < int(config.SEARCH_MATCH_LIMIT):
+        # Pages are read from the materialized matches, even while they are
+        # being refreshed.
+        search_ids = get_materialized_search_ids(search, offset_number, max_number)
+        searches = load_searches(search_ids)
+    else:
+        searches = get_searches_ordered_by_label_matches(
+            search.labels,
+            searcher_role=search.searching_for_role,
+            searching_for_role=search.searcher_role,
+            offset_number=page,
+            max_number=max_number,
+            near=get_near(search),
+        )
     return searches
@@ -0,0 +1,107 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import Column, DateTime, Integer, String, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.declarative import declarative_base
+
+from community_share import Base, config, store
+from community_share.models.base import Serializable
+from community_share.models.search import Label
+# Registers the tables labels refer to.
+from community_share.models import user
+
+TestBase = declarative_base()
+
+
+class Stamped(TestBase, Serializable):
+    __tablename__ = 'stamped'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), nullable=False, unique=True)
+    date_created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    kind = Column(String(10), default='plain')
+
+
+class Counted(TestBase, Serializable):
+    __tablename__ = 'counted'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), nullable=False, unique=True)
+    date_created = Column(DateTime, default=func.now())
+
+# A Postgres database the tests may create tables in and drop them from.
+POSTGRES_CONNECTION = os.environ.get('TEST_POSTGRES_CONNECTION', None)
+
+
+class BulkGetOrCreateTest(unittest.TestCase):
+    '''
+    Runs Serializable.bulk_get_or_create against SQLite.
+    '''
+
+    def connect(self):
+        self.db_file = tempfile.NamedTemporaryFile(suffix='.db')
+        self.addCleanup(self.db_file.close)
+        return 'sqlite:///{}'.format(self.db_file.name)
+
+    def setUp(self):
+        config.load_config('./config.dev.json')
+        config.DB_CONNECTION = self.connect()
+        store.set_config(config)
+        Base.metadata.create_all(store.engine)
+        TestBase.metadata.create_all(store.engine)
+        store.session.add(Label(name='Robots', normalized_name='robots'))
+        store.session.commit()
+
+    def tearDown(self):
+        store.session.remove()
+        TestBase.metadata.drop_all(store.engine)
+        Base.metadata.drop_all(store.engine)
+
+    def test_get_or_create(self):
+        labels = Label.bulk_get_or_create('normalized_name', [
+            {'name': 'ROBOTS', 'normalized_name': 'robots'},
+            {'name': 'Dogs', 'normalized_name': 'dogs'},
+            {'name': 'DOGS', 'normalized_name': 'dogs'},
+        ])
+        store.session.commit()
+        self.assertEqual(sorted(labels), ['dogs', 'robots'])
+        # Existing rows are left unchanged and the first of new rows is kept.
+        self.assertEqual(labels['robots'].name, 'Robots')
+        self.assertEqual(labels['dogs'].name, 'Dogs')
+        self.assertTrue(labels['dogs'].active)
+        self.assertEqual(store.session.query(Label).count(), 2)
+
+    def test_other_constraints(self):
+        # Only conflicts on the key are ignored.
+        with self.assertRaises(IntegrityError):
+            Label.bulk_get_or_create('normalized_name', [
+                {'name': 'Robots', 'normalized_name': 'robots!'},
+            ])
+        store.session.rollback()
+        with self.assertRaises(IntegrityError):
+            Label.bulk_get_or_create('normalized_name', [
+                {'name': None, 'normalized_name': 'cats'},
+            ])
+
+    def test_defaults(self):
+        before = datetime.datetime.utcnow()
+        rows = Stamped.bulk_get_or_create('name', [{'name': 'a'}, {'name': 'b', 'kind': 'odd'}])
+        store.session.commit()
+        self.assertEqual({name: row.kind for name, row in rows.items()}, {'a': 'plain', 'b': 'odd'})
+        self.assertTrue(all(row.date_created >= before for row in rows.values()))
+        # Defaults computed by the database aren't filled in.
+        with self.assertRaises(ValueError):
+            Counted.bulk_get_or_create('name', [{'name': 'a'}])
+
+
+@unittest.skipIf(POSTGRES_CONNECTION is None, 'TEST_POSTGRES_CONNECTION is not set')
+class PostgresBulkGetOrCreateTest(BulkGetOrCreateTest):
+    '''
+    Runs the same tests against Postgres, which uses a single statement.
+    '''
+
+    def connect(self):
+        return POSTGRES_CONNECTION
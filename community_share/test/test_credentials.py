@@ -0,0 +1,64 @@
+import unittest
+from unittest import mock
+
+from community_share.credentials import CredentialCache
+
+
+class User:
+    def __init__(self, id, email='a@example.com', password_hash='hash'):
+        self.id = id
+        self.email = email
+        self.password_hash = password_hash
+
+
+class CredentialCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = CredentialCache(max_size=2, ttl=60)
+
+    def test_miss_then_hit(self):
+        user = User(1)
+        self.assertFalse(self.cache.is_verified(user, 'password'))
+        self.cache.add(user, 'password')
+        self.assertTrue(self.cache.is_verified(user, 'password'))
+        self.assertFalse(self.cache.is_verified(user, 'wrong'))
+        self.assertEqual({'hits': 1, 'misses': 2, 'size': 1}, self.cache.stats())
+
+    def test_does_not_store_plaintext(self):
+        self.cache.add(User(1), 'password')
+        for key, value in self.cache._entries.items():
+            self.assertNotIn(b'password', key)
+            self.assertNotIn('password', value)
+
+    def test_changed_hash_misses(self):
+        user = User(1)
+        self.cache.add(user, 'password')
+        user.password_hash = 'new_hash'
+        self.assertFalse(self.cache.is_verified(user, 'password'))
+
+    def test_invalidate_user(self):
+        userA = User(1, email='a@example.com')
+        userB = User(2, email='b@example.com')
+        self.cache.add(userA, 'password')
+        self.cache.add(userB, 'password')
+        self.cache.invalidate_user(1)
+        self.assertFalse(self.cache.is_verified(userA, 'password'))
+        self.assertTrue(self.cache.is_verified(userB, 'password'))
+
+    def test_bounded(self):
+        users = [User(i, email='{}@example.com'.format(i)) for i in range(3)]
+        for user in users:
+            self.cache.add(user, 'password')
+        self.assertEqual(2, self.cache.stats()['size'])
+        self.assertFalse(self.cache.is_verified(users[0], 'password'))
+        self.assertTrue(self.cache.is_verified(users[2], 'password'))
+
+    def test_expires(self):
+        user = User(1)
+        with mock.patch('community_share.credentials.time.monotonic', return_value=0):
+            self.cache.add(user, 'password')
+        with mock.patch('community_share.credentials.time.monotonic', return_value=61):
+            self.assertFalse(self.cache.is_verified(user, 'password'))
+
+
+if __name__ == '__main__':
+    unittest.main()
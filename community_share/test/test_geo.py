@@ -0,0 +1,50 @@
+import random
+import unittest
+
+from community_share import geo
+
+
+class GeoTest(unittest.TestCase):
+    def test_haversine_distances(self):
+        # Tucson to Phoenix is about 108 miles.
+        distances = geo.haversine_distances(
+            32.2217, -110.9265, [32.2217, 33.4484], [-110.9265, -112.0740]
+        )
+        self.assertAlmostEqual(distances[0], 0)
+        self.assertAlmostEqual(distances[1], 108, delta=1)
+
+    def test_grid_cells_within(self):
+        random.seed(0)
+        for latitude, longitude, radius in (
+            (32.2, -110.9, 50),
+            (0.1, 179.9, 100),
+            (-60, -179.9, 200),
+            (70, 10, 100),
+        ):
+            cells = set(geo.grid_cells_within(latitude, longitude, radius))
+            for _ in range(1000):
+                other_latitude = latitude + random.uniform(-5, 5)
+                other_longitude = longitude + random.uniform(-10, 10)
+                other_latitude = max(min(other_latitude, 90), -90)
+                other_longitude = (other_longitude + 180) % 360 - 180
+                distance = geo.haversine_distances(
+                    latitude, longitude, [other_latitude], [other_longitude]
+                )[0]
+                if distance <= radius:
+                    self.assertIn(geo.grid_cell(other_latitude, other_longitude), cells)
+
+    def test_grid_cells_within_large_radius(self):
+        self.assertIsNone(geo.grid_cells_within(32.2, -110.9, 2000))
+
+    def test_rank_nearby(self):
+        candidates = [
+            (1, 1, 32.4367, -111.2254, None),
+            (2, 1, 31.9576, -110.9556, 30),
+            (3, 2, 32.4367, -111.2254, None),
+            (4, 3, 33.4484, -112.0740, None),
+            (5, 3, None, None, None),
+            (6, 3, 31.9576, -110.9556, 10),
+        ]
+        ranked = geo.rank_nearby(candidates, 32.2217, -110.9265, 50)
+        self.assertEqual([3, 2, 1], ranked)
+        self.assertEqual([], geo.rank_nearby([], 32.2217, -110.9265, 50))
@@ -0,0 +1,42 @@
+import random
+import string
+import unittest
+
+from community_share.label_completer import MAX_COMPLETIONS, build_trie
+
+
+def complete(root, names, prefix):
+    node = root
+    for character in prefix:
+        node = node.children.get(character)
+        if node is None:
+            return []
+    return [names[index] for index in node.top]
+
+
+class LabelCompleterTest(unittest.TestCase):
+    def test_completes_words_by_popularity(self):
+        names = ['robots', 'high school', 'rock climbing', 'school gardens', 'art']
+        root = build_trie(names)
+        self.assertEqual(complete(root, names, 'ro'), ['robots', 'rock climbing'])
+        self.assertEqual(complete(root, names, 'school'), ['high school', 'school gardens'])
+        self.assertEqual(complete(root, names, 'high s'), ['high school'])
+        self.assertEqual(complete(root, names, 'x'), [])
+        self.assertEqual(complete(root, names, ''), names)
+
+    def test_matches_brute_force(self):
+        random.seed(0)
+        names = sorted({
+            ' '.join(
+                ''.join(random.choice('abc') for _ in range(random.randint(1, 4)))
+                for _ in range(random.randint(1, 3))
+            ) for _ in range(500)
+        })
+        random.shuffle(names)
+        root = build_trie(names)
+        for prefix in ['', 'a', 'ab', 'c b', 'bca', 'cc a']:
+            expected = [
+                name for name in names
+                if name.startswith(prefix) or (' ' + name).find(' ' + prefix) >= 0
+            ][:MAX_COMPLETIONS]
+            self.assertEqual(complete(root, names, prefix), expected)
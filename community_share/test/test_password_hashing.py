@@ -0,0 +1,32 @@
+import unittest
+
+from community_share.password_hashing import PasswordHasher
+
+
+class PasswordHasherTest(unittest.TestCase):
+    def check_hasher(self, hasher):
+        password_hash = hasher.encrypt('password')
+        self.assertTrue(hasher.verify('password', password_hash))
+        self.assertFalse(hasher.verify('wrong', password_hash))
+        stats = hasher.stats()
+        self.assertEqual(3, stats['n_hashes'])
+        self.assertEqual(0, stats['queue_depth'])
+        self.assertEqual(1, stats['max_queue_depth'])
+        self.assertGreater(stats['mean_hash_time'], 0)
+
+    def test_synchronous(self):
+        hasher = PasswordHasher(n_workers=0)
+        self.check_hasher(hasher)
+        self.assertIsNone(hasher._executor)
+
+    def test_process_pool(self):
+        hasher = PasswordHasher(n_workers=1)
+        try:
+            self.check_hasher(hasher)
+            self.assertIsNotNone(hasher._executor)
+        finally:
+            hasher.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,273 @@
+import datetime
+import re
+import tempfile
+import unittest
+
+from sqlalchemy import event
+from werkzeug.datastructures import MultiDict
+
+from community_share import Base, config, store
+from community_share.models import user_search
+from community_share.models.user import User, UserReview
+from community_share.models.conversation import Conversation, InboxEntry, Message
+from community_share.models.search import Label, Search, search_label_table
+from community_share.models.share import Event, EventReminder, Share
+from community_share.models.statistics import Statistic
+from community_share import search_utils
+
+N_USERS = 500
+N_LABELS = 50
+
+# A full scan of a table reads as 'SCAN <table>', older SQLite versions say
+# 'SCAN TABLE <table>'.  Scans through an index name the index.  Tables may
+# be aliased as <table>_<n>.
+FULL_SCAN_PATTERN = re.compile(r'^SCAN (?:TABLE )?(\w+?)(?:_\d+)?$')
+
+
+def seed(connection):
+    now = datetime.datetime.utcnow()
+    connection.execute(
+        User.__table__.insert(),
+        [
+            {
+                'id': user_id,
+                'name': 'User {}'.format(user_id),
+                'email': 'user{}@example.com'.format(user_id),
+                'email_confirmed': True,
+                'active': True,
+                'is_administrator': False,
+                'wants_update_emails': False,
+                'api_key_generation': 0,
+                'date_created': now - datetime.timedelta(hours=user_id),
+                'last_active': now - datetime.timedelta(hours=user_id),
+            } for user_id in range(1, N_USERS + 1)
+        ],
+    )
+    connection.execute(
+        Label.__table__.insert(),
+        [
+            {
+                'id': label_id,
+                'name': 'Label {}'.format(label_id),
+                'normalized_name': 'label {}'.format(label_id),
+            } for label_id in range(1, N_LABELS + 1)
+        ],
+    )
+    connection.execute(
+        Search.__table__.insert(),
+        [
+            {
+                'id': user_id,
+                'searcher_user_id': user_id,
+                'searcher_role': 'educator' if user_id % 2 else 'partner',
+                'searching_for_role': 'partner' if user_id % 2 else 'educator',
+                'active': True,
+                'created': now,
+            } for user_id in range(1, N_USERS + 1)
+        ],
+    )
+    connection.execute(
+        search_label_table.insert(),
+        [
+            {'search_id': user_id, 'label_id': (user_id * offset) % N_LABELS + 1}
+            for user_id in range(1, N_USERS + 1) for offset in range(1, 4)
+        ],
+    )
+    connection.execute(
+        Conversation.__table__.insert(),
+        [
+            {
+                'id': user_id,
+                'active': True,
+                'date_created': now - datetime.timedelta(hours=user_id),
+                'title': 'Conversation {}'.format(user_id),
+                'search_id': user_id,
+                'userA_id': user_id,
+                'userB_id': user_id % N_USERS + 1,
+            } for user_id in range(1, N_USERS + 1)
+        ],
+    )
+    connection.execute(
+        Message.__table__.insert(),
+        [
+            {
+                'conversation_id': conversation_id,
+                'sender_user_id': conversation_id,
+                'content': 'Hello',
+                'viewed': bool(index),
+                'date_created': now,
+            } for conversation_id in range(1, N_USERS + 1) for index in range(3)
+        ],
+    )
+    connection.execute(
+        InboxEntry.__table__.insert(),
+        [
+            {
+                'conversation_id': conversation_id,
+                'user_id': user_id,
+                'other_user_id': other_user_id,
+                # The first message of each conversation is unviewed.
+                'unread_count': int(user_id != conversation_id),
+                'last_message_id': conversation_id * 3,
+                'last_activity': now,
+            } for conversation_id in range(1, N_USERS + 1)
+            for user_id, other_user_id in (
+                (conversation_id, conversation_id % N_USERS + 1),
+                (conversation_id % N_USERS + 1, conversation_id),
+            )
+        ],
+    )
+    connection.execute(
+        Share.__table__.insert(),
+        [
+            {
+                'id': user_id,
+                'conversation_id': user_id,
+                'educator_user_id': user_id,
+                'community_partner_user_id': user_id % N_USERS + 1,
+                'educator_approved': True,
+                'community_partner_approved': True,
+                'active': True,
+                'description': 'Share',
+                'date_created': now,
+            } for user_id in range(1, N_USERS + 1)
+        ],
+    )
+    connection.execute(
+        Event.__table__.insert(),
+        [
+            {
+                'id': user_id,
+                'share_id': user_id,
+                'active': True,
+                'date_created': now,
+                'datetime_start': now + datetime.timedelta(hours=user_id - N_USERS // 2),
+                'datetime_stop': now + datetime.timedelta(hours=user_id + 1 - N_USERS // 2),
+                'location': 'Somewhere',
+            } for user_id in range(1, N_USERS + 1)
+        ],
+    )
+    connection.execute(
+        EventReminder.__table__.insert(),
+        [
+            {'event_id': event_id, 'typ': 'review', 'date_created': now}
+            for event_id in range(1, N_USERS + 1, 2)
+        ],
+    )
+    connection.execute(
+        UserReview.__table__.insert(),
+        [
+            {
+                'user_id': user_id,
+                'event_id': user_id,
+                'rating': 5,
+                'active': True,
+                'date_created': now - datetime.timedelta(hours=user_id),
+                'creator_user_id': user_id % N_USERS + 1,
+            } for user_id in range(1, N_USERS + 1)
+        ],
+    )
+
+
+class QueryPlanTest(unittest.TestCase):
+    '''
+    Runs the hot queries against a seeded SQLite database and checks that
+    none of them reads a whole table.
+    '''
+
+    def setUp(self):
+        config.load_config('./config.dev.json')
+        self.db_file = tempfile.NamedTemporaryFile(suffix='.db')
+        config.DB_CONNECTION = 'sqlite:///{}'.format(self.db_file.name)
+        store.set_config(config)
+        Base.metadata.create_all(store.engine)
+        with store.engine.begin() as connection:
+            seed(connection)
+        self.statements = []
+        event.listen(store.engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def tearDown(self):
+        event.remove(store.engine, 'before_cursor_execute', self.before_cursor_execute)
+        store.session.remove()
+        self.db_file.close()
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            self.statements.append((statement, parameters))
+
+    def full_scans(self):
+        full_scans = []
+        connection = store.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            for statement, parameters in self.statements:
+                cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    match = FULL_SCAN_PATTERN.match(detail)
+                    if match and match.group(1) in Base.metadata.tables:
+                        full_scans.append((detail, statement))
+        finally:
+            connection.close()
+        return full_scans
+
+    def assertNoFullScans(self):
+        self.assertTrue(self.statements)
+        full_scans = self.full_scans()
+        self.assertEqual([], full_scans)
+
+    def test_search_matching(self):
+        labels = store.session.query(Label).filter(Label.id.in_([1, 2, 3])).all()
+        self.statements = []
+        searches = search_utils.get_searches_ordered_by_label_matches(labels, 'educator', 'partner')
+        self.assertTrue(searches)
+        self.assertNoFullScans()
+
+    def test_search_matches(self):
+        search_utils.refresh_stale_search_matches()
+        search = store.session.query(Search).get(1)
+        self.statements = []
+        self.assertTrue(search_utils.find_matching_searches(search, 2))
+        search_utils.refresh_stale_search_matches()
+        self.assertNoFullScans()
+
+    def test_user_search(self):
+        user_search.rebuild_index()
+        self.statements = []
+        users = User.search('User 42', None, None).all()
+        self.assertEqual(users[0].id, 42)
+        self.assertNoFullScans()
+
+    def test_event_reminders(self):
+        self.assertTrue(EventReminder.get_oneday_reminder_events())
+        self.assertTrue(EventReminder.get_review_reminder_events())
+        self.assertNoFullScans()
+
+    def test_statistics(self):
+        Statistic.get_statistics(Statistic.date_yesterday())
+        self.assertNoFullScans()
+
+    def test_conversations(self):
+        requester = store.session.query(User).get(1)
+        self.statements = []
+        for args in (
+            {'user_id': '1'},
+            {'user_id': '1', 'other_user_id': '2'},
+            {'user_id': '1', 'with_unviewed_messages': 'true'},
+        ):
+            conversations = Conversation.args_to_query(MultiDict(args), requester).all()
+            self.assertTrue(conversations)
+        self.assertNoFullScans()
+
+    def test_inbox(self):
+        entries = InboxEntry.inbox(1, unread_only=True)
+        self.assertEqual([entry.conversation_id for entry in entries], [N_USERS])
+        self.assertEqual(len(self.statements), 1)
+        self.assertNoFullScans()
+
+    def test_message_pages(self):
+        messages = Message.page(1, 2)
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(len(Message.page(1, 2, before_id=messages[0].id)), 1)
+        self.assertEqual(len(Message.last_messages([1, 2, 3], 2)), 6)
+        self.assertNoFullScans()
@@ -0,0 +1,96 @@
+import datetime
+import tempfile
+import unittest
+
+from community_share import Base, config, store
+from community_share.models import base
+from community_share.models.user import User
+from community_share.models.share import Event, Share
+
+
+def reference_serialize(item, requester, exclude=(), fields=None):
+    '''
+    Serializes as Serializable.serialize did before serializer plans.
+    '''
+    if item.has_admin_rights(requester):
+        fieldnames = item.ADMIN_READABLE_FIELDS
+    elif item.has_standard_rights(requester):
+        fieldnames = item.STANDARD_READABLE_FIELDS
+    else:
+        return None
+    serialized = {
+        key: (
+            item.custom_serializers[key](item, requester)
+            if key in item.custom_serializers else getattr(item, key)
+        )
+        for key in (set(fieldnames) - set(exclude)) | ({'id'} if hasattr(item, 'id') else set())
+    }
+    if fields is not None:
+        serialized = {key: serialized[key] for key in serialized if key in list(fields) + ['id']}
+    return serialized
+
+
+class SerializeTest(unittest.TestCase):
+    '''
+    Checks the compiled serializer plans against the reference serializer.
+    '''
+
+    def setUp(self):
+        self.db_file = tempfile.NamedTemporaryFile(suffix='.db')
+        self.addCleanup(self.db_file.close)
+        config.load_config('./config.dev.json')
+        config.DB_CONNECTION = 'sqlite:///{}'.format(self.db_file.name)
+        store.set_config(config)
+        Base.metadata.create_all(store.engine)
+        start = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        self.educator = User(id=1, name='Educator', email='educator@example.org')
+        self.partner = User(id=2, name='Partner', email='partner@example.org')
+        self.stranger = User(id=3, name='Stranger', email='stranger@example.org')
+        self.admin = User(id=4, name='Admin', email='admin@example.org', is_administrator=True)
+        self.share = Share(
+            id=1,
+            title='Robots',
+            description='A share',
+            educator=self.educator,
+            community_partner=self.partner,
+        )
+        self.event = Event(
+            id=1,
+            share=self.share,
+            location='Somewhere',
+            datetime_start=start,
+            datetime_stop=start + datetime.timedelta(hours=1),
+        )
+
+    def tearDown(self):
+        store.session.remove()
+        Base.metadata.drop_all(store.engine)
+
+    def test_matches_reference(self):
+        items = [self.educator, self.share, self.event]
+        requesters = [self.admin, self.educator, self.stranger]
+        for item in items:
+            readable = sorted(set(item.ADMIN_READABLE_FIELDS) | set(item.STANDARD_READABLE_FIELDS))
+            for requester in requesters:
+                for exclude in ([], readable[:1]):
+                    for fields in (None, readable[:2], readable[1:3] + ['unknown']):
+                        with self.subTest(item=item, requester=requester.name,
+                                          exclude=exclude, fields=fields):
+                            self.assertEqual(
+                                item.serialize(requester, exclude=exclude, fields=fields),
+                                reference_serialize(item, requester, exclude, fields),
+                            )
+
+    def test_fields_and_exclude(self):
+        serialized = self.share.serialize(self.admin, exclude=['title'], fields=['title', 'id'])
+        self.assertEqual(serialized, {'id': 1})
+        serialized = self.share.serialize(self.admin, fields=['title', 'description'])
+        self.assertEqual(serialized, {'id': 1, 'title': 'Robots', 'description': 'A share'})
+        self.assertNotIn('title', self.share.serialize(self.admin, exclude=['title']))
+
+    def test_unknown_fields_share_plan(self):
+        self.share.serialize(self.admin, fields=['title'])
+        n_plans = len(base._serializer_plans_cache)
+        for index in range(10):
+            self.share.serialize(self.admin, fields=['title', 'unknown{0}'.format(index)])
+        self.assertEqual(len(base._serializer_plans_cache), n_plans)
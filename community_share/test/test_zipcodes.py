@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+
+from community_share.zipcodes import ZipcodeTable, parse_zipcode, write_table, zipcode_table
+
+
+class ZipcodeTableTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        write_table(
+            [('85719', 32.248, -110.9474), ('00501', 40.8179, -73.0453), (85701, 32.2179, -110.9686)],
+            self.path,
+        )
+        self.table = ZipcodeTable(self.path)
+
+    def tearDown(self):
+        self.table.close()
+        os.remove(self.path)
+
+    def test_parse_zipcode(self):
+        self.assertEqual(parse_zipcode('85701'), 85701)
+        self.assertEqual(parse_zipcode(' 85701-1234 '), 85701)
+        self.assertEqual(parse_zipcode('857011234'), 85701)
+        self.assertEqual(parse_zipcode(501), 501)
+        self.assertIsNone(parse_zipcode('8570'))
+        self.assertIsNone(parse_zipcode('Tucson'))
+        self.assertIsNone(parse_zipcode(None))
+
+    def test_lookup(self):
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(self.table.lookup('00501'), (40.8179, -73.0453))
+        self.assertEqual(self.table.lookup('85701'), (32.2179, -110.9686))
+        self.assertEqual(self.table.lookup('85719-0001'), (32.248, -110.9474))
+        for zipcode in ('00000', '85700', '85702', '99999', 'Tucson', None):
+            self.assertIsNone(self.table.lookup(zipcode))
+
+    def test_bundled_table(self):
+        latitude, longitude = zipcode_table.lookup('85701')
+        self.assertAlmostEqual(latitude, 32.22, places=1)
+        self.assertAlmostEqual(longitude, -110.97, places=1)
@@ -1,6 +1,9 @@
 import logging, datetime, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from community_share import reminder
+from community_share import config, mail, recommendations, reminder, search_utils, store
+from community_share.models.outbox import OutboxEmail
 from community_share.models.statistics import Statistic
 
 logger = logging.getLogger(__name__)
@@ -10,6 +13,73 @@ def do_work():
     logger.info('Running do_work')
     reminder.send_reminders()
     Statistic.check_statistics()
+    recommendations.check_recommendations()
+
+
+def _deliver(mailer, email):
+    try:
+        if isinstance(email, mail.BatchEmail):
+            error_message = mail.deliver_batch(mailer, email)
+        else:
+            error_message = mailer.send(email)
+    except Exception as e:
+        logger.exception('Failed to send an email from the outbox')
+        error_message = '{0}: {1}'.format(type(e).__name__, e)
+    return error_message
+
+
+def _group_batches(outbox_emails):
+    '''
+    The emails to send for the outbox emails, with the outbox emails each
+    is for.  Outbox emails of the same batch are sent as one batch email.
+    '''
+    groups = []
+    batches = OrderedDict()
+    for outbox_email in outbox_emails:
+        if outbox_email.batch_key is None:
+            groups.append((outbox_email.to_email(config.MAILGUN_DOMAIN), [outbox_email]))
+        else:
+            batches.setdefault(outbox_email.batch_key, []).append(outbox_email)
+    for batch in batches.values():
+        groups.append((OutboxEmail.to_batch_email(batch), batch))
+    return groups
+
+
+def dispatch_outbox():
+    '''
+    Sends the emails due in the outbox, config.OUTBOX_WORKERS at a time,
+    until none are left.  Failed emails are retried with exponential
+    backoff by later calls.  Returns the number of emails sent.
+    '''
+    batch_size = int(config.OUTBOX_BATCH_SIZE)
+    mailer = mail.get_delivery_mailer()
+    n_sent = 0
+    with ThreadPoolExecutor(max_workers=int(config.OUTBOX_WORKERS)) as executor:
+        while True:
+            outbox_emails = OutboxEmail.claim_due(batch_size, int(config.OUTBOX_LEASE_SECONDS))
+            # Only the sending happens in the pool, the session stays in this thread.
+            futures = {
+                executor.submit(_deliver, mailer, email): group
+                for email, group in _group_batches(outbox_emails)
+            }
+            for future in as_completed(futures):
+                error_message = future.result()
+                for outbox_email in futures[future]:
+                    if error_message:
+                        outbox_email.record_failure(
+                            error_message,
+                            int(config.OUTBOX_MAX_ATTEMPTS),
+                            float(config.OUTBOX_RETRY_SECONDS),
+                        )
+                    else:
+                        outbox_email.record_sent()
+                        n_sent += 1
+                store.session.commit()
+            if len(outbox_emails) < batch_size:
+                break
+    if n_sent:
+        logger.info('Sent {0} emails from the outbox'.format(n_sent))
+    return n_sent
 
 
 default_target_time = datetime.timedelta(seconds=600)
@@ -21,10 +91,15 @@ def work_loop(target_time_between_calls=default_target_time, max_loops=None):
     while True:
         last_call_time = datetime.datetime.utcnow()
         do_work()
-        duration = datetime.datetime.utcnow() - last_call_time
-        remaining = (target_time_between_calls - duration).total_seconds()
-        if remaining > 0:
-            time.sleep(remaining)
+        # Keep search matches fresh and the outbox drained until the next call.
+        next_call_time = last_call_time + target_time_between_calls
+        while True:
+            search_utils.refresh_stale_search_matches()
+            dispatch_outbox()
+            remaining = (next_call_time - datetime.datetime.utcnow()).total_seconds()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, float(config.SEARCH_MATCH_REFRESH_INTERVAL)))
         n_loops += 1
         if (max_loops is not None) and (n_loops >= max_loops):
             break
@@ -0,0 +1,107 @@
+import mmap
+import os
+import re
+import struct
+import threading
+
+# The table is a sequence of (zipcode, latitude, longitude) records sorted by
+# zipcode, with the zipcode as an unsigned int and the coordinates as floats.
+# Coordinates are kept to four decimal places, about ten metres.
+RECORD = struct.Struct('<Iff')
+ZIPCODE = struct.Struct('<I')
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'zipcodes.bin')
+
+# Five digit zipcodes, optionally followed by the four digit extension.
+ZIPCODE_PATTERN = re.compile(r'^\s*(\d{5})(?:-?\d{4})?\s*$')
+
+
+def parse_zipcode(zipcode):
+    '''
+    The zipcode as an int, or None if it isn't a US zipcode.
+    '''
+    parsed = None
+    if isinstance(zipcode, int):
+        zipcode = '{0:05d}'.format(zipcode)
+    if isinstance(zipcode, str):
+        match = ZIPCODE_PATTERN.match(zipcode)
+        if match:
+            parsed = int(match.group(1))
+    return parsed
+
+
+def write_table(rows, path):
+    '''
+    Writes (zipcode, latitude, longitude) rows to `path` in the table format.
+    '''
+    records = {}
+    for zipcode, latitude, longitude in rows:
+        parsed = parse_zipcode(zipcode)
+        if parsed is None:
+            raise ValueError('Invalid zipcode: {0}'.format(zipcode))
+        records[parsed] = (float(latitude), float(longitude))
+    with open(path, 'wb') as f:
+        for parsed in sorted(records):
+            f.write(RECORD.pack(parsed, *records[parsed]))
+    return len(records)
+
+
+class ZipcodeTable(object):
+    """
+    Offline lookup of the coordinates of US zipcodes.
+
+    The table file is memory mapped the first time it is used, so processes
+    share its pages and lookups are a binary search without any parsing.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._table = None
+        self._size = 0
+
+    def _open(self):
+        with self._lock:
+            if self._table is None:
+                with open(self.path, 'rb') as f:
+                    table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if len(table) % RECORD.size:
+                    raise ValueError('Corrupt zipcode table: {0}'.format(self.path))
+                self._size = len(table) // RECORD.size
+                self._table = table
+        return self._table
+
+    def __len__(self):
+        self._open()
+        return self._size
+
+    def lookup(self, zipcode):
+        '''
+        The (latitude, longitude) of a zipcode, or None if it is unknown.
+        '''
+        location = None
+        parsed = parse_zipcode(zipcode)
+        if parsed is not None:
+            table = self._open()
+            low, high = 0, self._size
+            while low < high:
+                middle = (low + high) // 2
+                middle_zipcode, = ZIPCODE.unpack_from(table, middle * RECORD.size)
+                if middle_zipcode < parsed:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low < self._size:
+                found_zipcode, latitude, longitude = RECORD.unpack_from(table, low * RECORD.size)
+                if found_zipcode == parsed:
+                    location = (round(latitude, 4), round(longitude, 4))
+        return location
+
+    def close(self):
+        with self._lock:
+            if self._table is not None:
+                self._table.close()
+                self._table = None
+
+
+zipcode_table = ZipcodeTable()
@@ -0,0 +1,80 @@
+'''
+Compares per-request authentication latency for api keys stored as secrets
+and for signed api keys.
+
+Run from the repository root:
+
+    python scripts/bench_api_key_auth.py --requests 2000
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# Put communityshare in sys
+this_directory = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(this_directory, '..')))
+
+from community_share import app, config, store, Base
+from community_share.authorization import get_requesting_user
+from community_share.models.user import User
+
+
+def make_user():
+    user = User(name='Bench', email='bench@example.com', email_confirmed=True)
+    user.password_hash = User.pwd_context.encrypt('password')
+    store.session.add(user)
+    store.session.commit()
+    return user
+
+
+def time_requests(flask_app, api_key, n_requests):
+    headers = {'Authorization': 'Basic:api:{0}'.format(api_key)}
+    durations = []
+    for _ in range(n_requests):
+        with flask_app.test_request_context(headers=headers):
+            start = time.perf_counter()
+            user = get_requesting_user()
+            durations.append(time.perf_counter() - start)
+            assert user is not None
+        # Each request starts with an empty session.
+        store.session.remove()
+    durations.sort()
+    return {
+        'mean': sum(durations) / len(durations),
+        'p50': durations[len(durations) // 2],
+        'p95': durations[int(len(durations) * 0.95)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--config', default='./config.dev.json')
+    args = parser.parse_args()
+
+    config.load_config(args.config)
+    db_file = tempfile.NamedTemporaryFile(suffix='.db')
+    config.DB_CONNECTION = 'sqlite:///{}'.format(db_file.name)
+    store.set_config(config)
+    Base.metadata.create_all(store.engine)
+    flask_app = app.make_app()
+
+    user = make_user()
+    for mode in ('SECRET', 'SIGNED'):
+        config.API_KEY_MODE = mode
+        api_key = user.make_api_key().key
+        timings = time_requests(flask_app, api_key, args.requests)
+        print(
+            '{mode:>7}: mean {mean:.3f} ms  p50 {p50:.3f} ms  p95 {p95:.3f} ms'.format(
+                mode=mode,
+                **{key: value * 1000 for key, value in timings.items()}
+            )
+        )
+        user = store.session.query(User).get(user.id)
+
+
+if __name__ == '__main__':
+    main()
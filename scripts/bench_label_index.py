@@ -0,0 +1,161 @@
+'''
+Compares matching searches by label in SQL against the in-memory label
+index.
+
+Run from the repository root:
+
+    python scripts/bench_label_index.py --searches 100000
+'''
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Put communityshare in sys
+this_directory = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(this_directory, '..')))
+
+from community_share import config, store, Base
+from community_share.label_index import label_index
+from community_share.models.user import User
+from community_share.models.search import Label, Search, search_label_table
+from community_share import search_utils
+
+N_LABELS = 200
+LABELS_PER_SEARCH = 5
+
+
+def seed(n_searches):
+    now = datetime.datetime.utcnow()
+    random.seed(0)
+    with store.engine.begin() as connection:
+        connection.execute(
+            User.__table__.insert(),
+            [
+                {
+                    'id': user_id,
+                    'name': 'User {}'.format(user_id),
+                    'email': 'user{}@example.com'.format(user_id),
+                    'email_confirmed': True,
+                    'active': True,
+                    'is_administrator': False,
+                    'wants_update_emails': False,
+                    'api_key_generation': 0,
+                    'date_created': now,
+                } for user_id in range(1, n_searches + 1)
+            ],
+        )
+        connection.execute(
+            Label.__table__.insert(),
+            [
+                {
+                    'id': label_id,
+                    'name': 'Label {}'.format(label_id),
+                    'normalized_name': 'label {}'.format(label_id),
+                    'active': True,
+                } for label_id in range(1, N_LABELS + 1)
+            ],
+        )
+        connection.execute(
+            Search.__table__.insert(),
+            [
+                {
+                    'id': search_id,
+                    'searcher_user_id': search_id,
+                    'searcher_role': 'educator' if search_id % 2 else 'partner',
+                    'searching_for_role': 'partner' if search_id % 2 else 'educator',
+                    'active': True,
+                    'created': now,
+                } for search_id in range(1, n_searches + 1)
+            ],
+        )
+        connection.execute(
+            search_label_table.insert(),
+            [
+                {'search_id': search_id, 'label_id': label_id}
+                for search_id in range(1, n_searches + 1)
+                for label_id in random.sample(range(1, N_LABELS + 1), LABELS_PER_SEARCH)
+            ],
+        )
+        connection.execute('ANALYZE')
+
+
+def time_queries(query, labels_list):
+    durations = []
+    for labels in labels_list:
+        start = time.perf_counter()
+        query(labels)
+        durations.append(time.perf_counter() - start)
+        store.session.remove()
+    durations.sort()
+    return {
+        'mean': sum(durations) / len(durations),
+        'p50': durations[len(durations) // 2],
+        'p95': durations[int(len(durations) * 0.95)],
+    }
+
+
+def rank_in_sql(labels):
+    labelnames = [label.normalized_name for label in labels]
+    search_utils.get_search_ids_ordered_by_label_matches_from_db(
+        labelnames, 'educator', 'partner', 0, 10
+    )
+
+
+def rank_in_index(labels):
+    labelnames = [label.normalized_name for label in labels]
+    label_index.ranked_search_ids(labelnames, 'educator', 'partner', 0, 10)
+
+
+def get_searches(labels):
+    search_utils.get_searches_ordered_by_label_matches(labels, 'educator', 'partner')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--searches', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--config', default='./config.dev.json')
+    args = parser.parse_args()
+
+    config.load_config(args.config)
+    db_file = tempfile.NamedTemporaryFile(suffix='.db')
+    config.DB_CONNECTION = 'sqlite:///{}'.format(db_file.name)
+    store.set_config(config)
+    Base.metadata.create_all(store.engine)
+    seed(args.searches)
+
+    all_labels = store.session.query(Label).all()
+    labels_list = [random.sample(all_labels, LABELS_PER_SEARCH) for _ in range(args.queries)]
+    for label in all_labels:
+        store.session.expunge(label)
+    store.session.remove()
+
+    timings = [
+        ('SQL ranking', time_queries(rank_in_sql, labels_list)),
+        ('SQL with loading', time_queries(get_searches, labels_list)),
+    ]
+    start = time.perf_counter()
+    label_index.rebuild()
+    build_time = time.perf_counter() - start
+    timings += [
+        ('index ranking', time_queries(rank_in_index, labels_list)),
+        ('index with loading', time_queries(get_searches, labels_list)),
+    ]
+
+    print('{} searches, index built in {:.2f} s'.format(args.searches, build_time))
+    for name, timing in timings:
+        print(
+            '{name:>18}: mean {mean:7.2f} ms  p50 {p50:7.2f} ms  p95 {p95:7.2f} ms'.format(
+                name=name,
+                **{key: value * 1000 for key, value in timing.items()}
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
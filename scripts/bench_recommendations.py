@@ -0,0 +1,133 @@
+'''
+Compares computing recommendations for every educator with one ranking
+query per educator against the batch engine.
+
+Run from the repository root:
+
+    python scripts/bench_recommendations.py --users 20000
+'''
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Put communityshare in sys
+this_directory = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(this_directory, '..')))
+
+from community_share import config, store, Base
+from community_share.models.user import User
+from community_share.models.search import Label, Search, search_label_table
+from community_share import recommendations, search_utils
+
+N_LABELS = 200
+LABELS_PER_SEARCH = 5
+LIMIT = 20
+
+
+def seed(n_users):
+    now = datetime.datetime.utcnow()
+    random.seed(0)
+    with store.engine.begin() as connection:
+        connection.execute(
+            User.__table__.insert(),
+            [
+                {
+                    'id': user_id,
+                    'name': 'User {}'.format(user_id),
+                    'email': 'user{}@example.com'.format(user_id),
+                    'email_confirmed': True,
+                    'active': True,
+                    'is_administrator': False,
+                    'wants_update_emails': False,
+                    'api_key_generation': 0,
+                    'date_created': now,
+                } for user_id in range(1, n_users + 1)
+            ],
+        )
+        connection.execute(
+            Label.__table__.insert(),
+            [
+                {
+                    'id': label_id,
+                    'name': 'Label {}'.format(label_id),
+                    'normalized_name': 'label {}'.format(label_id),
+                    'active': True,
+                } for label_id in range(1, N_LABELS + 1)
+            ],
+        )
+        connection.execute(
+            Search.__table__.insert(),
+            [
+                {
+                    'id': user_id,
+                    'searcher_user_id': user_id,
+                    'searcher_role': 'educator' if user_id % 2 else 'partner',
+                    'searching_for_role': 'partner' if user_id % 2 else 'educator',
+                    'active': True,
+                    'created': now,
+                } for user_id in range(1, n_users + 1)
+            ],
+        )
+        # Skewed label popularity, like real labels.
+        weights = [1 / label_id for label_id in range(1, N_LABELS + 1)]
+        connection.execute(
+            search_label_table.insert(),
+            [
+                {'search_id': search_id, 'label_id': label_id}
+                for search_id in range(1, n_users + 1)
+                for label_id in set(
+                    random.choices(range(1, N_LABELS + 1), weights, k=LABELS_PER_SEARCH)
+                )
+            ],
+        )
+        connection.execute('ANALYZE')
+
+
+def rank_per_educator(max_educators):
+    educator_searches = store.session.query(Search).filter(
+        Search.searcher_role == 'educator'
+    ).order_by(Search.id).limit(max_educators).all()
+    start = time.perf_counter()
+    for search in educator_searches:
+        search_utils.get_search_ids_ordered_by_label_matches_from_db(
+            [label.normalized_name for label in search.labels], 'partner', 'educator', 0, LIMIT
+        )
+    return (time.perf_counter() - start) / len(educator_searches)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--sampled-educators', type=int, default=200)
+    parser.add_argument('--config', default='./config.dev.json')
+    args = parser.parse_args()
+
+    config.load_config(args.config)
+    db_file = tempfile.NamedTemporaryFile(suffix='.db')
+    config.DB_CONNECTION = 'sqlite:///{}'.format(db_file.name)
+    store.set_config(config)
+    Base.metadata.create_all(store.engine)
+    seed(args.users)
+    n_educators = (args.users + 1) // 2
+
+    per_educator = rank_per_educator(args.sampled_educators)
+    start = time.perf_counter()
+    n_computed = sum(1 for _ in recommendations.compute_recommendations('educator', 'partner', LIMIT))
+    batch = time.perf_counter() - start
+
+    print('{} educators, {} partners'.format(n_educators, args.users - n_educators))
+    print(
+        'query per educator: {:.2f} ms each, {:.1f} s for all (extrapolated from {})'.format(
+            per_educator * 1000, per_educator * n_educators, args.sampled_educators
+        )
+    )
+    print('batch engine: {:.1f} s for {} educators'.format(batch, n_computed))
+
+
+if __name__ == '__main__':
+    main()
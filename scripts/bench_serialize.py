@@ -0,0 +1,114 @@
+'''
+Compares serializing users, shares and events with the compiled serializer
+plans against the previous implementation, which worked out the readable
+fields for every object.
+
+Run from the repository root:
+
+    python scripts/bench_serialize.py --items 10000
+'''
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+# Put communityshare in sys
+this_directory = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(this_directory, '..')))
+
+from community_share import config
+from community_share.models.base import Serializable
+from community_share.models.user import User
+from community_share.models.share import Event, Share
+
+
+def legacy_serialize(self, requester, exclude=[], fields=None):
+    if self.has_admin_rights(requester):
+        fieldnames = self.ADMIN_READABLE_FIELDS
+    elif self.has_standard_rights(requester):
+        fieldnames = self.STANDARD_READABLE_FIELDS
+    else:
+        return None
+
+    item = {
+        key: (
+            self.custom_serializers[key](self, requester)
+            if key in self.custom_serializers else getattr(self, key)
+        )
+        for key in (set(fieldnames) - set(exclude)) | ({'id'} if hasattr(self, 'id') else set())
+    }
+    if fields is not None:
+        item = {key: item[key] for key in item if key in fields + ['id']}
+    return item
+
+
+def make_items(n_items):
+    start = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    users = []
+    shares = []
+    events = []
+    for index in range(n_items):
+        educator = User(id=2 * index, name='Educator {}'.format(index))
+        partner = User(id=2 * index + 1, name='Partner {}'.format(index))
+        share = Share(
+            id=index,
+            title='Share {}'.format(index),
+            description='A share',
+            educator=educator,
+            community_partner=partner,
+        )
+        event = Event(
+            id=index,
+            share=share,
+            location='Somewhere',
+            datetime_start=start,
+            datetime_stop=start + datetime.timedelta(hours=1),
+        )
+        users.append(educator)
+        shares.append(share)
+        events.append(event)
+    return {'User': users, 'Share': shares, 'Event': events}
+
+
+def time_serialize(items, requester, fields=None):
+    start = time.perf_counter()
+    for item in items:
+        item.serialize(requester, fields=fields)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--config', default='./config.dev.json')
+    args = parser.parse_args()
+
+    config.load_config(args.config)
+    requester = User(id=-1, name='Admin', is_administrator=True)
+    items_by_class = make_items(args.items)
+    compiled_serialize = Serializable.serialize
+
+    for class_name, items in sorted(items_by_class.items()):
+        # Warm up attribute instrumentation so it isn't charged to the first run.
+        time_serialize(items, requester)
+        for fields in (None, ['name', 'title']):
+            Serializable.serialize = legacy_serialize
+            before = time_serialize(items, requester, fields)
+            Serializable.serialize = compiled_serialize
+            after = time_serialize(items, requester, fields)
+            print(
+                '{class_name:>5} fields={fields!s:<17} before {before:8.1f} ms  '
+                'after {after:8.1f} ms  speedup {speedup:.2f}x'.format(
+                    class_name=class_name,
+                    fields=fields,
+                    before=before * 1000,
+                    after=after * 1000,
+                    speedup=before / after,
+                )
+            )
+
+
+if __name__ == '__main__':
+    main()
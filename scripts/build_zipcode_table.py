@@ -0,0 +1,40 @@
+'''
+Builds the zipcode table used to geocode users and searches from a CSV file
+with zipcode, latitude and longitude columns.
+
+Run from the repository root:
+
+    python scripts/build_zipcode_table.py zipcodes.csv
+'''
+
+import argparse
+import csv
+import os
+import sys
+
+# Put communityshare in sys
+this_directory = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(this_directory, '..')))
+
+from community_share import zipcodes
+
+
+def read_rows(csv_path):
+    with open(csv_path, newline='') as f:
+        for row in csv.DictReader(f):
+            if row['latitude'] and row['longitude']:
+                yield row['zipcode'], row['latitude'], row['longitude']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('csv_path')
+    parser.add_argument('--output', default=zipcodes.DEFAULT_PATH)
+    args = parser.parse_args()
+
+    n_zipcodes = zipcodes.write_table(read_rows(args.csv_path), args.output)
+    print('Wrote {0} zipcodes to {1}'.format(n_zipcodes, args.output))
+
+
+if __name__ == '__main__':
+    main()
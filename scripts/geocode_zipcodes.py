@@ -0,0 +1,83 @@
+'''
+Fills in the coordinates of users and searches from their zipcodes.
+
+By default only rows with a zipcode but no coordinates are updated.  Pass
+--all to geocode every row with a zipcode, for example after the zipcode
+table has been rebuilt.
+
+    python scripts/geocode_zipcodes.py
+'''
+
+import argparse
+import logging
+import os
+import sys
+
+from sqlalchemy import bindparam
+
+# Put communityshare in sys
+this_directory = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(this_directory, '..')))
+
+from community_share import config, store, geo
+from community_share.models.user import User
+from community_share.models.search import Search
+from community_share.zipcodes import zipcode_table
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+def geocode_table(Item, geocode_all=False, with_grid_cell=False):
+    '''
+    Updates the coordinates of the rows of `Item` in batches and returns the
+    number of rows updated.
+    '''
+    table = Item.__table__
+    values = {'latitude': bindparam('latitude'), 'longitude': bindparam('longitude')}
+    if with_grid_cell:
+        # Core updates skip the mapper events that keep grid_cell up to date.
+        values['grid_cell'] = bindparam('grid_cell')
+    statement = table.update().where(table.c.id == bindparam('_id')).values(**values)
+    n_updated = 0
+    last_id = 0
+    while True:
+        query = store.session.query(Item.id, Item.zipcode)
+        query = query.filter(Item.id > last_id, Item.zipcode != None)
+        if not geocode_all:
+            query = query.filter(Item.latitude == None)
+        rows = query.order_by(Item.id).limit(BATCH_SIZE).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updates = []
+        for item_id, zipcode in rows:
+            location = zipcode_table.lookup(zipcode)
+            if location is not None:
+                update = {'_id': item_id, 'latitude': location[0], 'longitude': location[1]}
+                if with_grid_cell:
+                    update['grid_cell'] = geo.grid_cell(*location)
+                updates.append(update)
+        if updates:
+            store.session.execute(statement, updates)
+            store.session.commit()
+        n_updated += len(updates)
+        logger.info('Geocoded {0} {1} rows up to id {2}'.format(n_updated, table.name, last_id))
+    return n_updated
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--all', action='store_true', help='Geocode rows with coordinates too.')
+    parser.add_argument('--config', default='./config.production.json')
+    args = parser.parse_args()
+
+    config.load_config(args.config)
+    n_users = geocode_table(User, geocode_all=args.all)
+    n_searches = geocode_table(Search, geocode_all=args.all, with_grid_cell=True)
+    print('Geocoded {0} users and {1} searches'.format(n_users, n_searches))
+
+
+if __name__ == '__main__':
+    main()
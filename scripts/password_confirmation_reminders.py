@@ -9,17 +9,19 @@ from community_share.models.share import Event
 from community_share.models.conversation import Conversation
 from community_share import mail_actions, config, store
 
+logger = logging.getLogger(__name__)
+
+
 def send_reminders():
     users = store.session.query(User).filter_by(
         active=True, email_confirmed=False).all()
-    for user in users:
-        template = mail_actions.CONFIRM_EMAIL_REMINDER_TEMPLATE
-        subject = 'Please confirm email address.'
-        mail_actions.request_signup_email_confirmation(
-            user, template=template, subject=subject)
-        
+    template = mail_actions.CONFIRM_EMAIL_REMINDER_TEMPLATE
+    subject = 'Please confirm email address.'
+    error_message = mail_actions.request_signup_email_confirmations(users, template, subject)
+    if error_message:
+        logger.error('Failed to send some reminders: {0}'.format(error_message))
+
+
 if __name__ == '__main__':
-    config.load_from_environment()
-    logger = logging.getLogger(__name__)
+    config.load_config('./config.production.json')
     send_reminders()
-        
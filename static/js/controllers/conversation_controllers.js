@@ -25,7 +25,7 @@ module.controller(
     $scope.Session = Session;
     var user = Session.activeUser;
     if ( user ) {
-        var conversationsPromise = Conversation.get_many( {'user_id': user.id}, true );
+        var conversationsPromise = Conversation.get_many( {'user_id': user.id}, true, true );
         conversationsPromise.then(
       function( conversations ) {
           conversations.sort( function( a, b ) {
@@ -54,14 +54,14 @@ module.controller(
 
 module.controller(
 'ConversationController',
-['$scope', '$q', '$location', '$timeout', '$modal', 'Session', 'Conversation', 'Message', 'User', 'Share', 'makeDialog', 'conversation', function( $scope, $q, $location, $timeout, $modal, Session,
-         Conversation, Message, User, Share, makeDialog, conversation ) {
+['$scope', '$q', '$location', '$timeout', '$modal', 'Session', 'Conversation', 'Message', 'MessageStream', 'User', 'Share', 'makeDialog', 'conversation', function( $scope, $q, $location, $timeout, $modal, Session,
+         Conversation, Message, MessageStream, User, Share, makeDialog, conversation ) {
     $scope.Session = Session;
     if ( ( conversation === undefined ) || ( Session.activeUser === undefined ) ) {
         return;
     }
 
-    var sharesPromise = Share.get_many( {conversation_id: conversation.id} );
+    var sharesPromise = Share.get_many( {conversation_id: conversation.id}, false, true );
     $scope.otherUser = undefined;
     $scope.conversation = conversation;
     $scope.newMessage = undefined;
@@ -93,8 +93,38 @@ module.controller(
       }
     );
     };
+    var addMessage = function( message ) {
+        var messages = $scope.conversation.messages;
+        for ( var i=0; i<messages.length; i++ ) {
+            if ( messages[i].id === message.id ) {
+                return;
+            }
+        }
+        if ( message.sender_user_id === Session.activeUser.id ) {
+            message.sender_user = Session.activeUser;
+        } else {
+            message.sender_user = $scope.otherUser;
+        }
+        messages.push( message );
+    };
+    var streamMessages = function() {
+        var lastMessageId = 0;
+        for ( var i=0; i<conversation.messages.length; i++ ) {
+            lastMessageId = Math.max( lastMessageId, conversation.messages[i].id );
+        }
+        var onMessage = function( messageData ) {
+            if ( messageData.conversation_id === conversation.id ) {
+                addMessage( new Message( messageData ) );
+            }
+        };
+        MessageStream.subscribe( onMessage, lastMessageId );
+        $scope.$on( '$destroy', function() {
+            MessageStream.unsubscribe( onMessage );
+        } );
+    };
     var refreshShares = function() {
-        var refreshedSharesPromise = Share.get_many( {conversation_id: conversation.id}, true );
+        var refreshedSharesPromise = Share.get_many(
+            {conversation_id: conversation.id}, true, true );
         refreshedSharesPromise.then(
       function( shares ) {
           sortShares( shares );
@@ -120,7 +150,12 @@ module.controller(
     $scope.messageHighlightClasses[$scope.otherUser.id] = 'highlight2';
     $scope.newMessage = makeNewMessage();
     refreshShares();
-    $timeout( refreshConversation, 5000 );
+    // New messages are pushed by the server where browsers support it.
+    if ( MessageStream.isSupported() ) {
+        streamMessages();
+    } else {
+        $timeout( refreshConversation, 5000 );
+    }
     $scope.createNewShare = function() {
         var share = conversation.makeShare();
         $scope.editShare( share );
@@ -144,8 +179,7 @@ module.controller(
         var messagePromise = $scope.newMessage.save();
         messagePromise.then(
       function( message ) {
-          message.sender_user = Session.activeUser;
-          $scope.conversation.messages.push( message );
+          addMessage( message );
           $scope.newMessage = makeNewMessage();
       },
       showErrorMessage
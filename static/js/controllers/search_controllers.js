@@ -41,7 +41,7 @@ module.controller(
     }
 
     if ( user ) {
-        var searchesPromise = Search.get_many( {'searcher_user_id': user.id}, true );
+        var searchesPromise = Search.get_many( {'searcher_user_id': user.id}, true, true );
         searchesPromise.then(
       function( searches ) {
           $scope.infoMessage = '';
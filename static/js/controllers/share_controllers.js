@@ -15,7 +15,7 @@ module.controller(
     $scope.Session = Session;
     $scope.startConversation = startConversation;
     if ( $scope.Session.activeUser ) {
-        var sharesPromise = Share.get_many( {'user_id': Session.activeUser.id}, true );
+        var sharesPromise = Share.get_many( {'user_id': Session.activeUser.id}, true, true );
         $scope.errorMessage = '';
         $scope.infoMessage = 'Loading shares...';
         sharesPromise.then(
@@ -99,7 +99,7 @@ module.controller(
     }
     $scope.start = start;
     $scope.stop = stop;
-    var eventsPromise = Evnt.get_many( searchParams );
+    var eventsPromise = Evnt.get_many( searchParams, false, true );
     $scope.infoMessage = 'Loading events...';
     $scope.errorMessage = '';
     eventsPromise.then(
@@ -43,12 +43,12 @@ module.controller(
     {'question_type.in': ['signup_community_partner', 'signup', 'signup_educator']}
   );
     if ( $scope.Session.activeUser && $scope.Session.activeUser.is_administrator ) {
-        var conversationsPromise = Conversation.get_many( {user_id: userId} );
+        var conversationsPromise = Conversation.get_many( {user_id: userId}, false, true );
         conversationsPromise.then(
       function( conversations ) {
           $scope.conversations = conversations;
       } );
-        var eventsPromise = Evnt.get_many( {user_id: userId} );
+        var eventsPromise = Evnt.get_many( {user_id: userId}, false, true );
         eventsPromise.then(
       function( events ) {
           $scope.events = events;
@@ -102,7 +102,7 @@ var commonSignupLogic = function( $scope, user, search, Messages, $location,
     $scope.questions = [];
     var questionsPromise = Question.get_many( {
         'question_type.in': ['signup_community_partner', 'signup', 'signup_educator']
-    } );
+    }, false, true );
     questionsPromise.then(
   function( questions ) {
       $scope.questions = questions;
@@ -34,7 +34,7 @@ module.directive(
                  return $scope.institutionsForm.$valid || $scope.noInstitutions;
              };
        // FIXME: Not scaleable.  Change to get the most popular.
-             var institutionsPromise = Institution.get_many();
+             var institutionsPromise = Institution.get_many( {}, false, true );
              $scope.options = {institutions: [],
                          institutionTypes: []
                         };
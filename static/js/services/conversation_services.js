@@ -137,13 +137,92 @@ module.factory(
             user_id: user_id,
             with_unviewed_messages: true
         };
-        var conversationsPromise = Conversation.get_many( data=data );
+        var conversationsPromise = Conversation.get_many( data, false, true );
         return conversationsPromise;
     };
 
     return Conversation;
 }] );
 
+module.factory(
+'MessageStream',
+['$http', '$rootScope', '$timeout', '$window', function( $http, $rootScope, $timeout, $window ) {
+    // Streams the new messages of the active user's conversations to the
+    // listeners.  Messages can arrive more than once.
+    var RETRYTIME = 5000; //milliseconds
+    var listeners = [];
+    var source;
+    var connecting = false;
+    var lastEventId;
+
+    var connect = function() {
+        connecting = true;
+        // The stream token can go in the url, unlike the api key.
+        var tokenPromise = $http( {
+            method: 'GET',
+            url: '/api/messages/stream_token'
+        } );
+        tokenPromise.then(
+      function( response ) {
+          connecting = false;
+          if ( listeners.length === 0 ) {
+              return;
+          }
+          var url = '/api/messages/stream?token=' +
+            encodeURIComponent( response.data.data.token );
+          if ( lastEventId !== undefined ) {
+              url += '&last_event_id=' + lastEventId;
+          }
+          source = new $window.EventSource( url );
+          source.addEventListener( 'message', function( event ) {
+              lastEventId = event.lastEventId;
+              var messageData = JSON.parse( event.data );
+              $rootScope.$apply( function() {
+                  for ( var i=0; i<listeners.length; i++ ) {
+                      listeners[i]( messageData );
+                  }
+              } );
+          } );
+          source.onerror = function() {
+              // The browser reconnects by itself until the token expires.
+              if ( source.readyState === $window.EventSource.CLOSED ) {
+                  source = undefined;
+                  connecting = true;
+                  $timeout( connect, RETRYTIME );
+              }
+          };
+      },
+      function() {
+          $timeout( connect, RETRYTIME );
+      } );
+    };
+
+    var MessageStream = {};
+    MessageStream.isSupported = function() {
+        return $window.EventSource !== undefined;
+    };
+    // Messages after the message afterId are streamed to the listener, or
+    // those after connecting when it is undefined.
+    MessageStream.subscribe = function( listener, afterId ) {
+        listeners.push( listener );
+        if ( ( source === undefined ) && !connecting ) {
+            lastEventId = afterId;
+            connect();
+        }
+    };
+    MessageStream.unsubscribe = function( listener ) {
+        var index = listeners.indexOf( listener );
+        if ( index >= 0 ) {
+            listeners.splice( index, 1 );
+        }
+        if ( ( listeners.length === 0 ) && ( source !== undefined ) ) {
+            source.close();
+            source = undefined;
+        }
+    };
+    return MessageStream;
+}] );
+
 module.factory(
 'Message',
 ['itemFactory', function( itemFactory ) {
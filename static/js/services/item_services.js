@@ -70,34 +70,50 @@ module.factory(
             }
             return deferred.promise;
         };
-        Item.get_many = function( searchParams, forceRefresh ) {
+        // Resolves to the first page of items, with the next page's url as
+        // items.nextPage, or to every item when allPages is true.
+        Item.get_many = function( searchParams, forceRefresh, allPages ) {
             var deferred = $q.defer();
 
-            var searchHash = JSON.stringify( searchParams );
+            var searchHash = JSON.stringify( [searchParams, !!allPages] );
             var items = Item.searchCache[searchHash];
             if ( ( items === undefined ) || forceRefresh ) {
 
-                var dataPromise = $http( {
+                var newItems = [];
+                var getPage = function( request ) {
+                    $http( request ).then(
+                      function( response ) {
+                          for ( var i=0; i<response.data.data.length; i++ ) {
+                              var item = Item.make( response.data.data[i] );
+                              newItems.push( item );
+                          }
+                          var nextPage;
+                          var links = response.data.links || [];
+                          for ( var j=0; j<links.length; j++ ) {
+                              if ( links[j].rel === 'next_page' ) {
+                                  nextPage = links[j].href;
+                              }
+                          }
+                          if ( allPages && ( nextPage !== undefined ) ) {
+                              getPage( {method: 'GET', url: nextPage} );
+                          } else {
+                              newItems.nextPage = nextPage;
+                              Item.searchCache[searchHash] = newItems;
+                              deferred.resolve( newItems );
+                          }
+                      },
+                      function( response ) {
+                          deferred.reject( response.data.message );
+                      }
+                    );
+                };
+
+                getPage( {
                     method: 'GET',
                     url: Item.makeUrl(),
                     params: searchParams
                 } );
 
-                dataPromise.then(
-          function( response ) {
-              var items = [];
-              for ( var i=0; i<response.data.data.length; i++ ) {
-                  var item = Item.make( response.data.data[i] );
-                  items.push( item );
-              }
-              Item.searchCache[searchHash] = items;
-              deferred.resolve( items );
-          },
-          function( response ) {
-              deferred.reject( response.data.message );
-          }
-        );
-
             } else {
                 deferred.resolve( items );
             }
@@ -20,13 +20,14 @@ module.factory(
     Question.get_many_with_answers = function(
     user_id, searchParams, answerParams, forceRefresh ) {
         var deferred = $q.defer();
-        var questionsPromise = Question.get_many( searchParams, forceRefresh );
+        // Every question and answer is needed to fill in the survey.
+        var questionsPromise = Question.get_many( searchParams, forceRefresh, true );
     // FIXME: Not scalable. Grabbing all answers for a given user.
         if ( !answerParams ) {
             answerParams = {};
         }
         answerParams.responder_id = user_id;
-        var answersPromise = Answer.get_many( answerParams );
+        var answersPromise = Answer.get_many( answerParams, false, true );
         $q.all( [questionsPromise, answersPromise] ).then(
       function( data ) {
           var questions = data[0];
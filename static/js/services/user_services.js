@@ -181,7 +181,7 @@ module.factory(
         var _this = this;
         if ( SessionBase.activeUser ) {
             var conversationsPromise = Conversation.get_many(
-        {user_id: SessionBase.activeUser.id} );
+        {user_id: SessionBase.activeUser.id}, false, true );
             conversationsPromise.then(
         function( conversations ) {
             _this.conversationsWithMe = [];
@@ -227,7 +227,7 @@ module.factory(
             'searcher_user_id': this.id,
             'active': true
         };
-        var searchesPromise = Search.get_many( searchParams );
+        var searchesPromise = Search.get_many( searchParams, false, true );
         return searchesPromise;
     };
 
@@ -239,7 +239,7 @@ module.factory(
             'messages.date_created.greaterthan': oneMonthAgo
         };
         var conversationsPromise = Conversation.get_many(
-      conversationParams, true );
+      conversationParams, true, true );
         return conversationsPromise;
     };
 
@@ -250,7 +250,7 @@ module.factory(
             user_id: SessionBase.activeUser.id,
             'datetime_start.greaterthan': today
         };
-        var eventsPromise = Evnt.get_many( params );
+        var eventsPromise = Evnt.get_many( params, false, true );
         return eventsPromise;
     };
 
@@ -300,7 +300,7 @@ module.factory(
         var conversationsPromise = Conversation.get_many(
       {user_id: thisUser.id,
        other_user_id: otherUser.id
-      }, true );
+      }, true, true );
     // Options for the new conversation modal.
         var newConversationOpts = {
             templateUrl: './static/templates/new_conversation.html',
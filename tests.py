@@ -3,18 +3,31 @@ import os
 import unittest
 from unittest import mock
 import logging
+import math
 import json
+import threading
+import time
 import datetime
+from urllib.parse import urlsplit
 
 import setup_test as setup
-from community_share import app, mail, config, time_format, store
+from community_share import app, mail, mail_actions, config, time_format, store
 from community_share.models.share import EventReminder, Event
 from community_share.models.user import User
-from community_share.models.conversation import Conversation
+from community_share.models.conversation import Conversation, InboxEntry, Message
+from community_share.models.outbox import OutboxEmail
+from community_share.models.secret import Secret
 from community_share.models.statistics import Statistic
-from community_share import reminder, worker
+from community_share.models.institution import Institution, InstitutionAssociation
+from community_share.models.search import Label, Search
+from community_share.models.survey import Answer, Question
+from community_share import message_events, recommendations, reminder, worker, search_utils
+from community_share.label_index import label_index
+from community_share.mailgun_standin import MailgunStandin
 from community_share.crypt import CryptHelper
 
+from sqlalchemy import event
+
 logger = logging.getLogger(__name__)
 
 sample_userA = {
@@ -130,7 +143,7 @@ class CommunityShareTestCase(unittest.TestCase):
         rv = self.app.post('/api/confirmemail', data=data, headers=headers)
         self.assertEqual(rv.status_code, 200)
 
-    def save_search(self, user_id, headers, searcher_role, searching_for_role, labels):
+    def save_search(self, user_id, headers, searcher_role, searching_for_role, labels, **fields):
         data = {
             'searcher_user_id': user_id,
             'searcher_role': searcher_role,
@@ -138,6 +151,7 @@ class CommunityShareTestCase(unittest.TestCase):
             'labels': labels,
             'zipcode': 12345
         }
+        data.update(fields)
         serialized = json.dumps(data)
         rv = self.app.post('/api/search', data=serialized, headers=headers)
         self.assertEqual(rv.status_code, 200)
@@ -581,6 +595,1081 @@ class CommunityShareTestCase(unittest.TestCase):
         email = mailer.pop()
         self.assertEqual(email.to_address, sample_userB['email'])
 
+    def capture_queries(self, url, headers):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(store.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            rv = self.app.get(url, headers=headers)
+        finally:
+            event.remove(store.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(rv.status_code, 200)
+        return statements, json.loads(rv.data.decode('utf8'))
+
+    def test_user_search_query_count(self):
+        user_ids, user_headers = self.create_users({'userA': sample_userA})
+        self.create_searches({'userA': user_ids['userA'], 'userB': user_ids['userA']},
+                             {'userA': user_headers['userA'], 'userB': user_headers['userA']})
+        statements, data = self.capture_queries('/api/usersearch', user_headers['userA'])
+        self.assertEqual(len(data['data']), 1)
+        more_user_ids, _ = self.create_users({'userB': sample_userB, 'userC': sample_userC})
+        more_statements, data = self.capture_queries('/api/usersearch', user_headers['userA'])
+        self.assertEqual(len(data['data']), 3)
+        # Related items are eager loaded so the number of queries does not
+        # grow with the number of users.
+        self.assertEqual(len(statements), len(more_statements))
+
+    def test_rights_filtering(self):
+        user_ids, user_headers = self.create_users({
+            'userA': sample_userA,
+            'userB': sample_userB,
+            'userC': sample_userC,
+        })
+        searchA_id, _ = self.create_searches(user_ids, user_headers)
+        conversation = self.make_conversation(
+            user_headers['userA'], searchA_id, 'Robots', user_ids['userA'], user_ids['userB']
+        )
+        share = self.make_share(
+            user_headers['userA'], conversation['id'], user_ids['userA'], user_ids['userB']
+        )
+        questions = [
+            Question(text='Public', question_type='signup', public=True,
+                     creator_id=user_ids['userA']),
+            Question(text='Private', question_type='signup', public=False,
+                     creator_id=user_ids['userA']),
+        ]
+        store.session.add_all(questions)
+        store.session.commit()
+        question_ids = [question.id for question in questions]
+
+        def add_answers():
+            for question_id in question_ids:
+                store.session.add(
+                    Answer(question_id=question_id, responder_id=user_ids['userA'], text='Yes')
+                )
+            store.session.commit()
+
+        def answer_question_ids(user):
+            statements, data = self.capture_queries('/api/answer', user_headers[user])
+            return statements, [answer['question_id'] for answer in data['data']]
+
+        add_answers()
+        statementsA, question_idsA = answer_question_ids('userA')
+        statementsB, question_idsB = answer_question_ids('userB')
+        self.assertEqual(question_idsA, question_ids)
+        # Only answers to public questions can be read by others.
+        self.assertEqual(question_idsB, question_ids[:1])
+        add_answers()
+        more_statementsA, question_idsA = answer_question_ids('userA')
+        more_statementsB, question_idsB = answer_question_ids('userB')
+        self.assertEqual(len(question_idsA), 4)
+        self.assertEqual(len(question_idsB), 2)
+        # Rights are resolved for the whole list rather than for each answer.
+        self.assertEqual(len(statementsA), len(more_statementsA))
+        self.assertEqual(len(statementsB), len(more_statementsB))
+        # Only the people in a share see the answers about its events.
+        _, dataA = self.capture_queries('/api/event', user_headers['userA'])
+        _, dataC = self.capture_queries('/api/event', user_headers['userC'])
+        self.assertEqual([event['share_id'] for event in dataC['data']], [share['id']])
+        self.assertIn('answers', dataA['data'][0])
+        self.assertNotIn('answers', dataC['data'][0])
+
+    def test_users_field_projection(self):
+        user_ids, user_headers = self.create_users({'userA': sample_userA, 'userB': sample_userB})
+        statements, data = self.capture_queries(
+            '/rest/users?field=name', user_headers['userA']
+        )
+        self.assertEqual(
+            sorted(user['name'] for user in data['users']),
+            sorted([sample_userA['name'], sample_userB['name']]),
+        )
+        self.assertEqual({key for user in data['users'] for key in user}, {'id', 'name', 'links'})
+        # Only the requested columns are read and nothing else is joined.
+        users_statements = [s for s in statements if 'LIMIT' in s]
+        self.assertEqual(len(users_statements), 1)
+        self.assertNotIn('bio', users_statements[0])
+        self.assertFalse(any('institution' in s for s in statements))
+
+    def test_users_count(self):
+        user_ids, user_headers = self.create_users({
+            'userA': sample_userA,
+            'userB': sample_userB,
+            'userC': sample_userC,
+        })
+        headers = user_headers['userA']
+        statements, data = self.capture_queries('/rest/users?number=2', headers)
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(len(data['users']), 2)
+        # The total is read with the page rather than by a second query.
+        count_statements = [s for s in statements if 'count(' in s.lower()]
+        self.assertEqual(len(count_statements), 1)
+        self.assertIn('OVER', count_statements[0])
+        for url, expected_count in (
+            ('/rest/users?number=2&offset=5', 3),
+            ('/rest/users?number=2&matches_any=name:charl', 2),
+            ('/rest/users?number=2&count=none', None),
+            # SQLite has no estimates, so the users are counted.
+            ('/rest/users?number=2&count=estimate', 3),
+        ):
+            rv = self.app.get(url, headers=headers)
+            self.assertEqual(rv.status_code, 200)
+            self.assertEqual(json.loads(rv.data.decode('utf8'))['count'], expected_count)
+        rv = self.app.get('/rest/users?count=approximately', headers=headers)
+        self.assertEqual(rv.status_code, 400)
+
+    def test_list_pagination(self):
+        for index in range(5):
+            store.session.add(Institution(name='Institution {}'.format(index)))
+        store.session.commit()
+        names = []
+        url = '/api/institution?limit=2&order_by=-id'
+        n_pages = 0
+        while url is not None:
+            rv = self.app.get(url)
+            self.assertEqual(rv.status_code, 200)
+            data = json.loads(rv.data.decode('utf8'))
+            names += [institution['name'] for institution in data['data']]
+            next_pages = [
+                urlsplit(link['href']) for link in data['links'] if link['rel'] == 'next_page'
+            ]
+            # The test client wants the path and query without the host.
+            url = '{0.path}?{0.query}'.format(next_pages[0]) if next_pages else None
+            n_pages += 1
+        self.assertEqual(n_pages, 3)
+        self.assertEqual(names, ['Institution {}'.format(index) for index in range(4, -1, -1)])
+        # The old behaviour is still available.
+        rv = self.app.get('/api/institution?unpaged=true&limit=2')
+        self.assertEqual(len(json.loads(rv.data.decode('utf8'))['data']), 5)
+        # Only allowlisted columns can be ordered by.
+        rv = self.app.get('/api/institution?order_by=name')
+        self.assertEqual(rv.status_code, 400)
+
+    def test_default_page_limit(self):
+        user_ids, user_headers = self.create_users({'userA': sample_userA, 'userB': sample_userB})
+        searchA_id, _ = self.create_searches(user_ids, user_headers)
+        n_conversations = Conversation.DEFAULT_PAGE_LIMIT + 5
+        for index in range(n_conversations):
+            store.session.add(Conversation(
+                search_id=searchA_id,
+                title='Conversation {0}'.format(index),
+                userA_id=user_ids['userA'],
+                userB_id=user_ids['userB'],
+            ))
+        store.session.commit()
+        # Lists are paged by default, and following the next pages, as the
+        # client does, gets every item including the newest.
+        url = '/api/conversation?user_id={0}'.format(user_ids['userA'])
+        titles = []
+        page_sizes = []
+        while url is not None:
+            rv = self.app.get(url, headers=user_headers['userA'])
+            self.assertEqual(rv.status_code, 200)
+            data = json.loads(rv.data.decode('utf8'))
+            titles += [conversation['title'] for conversation in data['data']]
+            page_sizes.append(len(data['data']))
+            next_pages = [
+                urlsplit(link['href']) for link in data['links'] if link['rel'] == 'next_page'
+            ]
+            url = '{0.path}?{0.query}'.format(next_pages[0]) if next_pages else None
+        self.assertEqual(page_sizes, [Conversation.DEFAULT_PAGE_LIMIT, 5])
+        self.assertEqual(
+            titles, ['Conversation {0}'.format(index) for index in range(n_conversations)]
+        )
+
+    def test_label_index(self):
+        user_ids, user_headers = self.create_users({
+            'userA': sample_userA,
+            'userB': sample_userB,
+            'userC': sample_userC,
+        })
+        searchA_id = self.save_search(
+            user_ids['userA'], user_headers['userA'], 'educator', 'partner',
+            ['Robots', 'dogs', 'beaches']
+        )
+        searchB_id = self.save_search(
+            user_ids['userB'], user_headers['userB'], 'partner', 'educator', ['robots']
+        )
+        searchC_id = self.save_search(
+            user_ids['userC'], user_headers['userC'], 'partner', 'educator', ['robots', 'Dogs']
+        )
+        # The searches were indexed as they were committed.
+        self.assertTrue(label_index.is_warm)
+        url = '/api/search/{0}/0/results'.format(searchA_id)
+        rv = self.app.get(url, headers=user_headers['userA'])
+        self.assertEqual(rv.status_code, 200)
+        result_ids = [search['id'] for search in json.loads(rv.data.decode('utf8'))['data']]
+        self.assertEqual(result_ids, [searchC_id, searchB_id])
+        sql_ids = search_utils.get_search_ids_ordered_by_label_matches_from_db(
+            ['robots', 'dogs', 'beaches'], 'partner', 'educator', 0, 10
+        )
+        self.assertEqual(result_ids, sql_ids)
+        # Deleted searches drop out of the index.
+        rv = self.app.delete('/api/search/{0}'.format(searchC_id), headers=user_headers['userC'])
+        self.assertEqual(rv.status_code, 200)
+        rv = self.app.get(url, headers=user_headers['userA'])
+        result_ids = [search['id'] for search in json.loads(rv.data.decode('utf8'))['data']]
+        self.assertEqual(result_ids, [searchB_id])
+
+    def test_label_completion(self):
+        user_ids, user_headers = self.create_users({'userA': sample_userA, 'userB': sample_userB})
+        self.save_search(
+            user_ids['userA'], user_headers['userA'], 'educator', 'partner',
+            ['Rock Climbing', 'robots']
+        )
+        self.save_search(
+            user_ids['userB'], user_headers['userB'], 'partner', 'educator', ['Robots', 'Art']
+        )
+
+        def complete(prefix, number=10):
+            url = '/api/labels/complete?prefix={0}&number={1}'.format(prefix, number)
+            rv = self.app.get(url)
+            self.assertEqual(rv.status_code, 200)
+            return json.loads(rv.data.decode('utf8'))['data']
+
+        self.assertEqual(complete('RO'), ['robots', 'Rock Climbing'])
+        self.assertEqual(complete('climb'), ['Rock Climbing'])
+        self.assertEqual(complete('ro', 1), ['robots'])
+        self.assertEqual(complete('zebra'), [])
+        rv = self.app.get('/api/labels/complete?prefix=ro&number=1000')
+        self.assertEqual(rv.status_code, 400)
+        # New labels are completed as soon as they are committed.
+        self.save_search(
+            user_ids['userB'], user_headers['userB'], 'partner', 'educator',
+            ['Rock Climbing', 'Rowing']
+        )
+        self.assertEqual(complete('ro'), ['robots', 'Rock Climbing', 'Rowing'])
+        # The full list can be revalidated with its ETag.
+        rv = self.app.get('/api/labels')
+        self.assertEqual(rv.status_code, 200)
+        etag = rv.headers['ETag']
+        rv = self.app.get('/api/labels', headers=[('If-None-Match', etag)])
+        self.assertEqual(rv.status_code, 304)
+        store.session.add(Label(name='Zebras'))
+        store.session.commit()
+        rv = self.app.get('/api/labels', headers=[('If-None-Match', etag)])
+        self.assertEqual(rv.status_code, 200)
+        self.assertIn('Zebras', json.loads(rv.data.decode('utf8'))['data'])
+
+    def test_label_normalization(self):
+        user_ids, user_headers = self.create_users({'userA': sample_userA})
+        user_id = user_ids['userA']
+        headers = user_headers['userA']
+        self.save_search(user_id, headers, 'educator', 'partner', ['Field  Trips'])
+        search_id = self.save_search(
+            user_id, headers, 'educator', 'partner', ['field trips', ' FIELD TRIPS', 'Robots']
+        )
+        search = store.session.query(Search).get(search_id)
+        self.assertEqual(sorted(label.name for label in search.labels), ['Field  Trips', 'Robots'])
+        labels = store.session.query(Label).order_by(Label.id).all()
+        self.assertEqual(
+            [label.normalized_name for label in labels], ['field trips', 'robots']
+        )
+
+    def test_bulk_get_or_create(self):
+        user_ids, user_headers = self.create_users({'userA': sample_userA})
+        user_id = user_ids['userA']
+        headers = user_headers['userA']
+        store.session.add(Institution(name='Robot Club', institution_type='Club'))
+        store.session.commit()
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(store.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            self.save_search(user_id, headers, 'educator', 'partner', ['Robots', 'Dogs', 'robots'])
+            data = json.dumps({
+                'id': user_id,
+                'institution_associations': [
+                    {'role': 'Teacher', 'institution': {'name': 'Tucson High'}},
+                    {
+                        'role': 'Coach',
+                        'institution': {'name': 'Robot Club', 'institution_type': 'Nonprofit'},
+                    },
+                ],
+            })
+            rv = self.app.put('/api/user/{0}'.format(user_id), data=data, headers=headers)
+            self.assertEqual(rv.status_code, 200)
+        finally:
+            event.remove(store.engine, 'before_cursor_execute', before_cursor_execute)
+        # Labels and institutions are each inserted by one statement.
+        for table in ('label', 'institution'):
+            insert = 'INTO {0} '.format(table)
+            inserts = [s for s in statements if s.startswith('INSERT') and insert in s]
+            self.assertEqual(len(inserts), 1)
+        self.assertEqual(
+            sorted(label.name for label in store.session.query(Label)), ['Dogs', 'Robots']
+        )
+        user = store.session.query(User).get(user_id)
+        self.assertEqual(
+            sorted(
+                (association.role, association.institution.name,
+                 association.institution.institution_type)
+                for association in user.institution_associations
+            ),
+            [('Coach', 'Robot Club', 'Nonprofit'), ('Teacher', 'Tucson High', None)],
+        )
+        self.assertEqual(store.session.query(Institution).count(), 2)
+
+    def test_search_matches(self):
+        user_ids, user_headers = self.create_users({
+            'userA': sample_userA,
+            'userB': sample_userB,
+            'userC': sample_userC,
+        })
+        searchA_id = self.save_search(
+            user_ids['userA'], user_headers['userA'], 'educator', 'partner', ['robots', 'dogs']
+        )
+        searchB_id = self.save_search(
+            user_ids['userB'], user_headers['userB'], 'partner', 'educator', ['robots']
+        )
+        searchC_id = self.save_search(
+            user_ids['userC'], user_headers['userC'], 'partner', 'educator', ['cats']
+        )
+        self.assertEqual(search_utils.refresh_stale_search_matches(), 3)
+        self.assertEqual(search_utils.refresh_stale_search_matches(), 0)
+        url = '/api/search/{0}/0/results'.format(searchA_id)
+
+        def get_result_ids():
+            rv = self.app.get(url, headers=user_headers['userA'])
+            self.assertEqual(rv.status_code, 200)
+            return [search['id'] for search in json.loads(rv.data.decode('utf8'))['data']]
+
+        def is_stale(search_id):
+            search = store.session.query(Search).get(search_id)
+            store.session.refresh(search)
+            return search.match_version > search.matched_version
+
+        self.assertEqual(get_result_ids(), [searchB_id])
+        # Only searches sharing a label with a changed search go stale.
+        data = json.dumps({'id': searchC_id, 'labels': ['dogs', 'robots']})
+        rv = self.app.put(
+            '/api/search/{0}'.format(searchC_id), data=data, headers=user_headers['userC']
+        )
+        self.assertEqual(rv.status_code, 200)
+        self.assertTrue(is_stale(searchA_id))
+        self.assertTrue(is_stale(searchC_id))
+        self.assertFalse(is_stale(searchB_id))
+        # Stale matches are served until they are refreshed.
+        self.assertEqual(get_result_ids(), [searchB_id])
+        self.assertEqual(search_utils.refresh_stale_search_matches(), 2)
+        self.assertEqual(get_result_ids(), [searchC_id, searchB_id])
+        searchA = store.session.query(Search).get(searchA_id)
+        searches = search_utils.find_matching_searches(searchA, 1, max_number=1)
+        self.assertEqual([search.id for search in searches], [searchB_id])
+        # Deleted searches drop out straight away.
+        rv = self.app.delete('/api/search/{0}'.format(searchC_id), headers=user_headers['userC'])
+        self.assertEqual(rv.status_code, 200)
+        self.assertTrue(is_stale(searchA_id))
+        self.assertEqual(get_result_ids(), [searchB_id])
+
+    def test_recommendations(self):
+        user_ids, user_headers = self.create_users({
+            'userA': sample_userA,
+            'userB': sample_userB,
+            'userC': sample_userC,
+        })
+        self.save_search(
+            user_ids['userA'], user_headers['userA'], 'educator', 'partner',
+            ['robots', 'dogs', 'beaches']
+        )
+        self.save_search(
+            user_ids['userB'], user_headers['userB'], 'partner', 'educator', ['robots']
+        )
+        self.save_search(
+            user_ids['userC'], user_headers['userC'], 'partner', 'educator', ['robots', 'dogs']
+        )
+        recommendations.update_recommendations()
+        url = '/api/recommendation?user_id={0}'.format(user_ids['userA'])
+        rv = self.app.get(url, headers=user_headers['userA'])
+        self.assertEqual(rv.status_code, 200)
+        data = json.loads(rv.data.decode('utf8'))['data']
+        self.assertEqual(
+            [item['recommended_user']['id'] for item in data],
+            [user_ids['userC'], user_ids['userB']],
+        )
+        # Every partner has robots, so only dogs counts for more than one.
+        self.assertAlmostEqual(data[0]['score'], 2 + math.log(3 / 2))
+        self.assertAlmostEqual(data[1]['score'], 1)
+        # Users can't see each other's recommendations.
+        rv = self.app.get(url, headers=user_headers['userB'])
+        self.assertEqual(rv.status_code, 403)
+        rv = self.app.get('/api/recommendation', headers=user_headers['userB'])
+        self.assertEqual(rv.status_code, 403)
+
+    def test_search_distance(self):
+        user_ids, user_headers = self.create_users({
+            'userA': sample_userA,
+            'userB': sample_userB,
+            'userC': sample_userC,
+        })
+        # In Tucson, looking within 50 miles.
+        searchA_id = self.save_search(
+            user_ids['userA'], user_headers['userA'], 'educator', 'partner',
+            ['robots', 'dogs'], latitude=32.2217, longitude=-110.9265, distance=50
+        )
+        # Marana, about 20 miles away.
+        searchB_id = self.save_search(
+            user_ids['userB'], user_headers['userB'], 'partner', 'educator',
+            ['robots'], latitude=32.4367, longitude=-111.2254
+        )
+        # Sahuarita, about 18 miles away.
+        searchC_id = self.save_search(
+            user_ids['userC'], user_headers['userC'], 'partner', 'educator',
+            ['robots'], latitude=31.9576, longitude=-110.9556, distance=30
+        )
+        url = '/api/search/{0}/0/results'.format(searchA_id)
+
+        def get_result_ids():
+            rv = self.app.get(url, headers=user_headers['userA'])
+            self.assertEqual(rv.status_code, 200)
+            return [search['id'] for search in json.loads(rv.data.decode('utf8'))['data']]
+
+        def get_sql_result_ids():
+            return search_utils.get_search_ids_near_from_db(
+                ['robots', 'dogs'], 'partner', 'educator', (32.2217, -110.9265, 50), 0, 10
+            )
+
+        # Equal matches are nearest first.
+        self.assertEqual(get_result_ids(), [searchC_id, searchB_id])
+        self.assertEqual(get_sql_result_ids(), [searchC_id, searchB_id])
+        # Searches further than the search's distance are dropped.
+        searchB = store.session.query(Search).get(searchB_id)
+        searchB.latitude, searchB.longitude = 33.4484, -112.0740
+        store.session.commit()
+        self.assertEqual(get_result_ids(), [searchC_id])
+        self.assertEqual(get_sql_result_ids(), [searchC_id])
+        # So are searches further than their own distance.
+        searchC = store.session.query(Search).get(searchC_id)
+        searchC.distance = 10
+        store.session.commit()
+        self.assertEqual(get_result_ids(), [])
+        self.assertEqual(get_sql_result_ids(), [])
+
+    def test_zipcode_coordinates(self):
+        user_ids, user_headers = self.create_users({'userA': sample_userA})
+        user_id = user_ids['userA']
+        headers = user_headers['userA']
+        search_id = self.save_search(
+            user_id, headers, 'educator', 'partner', ['robots'], zipcode='85701'
+        )
+        search = store.session.query(Search).get(search_id)
+        self.assertAlmostEqual(search.latitude, 32.22, places=1)
+        self.assertAlmostEqual(search.longitude, -110.97, places=1)
+        # Coordinates sent with the zipcode are kept.
+        search_id = self.save_search(
+            user_id, headers, 'educator', 'partner', ['robots'],
+            zipcode='85701', latitude=1.5, longitude=2.5
+        )
+        search = store.session.query(Search).get(search_id)
+        self.assertEqual((search.latitude, search.longitude), (1.5, 2.5))
+        # Editing a user's zipcode updates their coordinates.
+        for zipcode, expected_latitude in (('85701', 32.22), ('not a zipcode', None)):
+            data = json.dumps({'id': user_id, 'zipcode': zipcode})
+            rv = self.app.put('/api/user/{0}'.format(user_id), data=data, headers=headers)
+            self.assertEqual(rv.status_code, 200)
+            user = store.session.query(User).get(user_id)
+            if expected_latitude is None:
+                self.assertIsNone(user.latitude)
+            else:
+                self.assertAlmostEqual(user.latitude, expected_latitude, places=1)
+
+    def test_user_text_search(self):
+        user_ids, user_headers = self.create_users({
+            'userA': sample_userA,
+            'userB': sample_userB,
+            'userC': sample_userC,
+        })
+        headers = user_headers['userA']
+
+        def search_ids(search_text):
+            url = '/api/usersearch?search_text={0}'.format(search_text)
+            rv = self.app.get(url, headers=headers)
+            self.assertEqual(rv.status_code, 200)
+            return [user['id'] for user in json.loads(rv.data.decode('utf8'))['data']]
+
+        def rest_ids(match):
+            rv = self.app.get('/rest/users?matches_any={0}'.format(match), headers=headers)
+            self.assertEqual(rv.status_code, 200)
+            return [user['id'] for user in json.loads(rv.data.decode('utf8'))['users']]
+
+        self.assertEqual(search_ids('charl'), [user_ids['userA'], user_ids['userC']])
+        self.assertEqual(search_ids('ROB example'), [user_ids['userB']])
+        self.assertEqual(search_ids('100%'), [])
+        self.assertEqual(rest_ids('name:Charlie'), [user_ids['userC']])
+        self.assertEqual(rest_ids('bio:rob'), [user_ids['userB']])
+        # Institutions are searched by name, and renaming one is picked up.
+        institution = Institution(name='Tucson Robotics Club')
+        user = store.session.query(User).get(user_ids['userC'])
+        user.institution_associations.append(
+            InstitutionAssociation(institution=institution, role='Member')
+        )
+        store.session.commit()
+        self.assertEqual(rest_ids('institution:robotics'), [user_ids['userC']])
+        self.assertEqual(search_ids('tucson'), [user_ids['userC']])
+        institution = store.session.query(Institution).filter_by(name='Tucson Robotics Club').one()
+        institution.name = 'Phoenix Robotics Club'
+        store.session.commit()
+        self.assertEqual(search_ids('tucson'), [])
+        self.assertEqual(search_ids('phoenix'), [user_ids['userC']])
+        # So are edits to users.
+        data = json.dumps({'id': user_ids['userB'], 'name': 'Roberta'})
+        rv = self.app.put(
+            '/api/user/{0}'.format(user_ids['userB']), data=data, headers=user_headers['userB']
+        )
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rest_ids('name:roberta'), [user_ids['userB']])
+
+    def test_inbox(self):
+        user_ids, user_headers = self.create_users({
+            'userA': sample_userA,
+            'userB': sample_userB,
+            'userC': sample_userC,
+        })
+        userA_id, userB_id, userC_id = user_ids['userA'], user_ids['userB'], user_ids['userC']
+        searchA_id, _ = self.create_searches(user_ids, user_headers)
+        conversationAB = self.make_conversation(
+            user_headers['userA'], searchA_id, 'Robots', userA_id, userB_id
+        )
+        conversationAC = self.make_conversation(
+            user_headers['userA'], searchA_id, 'Dogs', userA_id, userC_id
+        )
+
+        def post_message(conversation, sender, content):
+            data = json.dumps({
+                'conversation_id': conversation['id'],
+                'sender_user_id': user_ids[sender],
+                'content': content,
+            })
+            rv = self.app.post('/api/message', headers=user_headers[sender], data=data)
+            self.assertEqual(rv.status_code, 200)
+            return json.loads(rv.data.decode('utf8'))['data']['id']
+
+        def inbox(user, args=''):
+            rv = self.app.get('/api/inbox{0}'.format(args), headers=user_headers[user])
+            self.assertEqual(rv.status_code, 200)
+            data = json.loads(rv.data.decode('utf8'))
+            return [
+                (entry['conversation']['id'], entry['other_user']['id'], entry['unread_count'],
+                 entry['last_message'] and entry['last_message']['content'])
+                for entry in data['data']
+            ], data['links']
+
+        post_message(conversationAB, 'userA', 'Hello B')
+        message_id = post_message(conversationAB, 'userA', 'Are you there?')
+        post_message(conversationAC, 'userC', 'Hello A')
+        entries, _ = inbox('userA')
+        self.assertEqual(entries, [
+            (conversationAC['id'], userC_id, 1, 'Hello A'),
+            (conversationAB['id'], userB_id, 0, 'Are you there?'),
+        ])
+        entries, links = inbox('userB', '?unread=true&limit=1')
+        self.assertEqual(entries, [(conversationAB['id'], userA_id, 2, 'Are you there?')])
+        self.assertEqual([link['rel'] for link in links], ['self'])
+        # Unviewed conversations are listed once however many messages they have.
+        url = '/api/conversation?user_id={0}&with_unviewed_messages=true'.format(userB_id)
+        rv = self.app.get(url, headers=user_headers['userB'])
+        conversations = json.loads(rv.data.decode('utf8'))['data']
+        self.assertEqual([c['id'] for c in conversations], [conversationAB['id']])
+        # Viewing a message counts it as read.
+        data = json.dumps({'id': message_id, 'viewed': True})
+        rv = self.app.put(
+            '/api/message/{0}'.format(message_id), data=data, headers=user_headers['userB']
+        )
+        self.assertEqual(rv.status_code, 200)
+        entries, _ = inbox('userB')
+        self.assertEqual(entries, [(conversationAB['id'], userA_id, 1, 'Are you there?')])
+        # Pages link to the next one.
+        entries, links = inbox('userA', '?limit=1')
+        self.assertEqual([entry[0] for entry in entries], [conversationAC['id']])
+        next_page = [urlsplit(link['href']) for link in links if link['rel'] == 'next_page'][0]
+        entries, _ = inbox('userA', '?' + next_page.query)
+        self.assertEqual([entry[0] for entry in entries], [conversationAB['id']])
+        rv = self.app.get('/api/inbox')
+        self.assertEqual(rv.status_code, 401)
+
+    def test_message_pages(self):
+        user_ids, user_headers = self.create_users({'userA': sample_userA, 'userB': sample_userB})
+        searchA_id, _ = self.create_searches(user_ids, user_headers)
+        conversation = self.make_conversation(
+            user_headers['userA'], searchA_id, 'Robots', user_ids['userA'], user_ids['userB']
+        )
+        other_conversation = self.make_conversation(
+            user_headers['userB'], searchA_id, 'Dogs', user_ids['userB'], user_ids['userA']
+        )
+        empty_conversation = self.make_conversation(
+            user_headers['userA'], searchA_id, 'Cats', user_ids['userA'], user_ids['userB']
+        )
+        # Messages are added directly, all at the same time so they are
+        # ordered by id.
+        now = datetime.datetime.utcnow()
+        for conversation_id, n_messages in ((conversation['id'], 7), (other_conversation['id'], 2)):
+            for index in range(n_messages):
+                store.session.add(Message(
+                    conversation_id=conversation_id,
+                    sender_user_id=user_ids['userA'],
+                    content='Message {0}'.format(index),
+                    date_created=now,
+                ))
+        store.session.commit()
+        headers = user_headers['userB']
+
+        def get(url):
+            rv = self.app.get(url, headers=headers)
+            self.assertEqual(rv.status_code, 200)
+            data = json.loads(rv.data.decode('utf8'))
+            contents = [message['content'] for message in data['data']]
+            links = {
+                link['rel']: '{0.path}?{0.query}'.format(urlsplit(link['href']))
+                for link in data['links'] if link['rel'] != 'self'
+            }
+            return contents, links
+
+        url = '/api/conversation/{0}/messages?limit=3'.format(conversation['id'])
+        contents, links = get(url)
+        self.assertEqual(contents, ['Message 4', 'Message 5', 'Message 6'])
+        contents, links = get(links['prev_page'])
+        self.assertEqual(contents, ['Message 1', 'Message 2', 'Message 3'])
+        contents, older_links = get(links['prev_page'])
+        self.assertEqual(contents, ['Message 0'])
+        self.assertNotIn('prev_page', older_links)
+        contents, links = get(links['next_page'])
+        self.assertEqual(contents, ['Message 4', 'Message 5', 'Message 6'])
+        last_url = links['next_page']
+        contents, links = get(last_url)
+        # There is always a next page to poll for new messages.
+        self.assertEqual((contents, links), ([], {'next_page': last_url}))
+        url = '/api/conversation/{0}/messages?limit=3'.format(empty_conversation['id'])
+        contents, links = get(url)
+        self.assertEqual(contents, [])
+        self.assertEqual(list(links), ['next_page'])
+        self.assertIn('after_id=0', links['next_page'])
+        store.session.add(Message(
+            conversation_id=empty_conversation['id'],
+            sender_user_id=user_ids['userA'],
+            content='First',
+        ))
+        store.session.commit()
+        contents, links = get(links['next_page'])
+        self.assertEqual(contents, ['First'])
+        for bad_args in ('limit=0', 'before_id=1&after_id=2', 'before_id=one'):
+            rv = self.app.get(
+                '/api/conversation/{0}/messages?{1}'.format(conversation['id'], bad_args),
+                headers=headers,
+            )
+            self.assertEqual(rv.status_code, 400)
+        # Conversations can come with only their last messages.
+        url = '/api/conversation/{0}?expand=messages:last 2'.format(conversation['id'])
+        rv = self.app.get(url, headers=headers)
+        data = json.loads(rv.data.decode('utf8'))['data']
+        self.assertEqual([m['content'] for m in data['messages']], ['Message 5', 'Message 6'])
+        url = '/api/conversation?user_id={0}&expand=messages:last 1'.format(user_ids['userB'])
+        rv = self.app.get(url, headers=headers)
+        data = json.loads(rv.data.decode('utf8'))['data']
+        self.assertEqual(
+            {c['id']: [m['content'] for m in c['messages']] for c in data},
+            {
+                conversation['id']: ['Message 6'],
+                other_conversation['id']: ['Message 1'],
+                empty_conversation['id']: ['First'],
+            },
+        )
+        rv = self.app.get(url.replace('last 1', 'first 1'), headers=headers)
+        self.assertEqual(rv.status_code, 400)
+
+    def test_bulk_viewed(self):
+        user_ids, user_headers = self.create_users({
+            'userA': sample_userA,
+            'userB': sample_userB,
+            'userC': sample_userC,
+        })
+        searchA_id, _ = self.create_searches(user_ids, user_headers)
+        conversation = self.make_conversation(
+            user_headers['userA'], searchA_id, 'Robots', user_ids['userA'], user_ids['userB']
+        )
+        message_ids = []
+        for sender, content in (('userA', 'One'), ('userB', 'Two'), ('userA', 'Three'),
+                                ('userA', 'Four')):
+            message = Message(
+                conversation_id=conversation['id'], sender_user_id=user_ids[sender], content=content
+            )
+            store.session.add(message)
+            store.session.commit()
+            message_ids.append(message.id)
+        url = '/api/conversation/{0}/viewed'.format(conversation['id'])
+
+        def mark_viewed(user, up_to_id):
+            data = json.dumps({'up_to_id': up_to_id})
+            return self.app.post(url, data=data, headers=user_headers[user])
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(store.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            rv = mark_viewed('userB', message_ids[2])
+        finally:
+            event.remove(store.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(
+            json.loads(rv.data.decode('utf8'))['data'], {'viewed': 2, 'unread_count': 1}
+        )
+        message_updates = [s for s in statements if s.startswith('UPDATE message')]
+        self.assertEqual(len(message_updates), 1)
+        viewed = [
+            message.viewed
+            for message in store.session.query(Message).order_by(Message.id)
+        ]
+        self.assertEqual(viewed, [True, False, True, False])
+        entry = store.session.query(InboxEntry).get((conversation['id'], user_ids['userB']))
+        self.assertEqual(entry.unread_count, 1)
+        # Messages already viewed aren't counted again.
+        rv = mark_viewed('userB', message_ids[3])
+        self.assertEqual(
+            json.loads(rv.data.decode('utf8'))['data'], {'viewed': 1, 'unread_count': 0}
+        )
+        self.assertEqual(mark_viewed('userC', message_ids[3]).status_code, 403)
+        self.assertEqual(mark_viewed('userA', 'all').status_code, 400)
+
+    def test_message_stream(self):
+        user_ids, user_headers = self.create_users({'userA': sample_userA, 'userB': sample_userB})
+        searchA_id, _ = self.create_searches(user_ids, user_headers)
+        conversation = self.make_conversation(
+            user_headers['userA'], searchA_id, 'Robots', user_ids['userA'], user_ids['userB']
+        )
+
+        def add_message(content):
+            message = Message(
+                conversation_id=conversation['id'],
+                sender_user_id=user_ids['userA'],
+                content=content,
+            )
+            store.session.add(message)
+            store.session.commit()
+            message_id = message.id
+            store.session.remove()
+            return message_id
+
+        # Committed messages wake up the streams of both users.
+        subscription = message_events.message_broker.subscribe(user_ids['userB'])
+        try:
+            first_id = add_message('First')
+            self.assertTrue(subscription.wait(0))
+            self.assertFalse(subscription.wait(0))
+        finally:
+            message_events.message_broker.unsubscribe(subscription)
+
+        api_key = dict(user_headers['userB'])['Authorization'].split(':')[2]
+        rv = self.app.get('/api/messages/stream')
+        self.assertEqual(rv.status_code, 401)
+        # Api keys can't be put in the url, only stream tokens.
+        rv = self.app.get('/api/messages/stream?token={0}'.format(api_key))
+        self.assertEqual(rv.status_code, 401)
+        rv = self.app.get('/api/messages/stream_token', headers=user_headers['userB'])
+        self.assertEqual(rv.status_code, 200)
+        token = json.loads(rv.data.decode('utf8'))['data']['token']
+        rv = self.app.get('/api/user/{0}'.format(user_ids['userB']), headers=make_headers(token))
+        self.assertEqual(rv.status_code, 401)
+        url = '/api/messages/stream?token={0}'.format(token)
+        # Clients resume from the last event they saw.
+        config.MESSAGE_STREAM_SECONDS = 0.3
+        config.MESSAGE_STREAM_HEARTBEAT_SECONDS = 0.1
+        second_id = add_message('Second')
+        rv = self.app.get(url, headers=[('Last-Event-ID', str(first_id))])
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.mimetype, 'text/event-stream')
+        events = rv.data.decode('utf8').split('\n\n')
+        message_events_sent = [e for e in events if 'event: message' in e]
+        # Recent messages are sent again in case they committed late.
+        self.assertEqual(
+            [json.loads(e.split('data: ', 1)[1])['content'] for e in message_events_sent],
+            ['First', 'Second'],
+        )
+        self.assertIn('id: {0}\n'.format(second_id), message_events_sent[1])
+        self.assertIn(': heartbeat', events)
+        # A message read after one with a larger id is found when recent.
+        since = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+        late_messages = message_events.get_new_messages(
+            user_ids['userB'], second_id, {second_id}, since
+        )
+        self.assertEqual([message.id for message in late_messages], [first_id])
+        late_messages = message_events.get_new_messages(
+            user_ids['userB'], second_id, {first_id, second_id}, since
+        )
+        self.assertEqual(late_messages, [])
+        # New messages are pushed as they are committed rather than on the
+        # next heartbeat.
+        config.MESSAGE_STREAM_SECONDS = 3
+        config.MESSAGE_STREAM_HEARTBEAT_SECONDS = 3
+        rv = self.app.get(url, buffered=False)
+        chunks = iter(rv.response)
+        self.assertTrue(next(chunks).startswith(b'retry:'))
+        start = time.time()
+        thread = threading.Timer(0.2, add_message, ['Third'])
+        thread.start()
+        chunk = next(chunks)
+        self.assertIn(b'"content": "Third"', chunk)
+        self.assertLess(time.time() - start, 2)
+        thread.join()
+        rv.response.close()
+
+    def test_outbox(self):
+        config.MAILER_TYPE = 'OUTBOX'
+        standin = MailgunStandin(api_key='key-test').start()
+        self.addCleanup(standin.stop)
+        settings = {
+            'MAIL_DELIVERY': 'MAILGUN',
+            'MAILGUN_API_URL': standin.url,
+            'MAILGUN_API_KEY': 'key-test',
+            'MAILGUN_DOMAIN': 'mail.example.org',
+            'OUTBOX_BATCH_SIZE': 2,
+            'OUTBOX_MAX_ATTEMPTS': 2,
+        }
+        with mock.patch.multiple(config, **settings):
+            # Signing up adds the confirmation email to the outbox in the
+            # request's transaction.
+            data = json.dumps({'password': sample_userA['password'], 'user': sample_userA})
+            headers = [('Content-Type', 'application/json')]
+            rv = self.app.post('/api/usersignup', data=data, headers=headers)
+            self.assertEqual(rv.status_code, 200)
+            outbox_emails = store.session.query(OutboxEmail).all()
+            self.assertEqual([e.to_address for e in outbox_emails], [sample_userA['email']])
+            store.session.query(OutboxEmail).delete()
+            store.session.commit()
+            # Nothing is sent for rolled back transactions.
+            email = mail.Email('from@example.org', 'to@example.org', 'Subject', 'Hi', 'Hi')
+            mail.get_mailer().send(email)
+            store.session.rollback()
+            self.assertEqual(store.session.query(OutboxEmail).count(), 0)
+            for index in range(3):
+                to_address = 'to{0}@example.org'.format(index)
+                mail.get_mailer().send(
+                    mail.Email('from@example.org', to_address, 'Subject', 'Hi', 'Hi')
+                )
+            store.session.commit()
+            standin.fail_next(1)
+            # Batches are claimed until the outbox is drained.
+            self.assertEqual(worker.dispatch_outbox(), 2)
+            self.assertEqual(len(standin.messages), 2)
+            failed = store.session.query(OutboxEmail).filter_by(status='pending').one()
+            self.assertEqual(failed.attempts, 1)
+            self.assertTrue(failed.last_error)
+            self.assertGreater(failed.next_attempt_at, datetime.datetime.utcnow())
+            # Failed emails wait for their retry.
+            self.assertEqual(worker.dispatch_outbox(), 0)
+            failed.next_attempt_at = datetime.datetime.utcnow()
+            store.session.commit()
+            self.assertEqual(worker.dispatch_outbox(), 1)
+            self.assertEqual(
+                sorted(message['to'] for message in standin.messages),
+                ['to0@example.org', 'to1@example.org', 'to2@example.org'],
+            )
+            # An email whose dispatcher died before recording it is sent
+            # again, with the same Message-Id.
+            sent = store.session.query(OutboxEmail).first()
+            sent.status = 'pending'
+            sent.next_attempt_at = datetime.datetime.utcnow()
+            store.session.commit()
+            self.assertEqual(worker.dispatch_outbox(), 1)
+            self.assertEqual(len(standin.messages), 4)
+            outbox_email = store.session.query(OutboxEmail).first()
+            message_id = '<{0}@mail.example.org>'.format(outbox_email.idempotency_key)
+            self.assertEqual(
+                [m['message_id'] for m in standin.messages if m['to'] == outbox_email.to_address],
+                [message_id, message_id],
+            )
+            # A dispatcher whose lease ran out doesn't record its attempt
+            # over the one of the dispatcher that claimed the email again.
+            outbox_email.status = 'pending'
+            outbox_email.next_attempt_at = datetime.datetime.utcnow()
+            store.session.commit()
+            stale, = OutboxEmail.claim_due(1, 0)
+            store.session.query(OutboxEmail).filter_by(id=stale.id).update({'claim': 'newer'})
+            store.session.commit()
+            self.assertFalse(stale.record_sent())
+            self.assertFalse(stale.record_failure('Timeout', 2, 60))
+            store.session.commit()
+            self.assertEqual((stale.status, stale.claim), ('pending', 'newer'))
+            store.session.query(OutboxEmail).filter_by(id=stale.id).update({'status': 'sent'})
+            store.session.commit()
+            # Emails are given up on after OUTBOX_MAX_ATTEMPTS.
+            mail.get_mailer().send(email)
+            store.session.commit()
+            standin.fail_next(2)
+            for _ in range(2):
+                store.session.query(OutboxEmail).filter_by(status='pending').update(
+                    {'next_attempt_at': datetime.datetime.utcnow()}
+                )
+                store.session.commit()
+                self.assertEqual(worker.dispatch_outbox(), 0)
+            given_up = store.session.query(OutboxEmail).filter_by(to_address='to@example.org').one()
+            self.assertEqual((given_up.status, given_up.attempts), ('failed', 2))
+
+    def test_outbox_transactions(self):
+        user_ids, user_headers = self.create_users({'userA': sample_userA, 'userB': sample_userB})
+        searchA_id, _ = self.create_searches(user_ids, user_headers)
+        conversation = self.make_conversation(
+            user_headers['userA'], searchA_id, 'Robots', user_ids['userA'], user_ids['userB']
+        )
+        config.MAILER_TYPE = 'OUTBOX'
+        api_key = dict(user_headers['userA'])['Authorization'].split(':')[2]
+        # Added items and the emails about them commit together.
+        self.send_message(conversation['id'], user_ids['userA'], 'Kept', api_key)
+        self.assertEqual(store.session.query(Message).filter_by(content='Kept').count(), 1)
+        self.assertEqual(store.session.query(OutboxEmail).count(), 1)
+        store.session.remove()
+        # Or not at all.
+        original_on_add = Message.on_add
+
+        def failing_on_add(message, requester):
+            original_on_add(message, requester)
+            raise RuntimeError('Failed after queueing the email')
+
+        message_data = json.dumps({
+            'conversation_id': conversation['id'],
+            'sender_user_id': user_ids['userA'],
+            'content': 'Lost',
+        })
+        with mock.patch.object(Message, 'on_add', failing_on_add):
+            rv = self.app.post('/api/message', headers=make_headers(api_key), data=message_data)
+        self.assertEqual(rv.status_code, 500)
+        store.session.remove()
+        self.assertEqual(store.session.query(Message).filter_by(content='Lost').count(), 0)
+        self.assertEqual(store.session.query(OutboxEmail).count(), 1)
+        # So do new users and their confirmation emails.
+        data = json.dumps({'password': sample_userC['password'], 'user': sample_userC})
+        headers = [('Content-Type', 'application/json')]
+        original_request = mail_actions.request_signup_email_confirmation
+
+        def failing_request(user):
+            original_request(user)
+            raise RuntimeError('Failed after queueing the email')
+
+        with mock.patch.object(mail_actions, 'request_signup_email_confirmation', failing_request):
+            rv = self.app.post('/api/usersignup', data=data, headers=headers)
+        self.assertEqual(rv.status_code, 500)
+        store.session.remove()
+        self.assertEqual(
+            store.session.query(User).filter_by(email=sample_userC['email']).count(), 0
+        )
+        self.assertEqual(store.session.query(OutboxEmail).count(), 1)
+        rv = self.app.post('/api/usersignup', data=data, headers=headers)
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(
+            store.session.query(OutboxEmail).filter_by(to_address=sample_userC['email']).count(),
+            1,
+        )
+
+    def test_mailgun_batch(self):
+        user_ids = []
+        for index, sample_user in enumerate((sample_userA, sample_userB, sample_userC)):
+            user_data = dict(sample_user, email='user{0}@example.org'.format(index))
+            user_id, _, _ = self.sign_up(user_data)
+            user_ids.append(user_id)
+        users = [store.session.query(User).get(user_id) for user_id in user_ids]
+        template = mail_actions.CONFIRM_EMAIL_REMINDER_TEMPLATE
+        # Mailers that can't batch send an email to each recipient.
+        mail_actions.request_signup_email_confirmations(users, template, 'Confirm')
+        queue = mail.get_mailer().queue
+        self.assertEqual([email.to_address for email in queue], [u.email for u in users])
+        self.assertNotIn('%recipient', queue[0].content)
+        standin = MailgunStandin(api_key='key-test').start()
+        self.addCleanup(standin.stop)
+        settings = {
+            'MAILER_TYPE': 'MAILGUN',
+            'MAILGUN_API_URL': standin.url,
+            'MAILGUN_API_KEY': 'key-test',
+            'MAILGUN_DOMAIN': 'mail.example.org',
+        }
+        mailer = mail.mailer_type_to_mail['MAILGUN']
+        with mock.patch.multiple(config, **settings), \
+                mock.patch.object(mailer, 'MAX_BATCH_RECIPIENTS', 2):
+            error_message = mail_actions.request_signup_email_confirmations(
+                users, template, 'Confirm'
+            )
+            self.assertEqual(error_message, '')
+            self.assertEqual(standin.n_requests, 2)
+            self.assertEqual([metric.n_recipients for metric in mailer.batch_metrics][-2:], [2, 1])
+            self.assertEqual(
+                sorted(message['to'] for message in standin.messages), [u.email for u in users]
+            )
+            # Each recipient gets their own link.
+            for message in standin.messages:
+                key = re.search(r'key=(\w+)', message['html']).group(1)
+                secret = Secret.lookup_secret(key)
+                self.assertEqual(secret.get_info()['email'], message['to'])
+            for user in users:
+                mailer.send(mail.Email('from@example.org', user.email, 'Hi', 'Hi', 'Hi'))
+            # Requests reuse the connection.
+            self.assertEqual(standin.n_requests, 5)
+            self.assertEqual(standin.n_connections, 1)
+        # The outbox mailer adds the batch in the transaction and the worker
+        # sends it in batches, retrying failed ones.
+        settings = dict(settings, MAILER_TYPE='OUTBOX', MAIL_DELIVERY='MAILGUN')
+        with mock.patch.multiple(config, **settings), \
+                mock.patch.object(mail.MailgunMailer, 'MAX_BATCH_RECIPIENTS', 2):
+            error_message = mail_actions.request_signup_email_confirmations(
+                users, template, 'Confirm'
+            )
+            self.assertEqual(error_message, '')
+            self.assertEqual(standin.n_requests, 5)
+            outbox_emails = store.session.query(OutboxEmail).order_by(OutboxEmail.to_address)
+            batch_keys = [e.batch_key for e in outbox_emails]
+            self.assertEqual(len(batch_keys), 3)
+            self.assertEqual(batch_keys[0], batch_keys[1])
+            self.assertNotEqual(batch_keys[1], batch_keys[2])
+            standin.fail_next(1)
+            n_sent = worker.dispatch_outbox()
+            # Only the recipients of the failed batch are retried.
+            failed = store.session.query(OutboxEmail).filter_by(status='pending').all()
+            self.assertEqual(n_sent + len(failed), 3)
+            self.assertEqual(len({e.batch_key for e in failed}), 1)
+            for outbox_email in failed:
+                outbox_email.next_attempt_at = datetime.datetime.utcnow()
+            store.session.commit()
+            self.assertEqual(worker.dispatch_outbox(), len(failed))
+            self.assertEqual(standin.n_requests, 8)
+            batch_messages = standin.messages[-3:]
+            self.assertEqual(sorted(m['to'] for m in batch_messages), [u.email for u in users])
+            for message in batch_messages:
+                # Recipients' copies don't share a Message-Id.
+                self.assertNotIn('h:Message-Id', message)
+                key = re.search(r'key=(\w+)', message['html']).group(1)
+                self.assertEqual(Secret.lookup_secret(key).get_info()['email'], message['to'])
+
+    def test_api_keys(self):
+        userA_id, userA_api_key, userA_email_key = self.sign_up(sample_userA)
+        self.confirm_email(userA_email_key)
+        # Signed keys do not create secrets.
+        api_key_secrets = store.session.query(Secret).filter(Secret.info.like('%api_key%'))
+        self.assertEqual(api_key_secrets.count(), 0)
+        rv = self.app.get('/api/user/{0}'.format(userA_id), headers=make_headers(userA_api_key))
+        self.assertEqual(rv.status_code, 200)
+        # A tampered key is rejected.
+        tampered_key = 'A' + userA_api_key[1:]
+        rv = self.app.get('/api/user/{0}'.format(userA_id), headers=make_headers(tampered_key))
+        self.assertEqual(rv.status_code, 401)
+        # Keys stored as secrets still work.
+        config.API_KEY_MODE = 'SECRET'
+        headers = make_headers(email=sample_userA['email'], password=sample_userA['password'])
+        rv = self.app.get('/api/requestapikey', headers=headers)
+        self.assertEqual(rv.status_code, 200)
+        secret_api_key = json.loads(rv.data.decode('utf8'))['apiKey']
+        rv = self.app.get('/api/user/{0}'.format(userA_id), headers=make_headers(secret_api_key))
+        self.assertEqual(rv.status_code, 200)
+        # Changing the password revokes signed keys.
+        userA = store.session.query(User).filter(User.id == userA_id).first()
+        userA.set_password('anewpassword')
+        store.session.commit()
+        rv = self.app.get('/api/user/{0}'.format(userA_id), headers=make_headers(userA_api_key))
+        self.assertEqual(rv.status_code, 401)
+
     def test_password_reset(self):
         # Signup userA
         userA_id, userA_api_key, userA_email_key = self.sign_up(sample_userA)
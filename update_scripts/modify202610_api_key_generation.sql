@@ -0,0 +1,2 @@
+alter table "user"
+      add column api_key_generation integer not null default 0;
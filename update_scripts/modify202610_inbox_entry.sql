@@ -0,0 +1,35 @@
+-- Unread counters and latest messages of each user's conversations, as
+-- maintained by community_share.models.conversation.update_inbox_entries.
+create table inbox_entry (
+    conversation_id integer not null references conversation (id),
+    user_id integer not null references "user" (id),
+    other_user_id integer not null references "user" (id),
+    unread_count integer not null,
+    last_message_id integer references message (id),
+    last_activity timestamp without time zone not null,
+    primary key (conversation_id, user_id)
+);
+insert into inbox_entry
+    (conversation_id, user_id, other_user_id, unread_count, last_message_id, last_activity)
+select
+    conversation.id,
+    participant.user_id,
+    participant.other_user_id,
+    (
+        select count(*) from message
+        where message.conversation_id = conversation.id
+        and not message.viewed
+        and message.sender_user_id != participant.user_id
+    ),
+    (select max(message.id) from message where message.conversation_id = conversation.id),
+    coalesce(
+        (select max(message.date_created) from message where message.conversation_id = conversation.id),
+        conversation.date_created
+    )
+from conversation
+cross join lateral (
+    values
+        (conversation."userA_id", conversation."userB_id"),
+        (conversation."userB_id", conversation."userA_id")
+) as participant (user_id, other_user_id);
+create index ix_inbox_entry_user_id_last_activity on inbox_entry (user_id, last_activity);
@@ -0,0 +1,28 @@
+-- Indexes for the filters used by list endpoints, search matching, reminders
+-- and statistics.  Built concurrently so the tables stay writable, which means
+-- this must not be run inside a transaction.
+create index concurrently if not exists ix_label_lower_name on label (lower(name));
+create index concurrently if not exists ix_user_date_created on "user" (date_created);
+create index concurrently if not exists ix_user_email_active on "user" (email) where active = true;
+create index concurrently if not exists ix_user_last_active_active on "user" (last_active) where active = true;
+create index concurrently if not exists ix_institution_association_user_id on institution_association (user_id);
+create index concurrently if not exists ix_search_roles_active on search (searcher_role, searching_for_role) where active = true;
+create index concurrently if not exists ix_search_searcher_user_id on search (searcher_user_id);
+create index concurrently if not exists ix_page_views_user_id on page_views (user_id);
+create index concurrently if not exists ix_page_views_viewed_at on page_views (viewed_at);
+create index concurrently if not exists ix_search_label_label_id on search_label (label_id);
+create index concurrently if not exists ix_search_label_search_id on search_label (search_id);
+create index concurrently if not exists ix_conversation_date_created on conversation (date_created);
+create index concurrently if not exists "ix_conversation_userA_id" on conversation ("userA_id");
+create index concurrently if not exists "ix_conversation_userB_id" on conversation ("userB_id");
+create index concurrently if not exists ix_share_community_partner_user_id_active on share (community_partner_user_id) where active = true;
+create index concurrently if not exists ix_share_conversation_id_active on share (conversation_id) where active = true;
+create index concurrently if not exists ix_share_educator_user_id_active on share (educator_user_id) where active = true;
+create index concurrently if not exists ix_message_conversation_id_date_created on message (conversation_id, date_created);
+create index concurrently if not exists ix_message_unviewed on message (conversation_id) where viewed = false;
+create index concurrently if not exists ix_event_datetime_start on event (datetime_start);
+create index concurrently if not exists ix_event_datetime_stop on event (datetime_stop);
+create index concurrently if not exists ix_event_share_id on event (share_id);
+create index concurrently if not exists ix_eventreminder_event_id on eventreminder (event_id);
+create index concurrently if not exists ix_userreview_date_created on userreview (date_created);
+analyze;
@@ -0,0 +1,43 @@
+-- Labels are matched on a normalized name: whitespace collapsed and lower
+-- cased, as Label.normalize_name does.  Labels whose names only differed in
+-- case or whitespace are merged into the oldest of them.
+begin;
+
+alter table label add column normalized_name varchar(50);
+update label set normalized_name = lower(regexp_replace(btrim(name), '\s+', ' ', 'g'));
+
+create temporary table label_merge on commit drop as
+select label.id as label_id, canonical.id as canonical_id
+from label
+join (
+    select normalized_name, min(id) as id
+    from label
+    group by normalized_name
+    having count(*) > 1
+) canonical on canonical.normalized_name = label.normalized_name
+where label.id != canonical.id;
+
+-- The merged label stays active if any of its duplicates was.
+update label set active = true
+from label_merge
+join label duplicate on duplicate.id = label_merge.label_id
+where label.id = label_merge.canonical_id and coalesce(duplicate.active, true);
+
+update search_label set label_id = label_merge.canonical_id
+from label_merge
+where search_label.label_id = label_merge.label_id;
+
+-- A search that had several of the merged labels now has the same row twice.
+delete from search_label a
+using search_label b
+where a.ctid > b.ctid and a.search_id = b.search_id and a.label_id = b.label_id;
+
+delete from label where id in (select label_id from label_merge);
+
+alter table label alter column normalized_name set not null;
+alter table label add constraint label_normalized_name_key unique (normalized_name);
+drop index if exists ix_label_lower_name;
+
+commit;
+analyze label;
+analyze search_label;
@@ -0,0 +1,19 @@
+-- Outgoing emails, added by community_share.mail.OutboxMailer and sent by
+-- community_share.worker.dispatch_outbox.
+create table outbox_email (
+    id serial primary key,
+    idempotency_key varchar(32) not null unique,
+    from_address varchar not null,
+    to_address varchar not null,
+    subject varchar,
+    content varchar,
+    new_content varchar,
+    status varchar(10) not null,
+    attempts integer not null,
+    next_attempt_at timestamp without time zone not null,
+    claim varchar(32),
+    last_error varchar,
+    date_created timestamp without time zone not null,
+    date_sent timestamp without time zone
+);
+create index ix_outbox_email_status_next_attempt_at on outbox_email (status, next_attempt_at);
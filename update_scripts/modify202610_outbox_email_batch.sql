@@ -0,0 +1,3 @@
+-- Outbox emails added as one batch, sent together with recipient variables.
+alter table outbox_email add column batch_key varchar(32);
+alter table outbox_email add column recipient_variables varchar;
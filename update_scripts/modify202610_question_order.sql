@@ -0,0 +1,5 @@
+-- Questions are paged through in survey order, which needs a value to
+-- compare against on every row.
+update question set "order" = 0 where "order" is null;
+alter table question alter column "order" set default 0;
+alter table question alter column "order" set not null;
@@ -0,0 +1,12 @@
+-- Recommendations computed nightly by the worker.
+create table recommendation (
+    id serial primary key,
+    user_id integer not null references "user" (id),
+    searcher_role varchar(20) not null,
+    rank integer not null,
+    recommended_user_id integer not null references "user" (id),
+    score double precision not null,
+    active boolean not null default true,
+    date_created timestamp without time zone not null
+);
+create index ix_recommendation_user_id_rank on recommendation (user_id, rank);
@@ -0,0 +1,9 @@
+-- Grid cell of each search's location, computed as community_share.geo.grid_cell
+-- does.  The index is built concurrently, so this must not be run inside a
+-- transaction.
+alter table search add column grid_cell integer;
+update search
+set grid_cell = least(floor((latitude + 90) / 0.5)::integer, 359) * 720
+    + mod(floor((longitude + 180) / 0.5)::integer, 720)
+where latitude is not null and longitude is not null;
+create index concurrently if not exists ix_search_roles_grid_cell_active on search (searcher_role, searching_for_role, grid_cell) where active = true;
@@ -0,0 +1,18 @@
+-- Materialized matches of each search.  Every active search starts stale so
+-- the worker computes its matches; until then results are ranked live.
+begin;
+
+alter table search add column match_version integer not null default 1;
+alter table search add column matched_version integer not null default 0;
+create index ix_search_stale_matches on search (id) where active = true and match_version > matched_version;
+
+create table search_match (
+    search_id integer not null references search (id) on delete cascade,
+    rank integer not null,
+    matched_search_id integer not null references search (id) on delete cascade,
+    score integer not null,
+    primary key (search_id, rank)
+);
+create index ix_search_match_matched_search_id on search_match (matched_search_id);
+
+commit;
@@ -0,0 +1,4 @@
+-- Coordinates of each user's zipcode.  Fill them in for existing users with
+-- scripts/geocode_zipcodes.py.
+alter table "user" add column latitude double precision;
+alter table "user" add column longitude double precision;
@@ -0,0 +1,10 @@
+-- Trigram indexes for substring searches of users and institutions, and a
+-- full-text index over the users' names, emails and bios.  The expression
+-- must match community_share.models.user_search.USER_TSVECTOR.  The indexes
+-- are built concurrently, so this must not be run inside a transaction.
+create extension if not exists pg_trgm;
+create index concurrently if not exists ix_user_name_trgm on "user" using gin (name gin_trgm_ops);
+create index concurrently if not exists ix_user_email_trgm on "user" using gin (email gin_trgm_ops);
+create index concurrently if not exists ix_user_bio_trgm on "user" using gin (bio gin_trgm_ops);
+create index concurrently if not exists ix_institution_name_trgm on institution using gin (name gin_trgm_ops);
+create index concurrently if not exists ix_user_search_vector on "user" using gin (to_tsvector('simple', coalesce("user".name, '') || ' ' || coalesce("user".email, '') || ' ' || coalesce("user".bio, '')));